@@ -1,100 +1,942 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, firestore
-import bcrypt
-import jwt
-from datetime import datetime, timedelta
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import json
 import os
-from dotenv import load_dotenv
-import traceback
+import threading
+import time
 import logging
+import atexit
+import click
+
+import app_logging
+from app_logging import configure_logging, new_request_id, request_id_var, stop_logging
+from availability_stream import AvailabilityBroker, lot_delta, parse_tile, tile_topic
+from login_writer import LoginWriter
+from json_provider import FastJSONProvider, PrecomputedJSON, dumps_bytes
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, TimedProxy
+from occupancy_forecast import OccupancyForecaster
+from occupancy_history import DEFAULT_TIERS as HISTORY_DEFAULT_TIERS, OccupancyHistory
+from occupancy_ingest import EventIngestor, parse_timestamp
+from parking_index import GeoGridIndex, Lot
+from parking_store import FirestoreParkingRepository, ReservationConflict, SQLiteParkingRepository
+from password_hasher import HasherBusy, PasswordHasher
+from rate_limiter import MemoryBucketStore, RateLimiter, SQLiteBucketStore, parse_rate
+from request_profiler import RequestProfiler
+from reservations import ReservationEngine, ReservationStateError
+from revocation import RevocationFilter
+from token_keys import TokenKeyRing, generate_signing_key
+from user_cache import UserCache
+from user_store import EmailAlreadyRegistered, FirestoreUserRepository, SQLiteUserRepository
 
 # Google OAuth imports
-from google.auth.transport import requests
-from google.oauth2 import id_token
+from google_certs import GOOGLE_CERTS_URL, GoogleCertCache, HttpCertSource, decode_google_id_token
+
+# Load environment variables (python-dotenv is only imported when there is a .env to read)
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+if os.path.exists(ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
 
-# Load environment variables
-load_dotenv()
+# Logging goes through a queue to a background writer thread (see app_logging.py)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')  # Per-level keep rates, e.g. 'INFO=0.1,DEBUG=0.01'
+LOG_TRACEBACKS_PER_MINUTE = int(os.getenv('LOG_TRACEBACKS_PER_MINUTE', 10))  # Per exception type and call site
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # Records buffered before new ones are dropped
+configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING, LOG_TRACEBACKS_PER_MINUTE, LOG_QUEUE_SIZE)
+logger = logging.getLogger('smartparking')
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # orjson, datetimes serialized as ISO 8601
 CORS(app, origins=['*'])  # Allow all origins for development
-logging.basicConfig(level=logging.DEBUG)
 
 # Configuration
 JWT_SECRET = os.getenv('JWT_SECRET', 'smartparking-secret-key-change-this')
+JWT_KEYS_DIR = os.getenv('JWT_KEYS_DIR')  # PEM private keys named <kid>.pem; enables RS256/EdDSA tokens
+JWT_ACTIVE_KID = os.getenv('JWT_ACTIVE_KID')  # Key that signs new tokens, defaults to the last kid
+JWT_LEGACY_HS256 = os.getenv('JWT_LEGACY_HS256', 'true').lower() in ('1', 'true', 'yes')  # Accept old HS256 tokens
+JWKS_MAX_AGE = int(os.getenv('JWKS_MAX_AGE', 3600))  # Cache-Control max-age of /.well-known/jwks.json
+VERIFY_BATCH_MAX = int(os.getenv('VERIFY_BATCH_MAX', 100))  # Max tokens per /api/auth/verify/batch call
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')  # Add this to your .env file
+GOOGLE_CERTS_URL = os.getenv('GOOGLE_CERTS_URL', GOOGLE_CERTS_URL)  # Point at a local JWKS for offline testing
 PORT = int(os.getenv('PORT', 5000))
 DEBUG = os.getenv('FLASK_ENV') == 'development'
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))  # Seconds, 0 disables the cache
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', os.cpu_count() or 1))  # 0 hashes on the request thread
+BCRYPT_MAX_PENDING = int(os.getenv('BCRYPT_MAX_PENDING', 0)) or None  # Defaults to 4 per worker
+BCRYPT_QUEUE_TIMEOUT = float(os.getenv('BCRYPT_QUEUE_TIMEOUT', 0.05))  # Seconds to wait for a slot before 503
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+USER_STORE = os.getenv('USER_STORE', 'firestore')  # 'firestore' or 'sqlite'
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'smartparking.db')  # ':memory:' for a throwaway store
+LOGIN_FLUSH_INTERVAL = float(os.getenv('LOGIN_FLUSH_INTERVAL', 2))  # Seconds, 0 writes on every login
+LOGIN_FLUSH_MAX_BATCH = int(os.getenv('LOGIN_FLUSH_MAX_BATCH', 500))  # Users buffered before an early flush
+STATELESS_VERIFY = os.getenv('STATELESS_VERIFY', 'false').lower() in ('1', 'true', 'yes')  # Opt-in zero-I/O verify
+REVOCATION_SYNC_INTERVAL = float(os.getenv('REVOCATION_SYNC_INTERVAL', 30))  # Seconds between filter rebuilds
+PROFILE_SECRET = os.getenv('PROFILE_SECRET')  # Signs X-Profile / X-Debug-Token headers; unset disables them
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))  # Fraction of requests profiled without a header
+PROFILE_BUFFER_SIZE = int(os.getenv('PROFILE_BUFFER_SIZE', 50))  # Profiles kept for /debug/profiles
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 1))  # Stack sampling interval
+RATE_LIMIT_IP = os.getenv('RATE_LIMIT_IP', '30/60')  # 'count/seconds' of credential requests per client IP, '0' disables
+RATE_LIMIT_EMAIL = os.getenv('RATE_LIMIT_EMAIL', '5/60')  # 'count/seconds' of login attempts per email, '0' disables
+RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'memory')  # 'memory' (per worker) or 'sqlite' (per host)
+RATE_LIMIT_SQLITE_PATH = os.getenv('RATE_LIMIT_SQLITE_PATH', 'ratelimit.db')
+PROXY_FIX_HOPS = int(os.getenv('PROXY_FIX_HOPS', 0))  # Trusted proxies in front of the app (for the client IP)
+PARKING_CELL_SIZE = float(os.getenv('PARKING_CELL_SIZE', 0.01))  # Degrees per grid cell of the nearby index (~1.1 km)
+PARKING_RELOAD_MAX_DELAY = float(os.getenv('PARKING_RELOAD_MAX_DELAY', 60))  # Longest wait between retries of failed parking loads
+NEARBY_DEFAULT_RADIUS = float(os.getenv('NEARBY_DEFAULT_RADIUS', 1000))  # Metres
+NEARBY_MAX_RADIUS = float(os.getenv('NEARBY_MAX_RADIUS', 20000))  # Metres
+NEARBY_MAX_RESULTS = int(os.getenv('NEARBY_MAX_RESULTS', 50))
+PARKING_INGEST_TOKEN = os.getenv('PARKING_INGEST_TOKEN')  # Bearer token of sensor gateways; unset disables /api/parking/events
+PARKING_EVENT_WINDOW = float(os.getenv('PARKING_EVENT_WINDOW', 1))  # Seconds occupancy changes are coalesced before a batched write
+PARKING_EVENT_MAX_BATCH = int(os.getenv('PARKING_EVENT_MAX_BATCH', 2000))  # Changed spots/lots buffered before an early write
+PARKING_EVENT_MAX_LINE = int(os.getenv('PARKING_EVENT_MAX_LINE', 1024))  # Bytes per event line, longer ones are dropped
+PARKING_EVENT_MAX_SKEW = float(os.getenv('PARKING_EVENT_MAX_SKEW', 300))  # Seconds an event's ts may be ahead of ours
+PARKING_SYNC_INTERVAL = float(os.getenv('PARKING_SYNC_INTERVAL', 0))  # Seconds between re-reads of free counts other workers wrote, 0 = never
+INGEST_CHUNK_SIZE = 64 * 1024  # Bytes of the event stream read at a time
+STREAM_MAX_SUBSCRIBERS = int(os.getenv('STREAM_MAX_SUBSCRIBERS', 1000))  # Open /api/parking/stream connections per worker
+STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', 256))  # Lots with undelivered changes before a client is evicted
+STREAM_MAX_TOPICS = int(os.getenv('STREAM_MAX_TOPICS', 100))  # Lots + tiles per connection
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', 15))  # Seconds between keep-alive comments on idle streams
+STREAM_MAX_SECONDS = float(os.getenv('STREAM_MAX_SECONDS', 3600))  # Streams end after this, clients reconnect and re-authenticate
+STREAM_RETRY_MS = 3000  # Reconnect delay suggested to EventSource clients
+STREAM_TICKET_SECONDS = int(os.getenv('STREAM_TICKET_SECONDS', 60))  # Lifetime of a ?ticket= for /api/parking/stream
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}  # No proxy buffering of the stream
+HISTORY_TIERS = os.getenv('HISTORY_TIERS', HISTORY_DEFAULT_TIERS)  # 'seconds:slots,...' ring buffers, finest first
+HISTORY_PATH = os.getenv('HISTORY_PATH', 'occupancy-history.bin')  # Snapshot file, '' keeps history in memory only
+HISTORY_SNAPSHOT_INTERVAL = float(os.getenv('HISTORY_SNAPSHOT_INTERVAL', 300))  # Seconds between snapshots
+HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', 2000))  # Values per /api/parking/history response
+FORECAST_INTERVAL = float(os.getenv('FORECAST_INTERVAL', 900))  # Seconds between forecast recomputations
+FORECAST_HORIZON_HOURS = int(os.getenv('FORECAST_HORIZON_HOURS', 24))  # How far ahead eta may be
+FORECAST_TREND_HOURS = int(os.getenv('FORECAST_TREND_HOURS', 3))  # Recent samples compared against the weekly profile
+FORECAST_HALF_LIFE_HOURS = float(os.getenv('FORECAST_HALF_LIFE_HOURS', 2))  # How fast a deviation from the profile fades
+RESERVATION_HOLD_SECONDS = float(os.getenv('RESERVATION_HOLD_SECONDS', 600))  # Time to confirm (pay) before a hold expires
+RESERVATION_MAX_HOURS = float(os.getenv('RESERVATION_MAX_HOURS', 24))  # Longest reservation window
+RESERVATION_MAX_DAYS_AHEAD = float(os.getenv('RESERVATION_MAX_DAYS_AHEAD', 30))  # How far ahead a window may start
+RESERVATION_SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', 30))  # Seconds between expiry sweeps
+
+if PROXY_FIX_HOPS:
+    # Client IPs for rate limiting come from X-Forwarded-For set by our own proxies
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS, x_proto=PROXY_FIX_HOPS)
+
+# Latency histograms served by /metrics
+metrics_registry = MetricsRegistry()
+request_seconds = metrics_registry.histogram(
+    'smartparking_http_request_duration_seconds',
+    'HTTP request latency by route',
+    ('method', 'route', 'status')
+)
+dependency_seconds = metrics_registry.histogram(
+    'smartparking_dependency_duration_seconds',
+    'Latency of user store, bcrypt, Google token and JWT calls',
+    ('dependency', 'operation')
+)
 
-# Initialize Firebase
+# Set up by create_app(), so importing this module stays cheap (tests, CLI tools,
+# benchmarks) and Firebase is only initialized in processes that serve requests
 db = None
+user_store = None  # User storage used by all auth routes
+parking_store = None  # Parking lots, the source of the nearby index
+revocation_filter = None
+home_payload = None
+health_payload = None
+services_initialized = threading.Event()
+services_ready = threading.Event()  # Warm-up finished, /readyz answers 200
+parking_reload_stopped = threading.Event()
+startup_timings = {'initMs': None, 'warmUpMs': None, 'warmUpSteps': {}}
+_init_lock = threading.Lock()
+
+# Token signing keys (HS256 with JWT_SECRET unless JWT_KEYS_DIR holds asymmetric keys)
 try:
-    # Check if running in production or development
-    firebase_key_path = os.getenv('FIREBASE_KEY_PATH', 'firebase-key.json')
-    
-    if os.path.exists(firebase_key_path):
-        cred = credentials.Certificate(firebase_key_path)
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        print("✅ Firebase initialized successfully!")
-    else:
-        print("❌ Firebase key file not found. Please download firebase-key.json")
-        
+    token_keys = TokenKeyRing(JWT_SECRET, JWT_KEYS_DIR, JWT_ACTIVE_KID, accept_legacy_hs256=JWT_LEGACY_HS256)
 except Exception as e:
-    print(f"❌ Error initializing Firebase: {e}")
-    print("Please ensure firebase-key.json is in the project root")
+    logger.error(f"Error loading JWT signing keys from {JWT_KEYS_DIR}: {e}. Falling back to HS256 tokens signed with JWT_SECRET")
+    token_keys = TokenKeyRing(JWT_SECRET)
+token_keys = TimedProxy(token_keys, dependency_seconds, 'jwt', ('encode', 'decode'))
+
+# Recently read user documents, shared by verify() and get_profile()
+user_cache = UserCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# Google signing keys, cached for as long as Google's Cache-Control allows
+google_cert_cache = GoogleCertCache(HttpCertSource(GOOGLE_CERTS_URL))
+
+# bcrypt runs in a bounded process pool so it cannot starve the request threads
+password_hasher = TimedProxy(PasswordHasher(
+    workers=BCRYPT_WORKERS,
+    max_pending=BCRYPT_MAX_PENDING,
+    wait_timeout=BCRYPT_QUEUE_TIMEOUT,
+    rounds=BCRYPT_ROUNDS
+), dependency_seconds, 'bcrypt', ('hash', 'check', 'hash_async', 'check_async'))
+
+# lastLogin/loginCount updates are buffered and written in batches off the request path
+login_writer = LoginWriter(
+    None,  # The user store is attached by create_app()
+    flush_interval=LOGIN_FLUSH_INTERVAL,
+    max_batch=LOGIN_FLUSH_MAX_BATCH,
+    on_flushed=lambda user_ids: [user_cache.invalidate(user_id) for user_id in user_ids]
+)
+
+# Token buckets per client IP and per email in front of the credential checks
+rate_limiter = RateLimiter(
+    SQLiteBucketStore(RATE_LIMIT_SQLITE_PATH) if RATE_LIMIT_STORE == 'sqlite' else MemoryBucketStore(),
+    rules={'ip': parse_rate(RATE_LIMIT_IP), 'email': parse_rate(RATE_LIMIT_EMAIL)}
+)
+
+# Lots and free-spot counts in a lat/lng grid, loaded from parking_store during warm-up
+parking_index = GeoGridIndex(cell_size=PARKING_CELL_SIZE)
+
+# Per-lot occupancy samples in tiered ring buffers, sampled from parking_index
+occupancy_history = OccupancyHistory(
+    parking_index,
+    tiers=HISTORY_TIERS,
+    path=HISTORY_PATH or None,
+    snapshot_interval=HISTORY_SNAPSHOT_INTERVAL,
+    max_points=HISTORY_MAX_POINTS
+)
+
+# Weekly profile plus recent trend per lot, recomputed from occupancy_history on a schedule
+occupancy_forecaster = OccupancyForecaster(
+    occupancy_history,
+    horizon_hours=FORECAST_HORIZON_HOURS,
+    trend_hours=FORECAST_TREND_HOURS,
+    half_life_hours=FORECAST_HALF_LIFE_HOURS,
+    interval=FORECAST_INTERVAL
+)
+
+# Availability changes pushed to /api/parking/stream clients subscribed to a lot or tile
+availability_broker = AvailabilityBroker(
+    max_subscribers=STREAM_MAX_SUBSCRIBERS,
+    max_buffer=STREAM_BUFFER_SIZE
+)
+
+# Sensor events update parking_index immediately and the parking store in coalesced batches
+event_ingestor = EventIngestor(
+    parking_index,
+    None,  # The parking store is attached by create_app()
+    window=PARKING_EVENT_WINDOW,
+    max_batch=PARKING_EVENT_MAX_BATCH,
+    max_line=PARKING_EVENT_MAX_LINE,
+    max_clock_skew=PARKING_EVENT_MAX_SKEW,
+    on_change=availability_broker.publish,
+    sync_interval=PARKING_SYNC_INTERVAL
+)
+
+# Spot reservations: per-spot schedules in memory, conditional writes to the parking store
+reservation_engine = ReservationEngine(
+    parking_index,
+    None,  # The parking store is attached by create_app()
+    hold_seconds=RESERVATION_HOLD_SECONDS,
+    max_duration=RESERVATION_MAX_HOURS * 3600,
+    max_advance=RESERVATION_MAX_DAYS_AHEAD * 86400,
+    sweep_interval=RESERVATION_SWEEP_INTERVAL
+)
+
+# Opt-in per-request stack profiles, served from /debug/profiles
+request_profiler = RequestProfiler(
+    secret=PROFILE_SECRET,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    buffer_size=PROFILE_BUFFER_SIZE,
+    interval=PROFILE_INTERVAL_MS / 1000
+)
+
+def init_firebase():
+    """Initialize the Firebase Admin SDK; returns a Firestore client, or None"""
+    try:
+        # Imported here: firebase_admin and the Firestore client take longer to
+        # import than the rest of the app together
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        # Check if running in production or development
+        firebase_key_path = os.getenv('FIREBASE_KEY_PATH', 'firebase-key.json')
+        
+        if os.path.exists(firebase_key_path):
+            cred = credentials.Certificate(firebase_key_path)
+            firebase_admin.initialize_app(cred)
+            client = firestore.client()
+            logger.info("Firebase initialized successfully")
+            return client
+
+        logger.error("Firebase key file not found. Please download firebase-key.json", extra={'path': firebase_key_path})
+            
+    except Exception as e:
+        logger.error(f"Error initializing Firebase: {e}. Please ensure firebase-key.json is in the project root")
+    return None
+
+def create_app(warm_up=True):
+    """Connect Firebase and the user store, then warm up in the background; returns the app"""
+    global db, user_store, parking_store, revocation_filter, home_payload, health_payload
+    with _init_lock:
+        if services_initialized.is_set():
+            return app
+
+        started = time.perf_counter()
+        if USER_STORE == 'firestore':
+            db = init_firebase()
+
+        store = lots = None
+        if USER_STORE == 'sqlite':
+            store = SQLiteUserRepository(SQLITE_PATH)
+            lots = SQLiteParkingRepository(SQLITE_PATH)
+            logger.info(f"SQLite user store ready: {SQLITE_PATH}")
+        elif db:
+            store = FirestoreUserRepository(db)
+            lots = FirestoreParkingRepository(db)
+        if store:
+            user_store = TimedProxy(store, dependency_seconds, store.name, (
+                'get', 'get_many', 'find_by_email', 'create', 'update', 'record_logins', 'revoked_users'
+            ))
+            parking_store = TimedProxy(lots, dependency_seconds, lots.name, (
+                'all_lots', 'put_lots', 'update_free', 'all_spots', 'put_spots',
+                'active_reservations', 'create_reservation', 'transition_reservation', 'expire_reservations'
+            ))
+        login_writer.user_store = user_store
+        event_ingestor.parking_store = parking_store
+        reservation_engine.parking_store = parking_store
+
+        # Stateless verify: token claims are trusted unless this filter says the user may be revoked
+        if STATELESS_VERIFY and user_store:
+            revocation_filter = RevocationFilter(user_store, sync_interval=REVOCATION_SYNC_INTERVAL)
+
+        home_payload, health_payload = static_payloads()
+        startup_timings['initMs'] = round((time.perf_counter() - started) * 1000, 1)
+        services_initialized.set()
+
+    if warm_up:
+        threading.Thread(target=warm_up_services, name='warm-up', daemon=True).start()
+    else:
+        services_ready.set()
+    return app
+
+def warm_up_services():
+    """Pay first-request costs (bcrypt workers, token signing, Google keys, ...), then report ready"""
+    steps = [('passwordHasher', password_hasher.warm_up), ('tokenKeys', warm_up_token_keys)]
+    if parking_store:
+        steps.append(('parkingIndex', load_parking_index))
+        steps.append(('spotStates', load_spot_states))
+        steps.append(('occupancyHistory', start_occupancy_history))
+        steps.append(('occupancyForecast', start_occupancy_forecast))
+        steps.append(('reservations', load_reservations))
+    if GOOGLE_CLIENT_ID:
+        steps.append(('googleCerts', google_cert_cache.prefetch))
+    if revocation_filter:
+        steps.append(('revocationFilter', revocation_filter.sync))
+
+    started = time.perf_counter()
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            # Not a reason to withhold traffic: parking loads are retried below, the rest on first use
+            logger.warning(f"Warm-up step {name} failed: {e}")
+        startup_timings['warmUpSteps'][name] = round((time.perf_counter() - step_started) * 1000, 1)
+    startup_timings['warmUpMs'] = round((time.perf_counter() - started) * 1000, 1)
+    services_ready.set()
+    logger.info("Warm-up finished", extra={'startup': startup_timings})
+
+    if parking_store and not parking_data_loaded():
+        threading.Thread(target=retry_parking_loads, name='parking-reload', daemon=True).start()
+
+def warm_up_token_keys():
+    """Sign and verify a throwaway token, which imports PyJWT and cryptography"""
+    now = datetime.utcnow()
+    decode_token(token_keys.encode({'user_id': 'warm-up', 'iat': now, 'exp': now + timedelta(seconds=60)}))
+
+def load_parking_index(attempts=3):
+    """Build the nearby index from the parking store; returns the number of lots"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return parking_index.load(parking_store.all_lots())
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"Loading parking lots failed (attempt {attempt}), retrying: {e}")
+            time.sleep(attempt)
+
+def load_spot_states():
+    """Restore per-spot sensor states after the index is loaded, then start syncing free counts; returns the number of spots"""
+    if not parking_index.loaded:
+        # The free counts they imply would be applied to an empty index
+        raise RuntimeError('Parking lots are not loaded')
+    try:
+        return event_ingestor.load(parking_store.all_spots())
+    finally:
+        event_ingestor.start()
+
+def start_occupancy_history():
+    """Restore the history snapshot, then start sampling; returns the number of lots restored"""
+    try:
+        restored = occupancy_history.restore()
+    finally:
+        occupancy_history.start()
+    return restored
+
+def start_occupancy_forecast():
+    """First forecast from the restored history, then recompute on a schedule; returns the number of lots"""
+    try:
+        return occupancy_forecaster.compute()
+    finally:
+        occupancy_forecaster.start()
+
+def load_reservations():
+    """Load active reservations into the per-spot schedules and start expiring holds; returns the number loaded"""
+    try:
+        return reservation_engine.load(parking_store.active_reservations())
+    finally:
+        reservation_engine.start()
+
+def parking_data_loaded():
+    """True once the lots, spot states and reservations are all in memory"""
+    return parking_index.loaded and event_ingestor.loaded and reservation_engine.loaded
+
+def retry_parking_loads():
+    """Retry the parking loads that failed during warm-up, with exponential backoff, until all succeed"""
+    delay = 1.0
+    while not parking_reload_stopped.wait(delay):
+        # In dependency order: spot states need the lots, so a failure waits for the next round
+        for name, component, load in (('parkingIndex', parking_index, lambda: load_parking_index(attempts=1)),
+                                      ('spotStates', event_ingestor, load_spot_states),
+                                      ('reservations', reservation_engine, load_reservations)):
+            if component.loaded:
+                continue
+            try:
+                load()
+                logger.info(f"Parking load {name} succeeded on retry")
+            except Exception as e:
+                logger.warning(f"Parking load {name} failed, retrying in up to {PARKING_RELOAD_MAX_DELAY:g}s: {e}")
+                break
+        if parking_data_loaded():
+            return
+        delay = min(delay * 2, PARKING_RELOAD_MAX_DELAY)
+
+def readiness(component=None):
+    """(body, status) for /readyz: 200 once create_app() has run and warmed up
+
+    Parking data is reported as its own component and only gates the status
+    when asked for (?component=parking): auth does not depend on it.
+    """
+    components = {'userStore': 'ready' if user_store else 'unavailable'}
+    if parking_store:
+        components['parking'] = 'ready' if parking_data_loaded() else 'loading'
+    if not services_ready.is_set():
+        return {'status': 'starting', 'components': components, 'startup': startup_timings}, 503
+    if not user_store:
+        return {'status': 'unavailable', 'error': 'User store not available',
+                'components': components, 'startup': startup_timings}, 503
+    if component == 'parking' and components.get('parking') != 'ready':
+        return {'status': 'unavailable', 'error': 'Parking data not loaded',
+                'components': components, 'startup': startup_timings}, 503
+    return {'status': 'ready', 'components': components, 'startup': startup_timings}, 200
+
+def shutdown():
+    """Release background resources (process exit, server worker exit)"""
+    if revocation_filter:
+        revocation_filter.stop()
+    parking_reload_stopped.set()
+    login_writer.stop()
+    event_ingestor.stop()
+    availability_broker.close_all()
+    occupancy_history.stop()
+    occupancy_forecaster.stop()
+    reservation_engine.stop()
+    password_hasher.shutdown()
+    stop_logging()
+
+atexit.register(shutdown)
 
 # Helper Functions
-def generate_token(user_id):
+def generate_token(user_id, user_data=None):
     """Generate JWT token for user"""
     payload = {
         'user_id': user_id,
         'iat': datetime.utcnow(),
         'exp': datetime.utcnow() + timedelta(days=7)  # Token expires in 7 days
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
+    if user_data is not None:
+        # Authorization claims, so verification can skip the user read
+        payload['active'] = user_data.get('isActive', True)
+        payload['tv'] = user_data.get('tokenVersion', 0)
+    return token_keys.encode(payload)
+
+def generate_stream_ticket(user_id):
+    """Short-lived token that only opens /api/parking/stream (sent as ?ticket=, so it ends up in access logs)"""
+    now = datetime.utcnow()
+    return token_keys.encode({
+        'user_id': user_id,
+        'purpose': 'stream',
+        'iat': now,
+        'exp': now + timedelta(seconds=STREAM_TICKET_SECONDS)
+    })
+
+def decode_token(token, purpose=None):
+    """Verify JWT token and return its claims; `purpose` must match the token's (None for bearer tokens)"""
+    import jwt  # Imported by warm_up_services() already, see token_keys.py
 
-def verify_token(token):
-    """Verify JWT token and return user_id"""
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-        return payload['user_id']
+        payload = token_keys.decode(token)
     except jwt.ExpiredSignatureError:
-        print("Token expired")
+        logger.debug("Token expired")
         return None
     except jwt.InvalidTokenError as e:
-        print(f"Invalid token: {e}")
+        logger.debug(f"Invalid token: {e}")
+        return None
+    if payload.get('purpose') != purpose:
+        logger.debug(f"Token for {payload.get('purpose') or 'bearer auth'} used for {purpose or 'bearer auth'}")
         return None
+    return payload
+
+def verify_token(token, purpose=None):
+    """Verify JWT token and return user_id"""
+    payload = decode_token(token, purpose)
+    return payload['user_id'] if payload else None
+
+def token_revoked(payload, user_data):
+    """True if the user's tokens were revoked after this one was issued"""
+    return payload.get('tv', 0) < user_data.get('tokenVersion', 0)
+
+def trusted_token_claims(payload):
+    """True if claims alone authorize the token (stateless verify, no store read)"""
+    return (revocation_filter is not None
+            and payload.get('active') is True
+            and 'tv' in payload
+            and not revocation_filter.might_be_revoked(payload['user_id']))
+
+def verify_user_response(user_id, user_data):
+    """User payload returned by /api/auth/verify (without password)"""
+    if user_data is None:
+        # Stateless verify without a cached document: the id is all we know
+        return {'id': user_id}
+    return {
+        'id': user_id,
+        'fullName': user_data['fullName'],
+        'email': user_data['email'],
+        'phoneNumber': user_data['phoneNumber'],
+        'createdAt': user_data.get('createdAt'),
+        'lastLogin': user_data.get('lastLogin'),
+        'loginCount': user_data.get('loginCount', 0)
+    }
+
+# Bump when the /api/auth/profile response shape changes, so clients refetch
+PROFILE_ETAG_VERSION = 1
+
+def profile_etag(user_id, user_data):
+    """Strong ETag for a profile: changes whenever the stored document does"""
+    # Every write path sets updatedAt; a 'version' counter takes precedence if a document has one
+    version = user_data.get('version') or user_data.get('updatedAt')
+    if version is None:
+        # Documents written before updatedAt existed: the fields the profile shows
+        version = (user_data.get('fullName'), user_data.get('email'), user_data.get('phoneNumber'),
+                   user_data.get('lastLogin'), user_data.get('loginCount'))
+    key = f"{PROFILE_ETAG_VERSION}:{user_id}:{version}:{user_data.get('isActive', True)}"
+    return '"' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:32] + '"'
+
+def profile_not_modified(if_none_match, etag):
+    """True when the client's If-None-Match already covers this ETag"""
+    return bool(if_none_match) and if_none_match.contains_weak(etag.strip('"'))
+
+def get_user_data(user_id):
+    """Get user document as dict (cached), or None if it does not exist"""
+    user_data = user_cache.get(user_id)
+    if user_data is not None:
+        return user_data
+
+    user_data = user_store.get(user_id)
+    if user_data is None:
+        return None
+
+    user_cache.set(user_id, user_data)
+    return user_data
+
+def get_many_user_data(user_ids):
+    """Get several user documents: cached ones first, the rest in one multi-document read"""
+    users = {}
+    missing = []
+    for user_id in user_ids:
+        user_data = user_cache.get(user_id)
+        if user_data is None:
+            missing.append(user_id)
+        else:
+            users[user_id] = user_data
+
+    if missing:
+        for user_id, user_data in user_store.get_many(missing).items():
+            user_cache.set(user_id, user_data)
+            users[user_id] = user_data
+    return users
+
+def parse_verify_batch(data):
+    """Validate a batch verify body; returns (tokens, error message)"""
+    tokens = data.get('tokens') if isinstance(data, dict) else None
+    if not isinstance(tokens, list) or not tokens:
+        return None, 'tokens must be a non-empty list'
+    if len(tokens) > VERIFY_BATCH_MAX:
+        return None, f'At most {VERIFY_BATCH_MAX} tokens per batch'
+    if not all(isinstance(token, str) for token in tokens):
+        return None, 'Every token must be a string'
+    return tokens, None
+
+def users_to_fetch(payloads):
+    """User ids a batch must read (tokens not answered from their claims alone)"""
+    user_ids = []
+    for payload in payloads:
+        if payload and not trusted_token_claims(payload) and payload['user_id'] not in user_ids:
+            user_ids.append(payload['user_id'])
+    return user_ids
+
+def verify_batch_results(payloads, users):
+    """Per-token verify results, in request order, shaped like /api/auth/verify"""
+    results = []
+    for payload in payloads:
+        if not payload:
+            results.append({'success': False, 'error': 'Invalid or expired token'})
+            continue
+
+        user_id = payload['user_id']
+        if user_id not in users and trusted_token_claims(payload):
+            results.append({'success': True, 'user': verify_user_response(user_id, user_cache.get(user_id))})
+            continue
+
+        user_data = users.get(user_id)
+        if user_data is None:
+            results.append({'success': False, 'error': 'User not found'})
+        elif not user_data.get('isActive', True):
+            results.append({'success': False, 'error': 'Account has been deactivated'})
+        elif token_revoked(payload, user_data):
+            results.append({'success': False, 'error': 'Token has been revoked'})
+        else:
+            results.append({'success': True, 'user': verify_user_response(user_id, user_data)})
+    return results
+
+def parse_nearby_query(args):
+    """Validate /api/parking/nearby query parameters; returns (query, error message)"""
+    try:
+        lat = float(args['lat'])
+        lng = float(args['lng'])
+        radius = float(args.get('radius', NEARBY_DEFAULT_RADIUS))
+        limit = int(args.get('limit', 20))
+        min_free = int(args.get('minFree', 1))
+    except KeyError:
+        return None, 'lat and lng are required'
+    except ValueError:
+        return None, 'lat, lng, radius, limit and minFree must be numbers'
+
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, 'lat/lng out of range'
+    if not 0 < radius <= NEARBY_MAX_RADIUS:
+        return None, f'radius must be between 0 and {NEARBY_MAX_RADIUS:g} metres'
+    if not 1 <= limit <= NEARBY_MAX_RESULTS:
+        return None, f'limit must be between 1 and {NEARBY_MAX_RESULTS}'
+    if min_free < 0:
+        return None, 'minFree must not be negative'
+    return {'lat': lat, 'lng': lng, 'radius': radius, 'limit': limit, 'min_free': min_free}, None
+
+def nearby_lots(query):
+    """Lots for a parsed nearby query, nearest first, shaped for the API"""
+    return [lot.to_dict(distance) for distance, lot in parking_index.nearby(**query)]
+
+def ingest_auth_error(authorization):
+    """(error message, status) unless the Authorization header carries PARKING_INGEST_TOKEN"""
+    if not PARKING_INGEST_TOKEN:
+        return 'Event ingestion is not enabled', 403
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), PARKING_INGEST_TOKEN.encode()):
+        return 'Invalid ingest token', 401
+    return None
+
+def ingest_unavailable():
+    """Error message while events cannot be applied yet, or None"""
+    if not parking_store:
+        return 'Parking store not available'
+    if not parking_index.loaded or not event_ingestor.loaded:
+        return 'Parking data is still loading, please try again shortly'
+    return None
+
+def stream_user(headers, args):
+    """user_id from the Authorization header, or from a stream ticket in ?ticket= (EventSource cannot set headers)
+
+    Bearer tokens are not accepted in the query string: URLs end up in access and proxy logs.
+    """
+    auth_header = headers.get('Authorization') or ''
+    if auth_header.startswith('Bearer '):
+        return verify_token(auth_header.split(' ')[1])
+    return verify_token(args.get('ticket') or '', purpose='stream')
+
+def parse_stream_topics(args):
+    """Topics of a /api/parking/stream request (lot, tile, or lat/lng/radius); returns (topics, error message)"""
+    topics = [f'lot:{lot_id}' for value in args.getlist('lot') for lot_id in value.split(',') if lot_id]
+    try:
+        for value in args.getlist('tile'):
+            for tile in value.split(','):
+                topics.append(tile_topic(parse_tile(f'tile:{tile}')))
+    except ValueError:
+        return None, 'tile must be <row>:<col>'
+
+    if 'lat' in args or 'lng' in args:
+        try:
+            lat = float(args['lat'])
+            lng = float(args['lng'])
+            radius = float(args.get('radius', NEARBY_DEFAULT_RADIUS))
+        except (KeyError, ValueError):
+            return None, 'lat, lng and radius must be numbers'
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return None, 'lat/lng out of range'
+        if not 0 < radius <= NEARBY_MAX_RADIUS:
+            return None, f'radius must be between 0 and {NEARBY_MAX_RADIUS:g} metres'
+        row_min, col_min, row_max, col_max = parking_index.cell_range(lat, lng, radius)
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > STREAM_MAX_TOPICS:
+            return None, f'At most {STREAM_MAX_TOPICS} topics per stream, use a smaller radius'
+        topics.extend(
+            tile_topic((row, col)) for row in range(row_min, row_max + 1) for col in range(col_min, col_max + 1)
+        )
+
+    topics = list(dict.fromkeys(topics))
+    if not topics:
+        return None, 'Subscribe to at least one lot, tile, or lat/lng'
+    if len(topics) > STREAM_MAX_TOPICS:
+        return None, f'At most {STREAM_MAX_TOPICS} topics per stream'
+    return topics, None
+
+def stream_snapshot(topics):
+    """Current state of every lot covered by the topics"""
+    lots = {}
+    for topic in topics:
+        kind, _, key = topic.partition(':')
+        if kind == 'lot':
+            lot = parking_index.get(key)
+            if lot is not None:
+                lots[lot.id] = lot
+        else:
+            for lot in parking_index.lots_in_cell(parse_tile(topic)):
+                lots[lot.id] = lot
+    return {'topics': topics, 'lots': [lot_delta(lot) for lot in lots.values()]}
+
+def sse_message(event, data):
+    """One server-sent event with a JSON payload"""
+    return b'event: ' + event.encode() + b'\ndata: ' + dumps_bytes(data) + b'\n\n'
+
+def first_stream_message(snapshot):
+    return f'retry: {STREAM_RETRY_MS}\n'.encode() + sse_message('snapshot', snapshot)
+
+def next_stream_message(subscriber, woken, deadline):
+    """(bytes to send, whether the stream ends) after a wake-up or a heartbeat timeout"""
+    deltas = subscriber.drain()
+    message = sse_message('availability', deltas) if deltas else b''
+    reason = subscriber.closed or ('maxDuration' if time.monotonic() >= deadline else None)
+    if reason:
+        return message + sse_message('closed', {'reason': reason}), True
+    if not message and not woken:
+        message = b': keep-alive\n\n'
+    return message, False
+
+def availability_events(user_id, topics):
+    """Body of a sync /api/parking/stream response (one request thread per client)"""
+    # Subscribed only once the response is being sent, so a client that is gone
+    # before then leaves nothing behind. Subscribing before the snapshot is taken
+    # means no change falls in between.
+    wakeup = threading.Event()
+    subscriber = availability_broker.subscribe(user_id, topics, wakeup.set)
+    if subscriber is None:
+        yield sse_message('closed', {'reason': 'tooManyStreams'})
+        return
+
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    try:
+        yield first_stream_message(stream_snapshot(topics))
+        done = False
+        while not done:
+            woken = wakeup.wait(STREAM_HEARTBEAT)
+            wakeup.clear()
+            message, done = next_stream_message(subscriber, woken, deadline)
+            if message:
+                yield message
+    finally:
+        # Also runs when the client disconnects and the server closes the generator
+        availability_broker.unsubscribe(subscriber)
+
+def parse_epoch(value):
+    """Epoch seconds from a query parameter: epoch seconds or ISO 8601"""
+    try:
+        return float(value)
+    except ValueError:
+        return parse_timestamp(value, None).replace(tzinfo=timezone.utc).timestamp()
+
+def parse_history_query(args):
+    """Validate /api/parking/history query parameters; returns (query, error message)"""
+    lot_id = args.get('lot')
+    if not lot_id:
+        return None, 'lot is required'
+    try:
+        end = parse_epoch(args['to']) if 'to' in args else time.time()
+        start = parse_epoch(args['from']) if 'from' in args else end - 86400
+        resolution = int(args['resolution']) if 'resolution' in args else None
+    except (ValueError, OverflowError):
+        return None, 'from and to must be ISO 8601 or epoch seconds, resolution a number of seconds'
+    if end < start:
+        return None, 'from must not be after to'
+    return {'lot_id': lot_id, 'start': start, 'end': end, 'resolution': resolution}, None
+
+def history_response(query, aggregate=False):
+    """(body, status) of a history range or aggregate query"""
+    try:
+        if aggregate:
+            result = occupancy_history.aggregate(**query)
+        else:
+            result = occupancy_history.query(**query)
+    except KeyError:
+        return {'success': False, 'error': 'No history for this lot'}, 404
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    if result['start'] is not None:
+        result['start'] = datetime.utcfromtimestamp(result['start'])
+    return {'success': True, 'lot': query['lot_id'], **result}, 200
+
+def parse_forecast_query(args):
+    """Validate /api/parking/forecast query parameters; returns (lot_id, eta, error message)"""
+    lot_id = args.get('lot')
+    if not lot_id:
+        return None, None, 'lot is required'
+    try:
+        eta = parse_epoch(args['eta']) if 'eta' in args else time.time()
+    except (ValueError, OverflowError):
+        return None, None, 'eta must be ISO 8601 or epoch seconds'
+    return lot_id, eta, None
+
+def forecast_response(lot_id, eta):
+    """(body, status) of the expected occupancy of a lot at eta"""
+    try:
+        forecast = occupancy_forecaster.lookup(lot_id, eta)
+    except KeyError:
+        return {'success': False, 'error': 'No history for this lot'}, 404
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    if forecast is None:
+        return {'success': False, 'error': 'Forecasts not computed yet'}, 503
+    if forecast['occupancy'] is None:
+        return {'success': False, 'error': 'No history for this lot'}, 404
+
+    occupancy = round(forecast['occupancy'], 3)
+    lot = parking_index.get(lot_id)
+    capacity = lot.capacity if lot else None
+    return {
+        'success': True,
+        'lot': lot_id,
+        'eta': datetime.utcfromtimestamp(eta),
+        'occupancy': occupancy,
+        'expectedFree': round(capacity * (1 - occupancy)) if capacity is not None else None,
+        'capacity': capacity,
+        'computedAt': datetime.utcfromtimestamp(forecast['computedAt'])
+    }, 200
+
+def bearer_user(headers):
+    """(user_id, error message) from the Bearer token in the Authorization header"""
+    auth_header = headers.get('Authorization') or ''
+    if not auth_header.startswith('Bearer '):
+        return None, 'Authorization header is required (Bearer token)'
+    user_id = verify_token(auth_header.split(' ')[1])
+    if not user_id:
+        return None, 'Invalid or expired token'
+    return user_id, None
+
+def reservations_unavailable():
+    """Error message while reservations cannot be made yet, or None"""
+    if not parking_store:
+        return 'Parking store not available'
+    if not parking_index.loaded or not reservation_engine.loaded:
+        return 'Reservations are still loading, please try again shortly'
+    return None
+
+def parse_reservation_request(data):
+    """Validate a POST /api/reservations body; returns (fields, error message)"""
+    if not isinstance(data, dict):
+        return None, 'A JSON body is required'
+    lot_id = data.get('lot')
+    if not lot_id or not isinstance(lot_id, str):
+        return None, 'lot is required'
+    spot_id = data.get('spot')
+    if spot_id is not None and not isinstance(spot_id, (str, int)):
+        return None, 'spot must be a spot number'
+    if data.get('start') is None or data.get('end') is None:
+        return None, 'start and end are required'
+    try:
+        start, end = parse_epoch(data['start']), parse_epoch(data['end'])
+    except (TypeError, ValueError, OverflowError):
+        return None, 'start and end must be ISO 8601 or epoch seconds'
+    return {'lot_id': lot_id, 'spot_id': None if spot_id is None else str(spot_id), 'start': start, 'end': end}, None
+
+def hold_response(user_id, fields):
+    """(body, status) of holding a spot for a window"""
+    try:
+        reservation = reservation_engine.hold(user_id, fields['lot_id'], fields['start'], fields['end'],
+                                              spot_id=fields['spot_id'])
+    except KeyError:
+        return {'success': False, 'error': 'Unknown lot or spot'}, 404
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    except ReservationConflict:
+        if fields['spot_id'] is None:
+            return {'success': False, 'error': 'No spot is free for this window'}, 409
+        return {'success': False, 'error': 'This spot is already booked for this window'}, 409
+    return {'success': True, 'reservation': reservation.to_dict()}, 201
+
+def reservation_response(action, reservation_id, user_id):
+    """(body, status) of reading ('get'), confirming or cancelling one of the user's reservations"""
+    try:
+        if action == 'confirm':
+            reservation = reservation_engine.confirm(reservation_id, user_id)
+        elif action == 'cancel':
+            reservation = reservation_engine.cancel(reservation_id, user_id)
+        else:
+            reservation = reservation_engine.get(reservation_id, user_id)
+    except KeyError:
+        return {'success': False, 'error': 'Reservation not found'}, 404
+    except ReservationStateError as e:
+        return {'success': False, 'error': str(e)}, 409
+    return {'success': True, 'reservation': reservation.to_dict()}, 200
 
 def validate_email(email):
     """Basic email validation"""
     return '@' in email and '.' in email and len(email) > 5
 
 def hash_password(password):
-    """Hash password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Hash password using bcrypt (raises HasherBusy when saturated)"""
+    return password_hasher.hash(password)
 
 def check_password(password, hashed):
-    """Check password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    """Check password against hash (raises HasherBusy when saturated)"""
+    return password_hasher.check(password, hashed)
 
+def rate_limited_response(retry_after):
+    """429 with the seconds until the client's next attempt is allowed"""
+    return jsonify({
+        'success': False,
+        'error': 'Too many attempts, please try again later'
+    }), 429, {'Retry-After': str(retry_after)}
+
+def hasher_busy_response():
+    """Fast 503 when the bcrypt pool is saturated"""
+    return jsonify({
+        'success': False,
+        'error': 'Server is busy, please try again shortly'
+    }), 503, {'Retry-After': '1'}
+
+@dependency_seconds.timer('google', 'verify_id_token')
 def verify_google_token(id_token_string):
     """Verify Google ID token and return user info"""
     try:
         if not GOOGLE_CLIENT_ID:
             raise ValueError("Google Client ID not configured")
         
-        # Verify the token
-        idinfo = id_token.verify_oauth2_token(
-            id_token_string, 
-            requests.Request(), 
+        # Verify the token (signature, audience, expiry and issuer)
+        idinfo = decode_google_id_token(
+            id_token_string,
+            google_cert_cache,
             GOOGLE_CLIENT_ID
         )
-        
-        # Validate issuer
-        if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
-            raise ValueError('Wrong issuer.')
             
         return {
             'google_id': idinfo['sub'],
@@ -105,52 +947,232 @@ def verify_google_token(id_token_string):
         }
         
     except Exception as e:
-        print(f"❌ Google token verification error: {e}")
+        logger.warning(f"Google token verification error: {e}")
         return None
 
-# Routes
-@app.route('/')
-def home():
-    """API home endpoint"""
-    return jsonify({
+@app.before_request
+def ensure_initialized():
+    # Servers that load app:app directly (flask run, gunicorn app:app) never
+    # call create_app(); the first request does. /livez answers meanwhile.
+    if not services_initialized.is_set() and request.path != '/livez':
+        create_app()
+
+@app.before_request
+def assign_request_id():
+    # Tags every log record of this request (app_logging.request_id_var)
+    new_request_id(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def return_request_id(response):
+    response.headers['X-Request-ID'] = request_id_var.get() or ''
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The route template, not the path, keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_seconds.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
+
+@app.before_request
+def start_profiling():
+    if request_profiler.enabled and not request.path.startswith('/debug/'):
+        trigger = request_profiler.trigger(request.headers.get('X-Profile'))
+        if trigger:
+            g.profile = (trigger, request_profiler.start())
+
+@app.after_request
+def finish_profiling(response):
+    profiling = g.pop('profile', None)
+    if profiling:
+        trigger, sampler = profiling
+        profile = request_profiler.finish(
+            sampler,
+            trigger=trigger,
+            method=request.method,
+            path=request.path,
+            route=request.url_rule.rule if request.url_rule else None,
+            status=response.status_code,
+            requestId=request_id_var.get()
+        )
+        response.headers['X-Profile-Id'] = str(profile['id'])
+    return response
+
+@app.teardown_request
+def stop_profiling(error=None):
+    # A request that died before after_request must not leave its sampler running
+    profiling = g.pop('profile', None)
+    if profiling:
+        profiling[1].stop()
+
+@app.teardown_request
+def clear_request_id(error=None):
+    # Server threads are reused; later logs on this thread belong to no request
+    request_id_var.set(None)
+
+def static_payloads():
+    """PrecomputedJSON bodies of / and /health (built by create_app)"""
+    # Load balancers and uptime checks hit / and /health constantly; everything
+    # but the timestamp and live stats is serialized once
+    home = PrecomputedJSON({
         'message': '🚗 SmartParking API is running!',
         'version': '1.0.0',
         'status': 'active',
-        'timestamp': datetime.utcnow().isoformat(),
         'firebase_status': 'connected' if db else 'disconnected',
+        'user_store': user_store.name if user_store else 'unavailable',
         'google_oauth': 'configured' if GOOGLE_CLIENT_ID else 'not configured',
         'endpoints': {
             'health': 'GET /',
+            'liveness': 'GET /livez',
+            'readiness': 'GET /readyz',
             'signup': 'POST /api/auth/signup',
             'login': 'POST /api/auth/login',
             'google_login': 'POST /api/auth/google',
             'verify': 'POST /api/auth/verify',
-            'profile': 'GET /api/auth/profile'
+            'verify_batch': 'POST /api/auth/verify/batch',
+            'profile': 'GET /api/auth/profile',
+            'parking_nearby': 'GET /api/parking/nearby',
+            'parking_events': 'POST /api/parking/events',
+            'parking_stream': 'GET /api/parking/stream',
+            'parking_stream_ticket': 'POST /api/parking/stream/ticket',
+            'parking_history': 'GET /api/parking/history',
+            'parking_history_aggregate': 'GET /api/parking/history/aggregate',
+            'parking_forecast': 'GET /api/parking/forecast',
+            'reservations': 'POST /api/reservations',
+            'reservation': 'GET|DELETE /api/reservations/<id>',
+            'reservation_confirm': 'POST /api/reservations/<id>/confirm',
+            'metrics': 'GET /metrics',
+            'jwks': 'GET /.well-known/jwks.json'
         }
     })
+    health = PrecomputedJSON({
+        'status': 'healthy',
+        'service': 'SmartParking API',
+        'firebase': 'connected' if db else 'disconnected',
+        'user_store': user_store.name if user_store else 'unavailable',
+        'google_oauth': 'configured' if GOOGLE_CLIENT_ID else 'not configured'
+    })
+    return home, health
+
+# Routes
+@app.route('/')
+def home():
+    """API home endpoint"""
+    return Response(home_payload.render(timestamp=datetime.utcnow()), mimetype='application/json')
 
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
+    return Response(health_payload.render(
+        timestamp=datetime.utcnow(),
+        user_cache=user_cache.stats(),
+        google_certs=google_cert_cache.stats(),
+        password_hasher=password_hasher.stats(),
+        login_writer=login_writer.stats(),
+        revocation_filter=revocation_filter.stats() if revocation_filter else 'disabled',
+        token_keys=token_keys.stats(),
+        logging=app_logging.stats(),
+        request_profiler=request_profiler.stats(),
+        rate_limiter=rate_limiter.stats(),
+        parking_index=parking_index.stats(),
+        event_ingest=event_ingestor.stats(),
+        availability_stream=availability_broker.stats(),
+        occupancy_history=occupancy_history.stats(),
+        occupancy_forecast=occupancy_forecaster.stats(),
+        reservations=reservation_engine.stats()
+    ), mimetype='application/json')
+
+@app.route('/livez')
+def liveness_check():
+    """Liveness probe: the process is up, whatever the state of its dependencies"""
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/readyz')
+def readiness_check():
+    """Readiness probe: 503 until Firebase/the user store are connected and warm-up has finished"""
+    body, status = readiness(request.args.get('component'))
+    return jsonify(body), status
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics (per process; scrape every worker)"""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+def debug_access_denied():
+    """Error response unless the request carries a valid admin debug token"""
+    if not PROFILE_SECRET:
+        return jsonify({
+            'success': False,
+            'error': 'Endpoint not found'
+        }), 404
+    if not request_profiler.check_token(request.headers.get('X-Debug-Token'), 'admin'):
+        return jsonify({
+            'success': False,
+            'error': 'Admin debug token required'
+        }), 403
+    return None
+
+@app.route('/debug/profiles')
+def list_profiles():
+    """Captured request profiles, newest first (admin only)"""
+    denied = debug_access_denied()
+    if denied:
+        return denied
+
     return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat(),
-        'service': 'SmartParking API',
-        'firebase': 'connected' if db else 'disconnected',
-        'google_oauth': 'configured' if GOOGLE_CLIENT_ID else 'not configured'
+        'success': True,
+        'profiler': request_profiler.stats(),
+        'profiles': request_profiler.list()
     }), 200
 
+@app.route('/debug/profiles/<int:profile_id>')
+def download_profile(profile_id):
+    """One profile as folded stacks, for flamegraph.pl / speedscope (admin only)"""
+    denied = debug_access_denied()
+    if denied:
+        return denied
+
+    folded = request_profiler.folded(profile_id)
+    if folded is None:
+        return jsonify({
+            'success': False,
+            'error': 'Profile not found'
+        }), 404
+    return Response(folded, content_type='text/plain; charset=utf-8', headers={
+        'Content-Disposition': f'attachment; filename="profile-{profile_id}.folded"'
+    })
+
+@app.route('/.well-known/jwks.json')
+def jwks():
+    """Public keys for verifying API tokens locally (JWKS)"""
+    return app.response_class(
+        token_keys.jwks_json,
+        mimetype='application/json',
+        headers={'Cache-Control': f'public, max-age={JWKS_MAX_AGE}'}
+    )
+
 # ✅ NEW: Google OAuth endpoint
 @app.route('/api/auth/google', methods=['POST'])
 def google_login():
     """Google OAuth login/signup endpoint"""
     try:
-        if not db:
+        if not user_store:
             return jsonify({
                 'success': False,
                 'error': 'Database connection not available'
             }), 500
 
+        # Rate limits are checked before any store read or password hash
+        retry_after = rate_limiter.check('ip', request.remote_addr)
+        if retry_after:
+            return rate_limited_response(retry_after)
+
         if not GOOGLE_CLIENT_ID:
             return jsonify({
                 'success': False,
@@ -186,34 +1208,22 @@ def google_login():
         profile_picture = google_user['picture']
         email_verified = google_user['email_verified']
         
-        print(f"🔐 Google login attempt for: {email}")
-        
-        # Check if user exists in Firebase
-        users_ref = db.collection('users')
+        logger.debug("Google login attempt", extra={'email': email})
         
-        # First check by email
-        existing_user_docs = users_ref.where('email', '==', email).limit(1).get()
+        # Check if user exists, by email
+        existing_user = user_store.find_by_email(email)
         
-        user_doc = None
         user_data = None
         user_id = None
         
-        if len(existing_user_docs) > 0:
+        if existing_user:
             # User exists, update Google info if needed
-            user_doc = existing_user_docs[0]
-            user_data = user_doc.to_dict()
-            user_id = user_doc.id
-            
-            print(f"📝 Existing user found: {email}")
+            user_id, user_data = existing_user
             
-            # Update Google-specific fields
-            update_data = {
-                'updatedAt': datetime.utcnow(),
-                'lastLogin': datetime.utcnow(),
-                'loginCount': user_data.get('loginCount', 0) + 1
-            }
+            logger.debug("Existing user found", extra={'email': email})
             
             # Add Google info if not present
+            update_data = {}
             if not user_data.get('googleId'):
                 update_data['googleId'] = google_id
             if not user_data.get('profilePicture'):
@@ -221,14 +1231,23 @@ def google_login():
             if 'emailVerified' not in user_data:
                 update_data['emailVerified'] = email_verified
                 
-            users_ref.document(user_id).update(update_data)
+            if update_data:
+                update_data['updatedAt'] = datetime.utcnow()
+                user_store.update(user_id, update_data)
+                user_cache.invalidate(user_id)
+            
+            # Last login and login count are written behind, in batches
+            last_login = datetime.utcnow()
+            queued_logins = login_writer.record(user_id, last_login)
             
             # Update local user_data for response
             user_data.update(update_data)
+            user_data['lastLogin'] = last_login
+            user_data['loginCount'] = user_data.get('loginCount', 0) + queued_logins
             
         else:
             # Create new user with Google info
-            print(f"👤 Creating new Google user: {email}")
+            logger.debug("Creating new Google user", extra={'email': email})
             
             user_data = {
                 'fullName': full_name,
@@ -246,12 +1265,22 @@ def google_login():
                 'authProvider': 'google'  # Track auth method
             }
             
-            # Add user to Firestore
-            doc_ref = users_ref.add(user_data)
-            user_id = doc_ref[1].id
+            # Add user to the store; a concurrent login may have just created it
+            try:
+                user_id = user_store.create(user_data)
+            except EmailAlreadyRegistered:
+                existing_user = user_store.find_by_email(email)
+                if existing_user is None:
+                    # Indexed, but the account is not readable (yet): let the client retry
+                    return jsonify({
+                        'success': False,
+                        'error': 'This email is being registered by another request, please try again'
+                    }), 409
+                user_id, user_data = existing_user
+            user_cache.invalidate(user_id)
         
         # Generate JWT token
-        token = generate_token(user_id)
+        token = generate_token(user_id, user_data)
         
         # Return user data (without password and sensitive info)
         user_response = {
@@ -261,12 +1290,12 @@ def google_login():
             'phoneNumber': user_data.get('phoneNumber', ''),
             'profilePicture': user_data.get('profilePicture', ''),
             'emailVerified': user_data.get('emailVerified', False),
-            'createdAt': user_data['createdAt'].isoformat(),
+            'createdAt': user_data['createdAt'],
             'loginCount': user_data['loginCount'],
             'authProvider': user_data.get('authProvider', 'google')
         }
         
-        print(f"✅ Google login successful: {email} (Login #{user_data['loginCount']})")
+        logger.info("Google login successful", extra={'email': email, 'loginCount': user_data['loginCount']})
         
         return jsonify({
             'success': True,
@@ -275,9 +1304,8 @@ def google_login():
             'token': token
         }), 200
         
-    except Exception as e:
-        print(f"❌ Google login error: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Google login error")
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -287,12 +1315,17 @@ def google_login():
 def signup():
     """User registration endpoint"""
     try:
-        if not db:
+        if not user_store:
             return jsonify({
                 'success': False,
                 'error': 'Database connection not available'
             }), 500
 
+        # Rate limits are checked before any store read or password hash
+        retry_after = rate_limiter.check('ip', request.remote_addr)
+        if retry_after:
+            return rate_limited_response(retry_after)
+
         data = request.get_json()
         
         if not data:
@@ -344,10 +1377,9 @@ def signup():
             }), 400
         
         # Check if user already exists
-        users_ref = db.collection('users')
-        existing_user = users_ref.where('email', '==', email).limit(1).get()
+        existing_user = user_store.find_by_email(email)
         
-        if len(existing_user) > 0:
+        if existing_user:
             return jsonify({
                 'success': False,
                 'error': 'Email is already registered'
@@ -369,12 +1401,18 @@ def signup():
             'loginCount': 0
         }
         
-        # Add user to Firestore
-        doc_ref = users_ref.add(user_data)
-        user_id = doc_ref[1].id
+        # Add user to the store (the email may have been taken since the check above)
+        try:
+            user_id = user_store.create(user_data)
+        except EmailAlreadyRegistered:
+            return jsonify({
+                'success': False,
+                'error': 'Email is already registered'
+            }), 400
+        user_cache.invalidate(user_id)
         
         # Generate JWT token
-        token = generate_token(user_id)
+        token = generate_token(user_id, user_data)
         
         # Return user data (without password)
         user_response = {
@@ -382,11 +1420,11 @@ def signup():
             'fullName': full_name,
             'email': email,
             'phoneNumber': phone_number,
-            'createdAt': user_data['createdAt'].isoformat(),
+            'createdAt': user_data['createdAt'],
             'loginCount': 0
         }
         
-        print(f"✅ New user registered: {email}")
+        logger.info("New user registered", extra={'email': email})
         
         return jsonify({
             'success': True,
@@ -395,9 +1433,10 @@ def signup():
             'token': token
         }), 201
         
-    except Exception as e:
-        print(f"❌ Signup error: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except HasherBusy:
+        return hasher_busy_response()
+    except Exception:
+        logger.exception("Signup error")
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -407,12 +1446,17 @@ def signup():
 def login():
     """User login endpoint"""
     try:
-        if not db:
+        if not user_store:
             return jsonify({
                 'success': False,
                 'error': 'Database connection not available'
             }), 500
 
+        # Rate limits are checked before any store read or password hash
+        retry_after = rate_limiter.check('ip', request.remote_addr)
+        if retry_after:
+            return rate_limited_response(retry_after)
+
         data = request.get_json()
         
         if not data:
@@ -437,19 +1481,20 @@ def login():
                 'error': 'Email and password cannot be empty'
             }), 400
         
+        retry_after = rate_limiter.check('email', email)
+        if retry_after:
+            return rate_limited_response(retry_after)
+        
         # Find user by email
-        users_ref = db.collection('users')
-        user_docs = users_ref.where('email', '==', email).limit(1).get()
+        existing_user = user_store.find_by_email(email)
         
-        if len(user_docs) == 0:
+        if not existing_user:
             return jsonify({
                 'success': False,
                 'error': 'Invalid email or password'
             }), 401
         
-        user_doc = user_docs[0]
-        user_data = user_doc.to_dict()
-        user_id = user_doc.id
+        user_id, user_data = existing_user
         
         # Verify password
         if not check_password(password, user_data['password']):
@@ -466,15 +1511,11 @@ def login():
             }), 401
         
         # Generate JWT token
-        token = generate_token(user_id)
+        token = generate_token(user_id, user_data)
         
-        # Update last login and login count
-        login_count = user_data.get('loginCount', 0) + 1
-        users_ref.document(user_id).update({
-            'lastLogin': datetime.utcnow(),
-            'updatedAt': datetime.utcnow(),
-            'loginCount': login_count
-        })
+        # Update last login and login count (written behind, in batches)
+        queued_logins = login_writer.record(user_id, datetime.utcnow())
+        login_count = user_data.get('loginCount', 0) + queued_logins
         
         # Return user data (without password)
         user_response = {
@@ -482,11 +1523,11 @@ def login():
             'fullName': user_data['fullName'],
             'email': user_data['email'],
             'phoneNumber': user_data['phoneNumber'],
-            'createdAt': user_data['createdAt'].isoformat() if 'createdAt' in user_data else None,
+            'createdAt': user_data.get('createdAt'),
             'loginCount': login_count
         }
         
-        print(f"✅ User logged in: {email} (Login #{login_count})")
+        logger.info("User logged in", extra={'email': email, 'loginCount': login_count})
         
         return jsonify({
             'success': True,
@@ -495,9 +1536,10 @@ def login():
             'token': token
         }), 200
         
-    except Exception as e:
-        print(f"❌ Login error: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except HasherBusy:
+        return hasher_busy_response()
+    except Exception:
+        logger.exception("Login error")
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -507,7 +1549,7 @@ def login():
 def verify():
     """Token verification endpoint"""
     try:
-        if not db:
+        if not user_store:
             return jsonify({
                 'success': False,
                 'error': 'Database connection not available'
@@ -522,25 +1564,33 @@ def verify():
             }), 400
         
         token = data['token']
-        user_id = verify_token(token)
+        payload = decode_token(token)
         
-        if not user_id:
+        if not payload:
             return jsonify({
                 'success': False,
                 'error': 'Invalid or expired token'
             }), 401
         
+        user_id = payload['user_id']
+        
+        # Stateless fast path: no store read unless the user may have been revoked
+        if trusted_token_claims(payload):
+            return jsonify({
+                'success': True,
+                'message': 'Token is valid',
+                'user': verify_user_response(user_id, user_cache.get(user_id))
+            }), 200
+        
         # Get user data
-        user_doc = db.collection('users').document(user_id).get()
+        user_data = get_user_data(user_id)
         
-        if not user_doc.exists:
+        if user_data is None:
             return jsonify({
                 'success': False,
                 'error': 'User not found'
             }), 404
         
-        user_data = user_doc.to_dict()
-        
         # Check if user is active
         if not user_data.get('isActive', True):
             return jsonify({
@@ -548,26 +1598,55 @@ def verify():
                 'error': 'Account has been deactivated'
             }), 401
         
-        # Return user data (without password)
-        user_response = {
-            'id': user_id,
-            'fullName': user_data['fullName'],
-            'email': user_data['email'],
-            'phoneNumber': user_data['phoneNumber'],
-            'createdAt': user_data['createdAt'].isoformat() if 'createdAt' in user_data else None,
-            'lastLogin': user_data['lastLogin'].isoformat() if user_data.get('lastLogin') else None,
-            'loginCount': user_data.get('loginCount', 0)
-        }
+        # Check if the user's tokens were revoked
+        if token_revoked(payload, user_data):
+            return jsonify({
+                'success': False,
+                'error': 'Token has been revoked'
+            }), 401
         
         return jsonify({
             'success': True,
             'message': 'Token is valid',
-            'user': user_response
+            'user': verify_user_response(user_id, user_data)
         }), 200
         
-    except Exception as e:
-        print(f"❌ Verify error: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Verify error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/auth/verify/batch', methods=['POST'])
+def verify_batch():
+    """Verify many tokens at once (gateways, background jobs)"""
+    try:
+        if not user_store:
+            return jsonify({
+                'success': False,
+                'error': 'Database connection not available'
+            }), 500
+
+        tokens, error = parse_verify_batch(request.get_json(silent=True))
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        payloads = [decode_token(token) for token in tokens]
+        
+        # Every referenced user in a single multi-document read
+        users = get_many_user_data(users_to_fetch(payloads))
+        
+        return jsonify({
+            'success': True,
+            'results': verify_batch_results(payloads, users)
+        }), 200
+        
+    except Exception:
+        logger.exception("Batch verify error")
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -577,7 +1656,7 @@ def verify():
 def get_profile():
     """Get user profile endpoint (requires authentication)"""
     try:
-        if not db:
+        if not user_store:
             return jsonify({
                 'success': False,
                 'error': 'Database connection not available'
@@ -602,15 +1681,19 @@ def get_profile():
             }), 401
         
         # Get user data
-        user_doc = db.collection('users').document(user_id).get()
+        user_data = get_user_data(user_id)
         
-        if not user_doc.exists:
+        if user_data is None:
             return jsonify({
                 'success': False,
                 'error': 'User not found'
             }), 404
         
-        user_data = user_doc.to_dict()
+        # Client's copy is current: no body to build, and with a cached document no store read
+        etag = profile_etag(user_id, user_data)
+        cache_headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if profile_not_modified(request.if_none_match, etag):
+            return '', 304, cache_headers
         
         # Return user data (without password)
         user_response = {
@@ -618,8 +1701,8 @@ def get_profile():
             'fullName': user_data['fullName'],
             'email': user_data['email'],
             'phoneNumber': user_data['phoneNumber'],
-            'createdAt': user_data['createdAt'].isoformat() if 'createdAt' in user_data else None,
-            'lastLogin': user_data['lastLogin'].isoformat() if user_data.get('lastLogin') else None,
+            'createdAt': user_data.get('createdAt'),
+            'lastLogin': user_data.get('lastLogin'),
             'loginCount': user_data.get('loginCount', 0),
             'isActive': user_data.get('isActive', True)
         }
@@ -628,16 +1711,379 @@ def get_profile():
             'success': True,
             'message': 'Profile retrieved successfully',
             'user': user_response
-        }), 200
+        }), 200, cache_headers
         
-    except Exception as e:
-        print(f"❌ Profile error: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Profile error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/parking/nearby', methods=['GET'])
+def parking_nearby():
+    """Lots with free spots near a point (lat, lng, radius in metres), nearest first"""
+    try:
+        query, error = parse_nearby_query(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        if not parking_index.loaded:
+            return jsonify({
+                'success': False,
+                'error': 'Parking data is still loading, please try again shortly'
+            }), 503, {'Retry-After': '1'}
+
+        # Answered from the in-memory grid index, no store read
+        lots = nearby_lots(query)
+
+        return jsonify({
+            'success': True,
+            'count': len(lots),
+            'lots': lots
+        }), 200
+
+    except Exception:
+        logger.exception("Nearby parking error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/parking/events', methods=['POST'])
+def parking_events():
+    """Occupancy sensor events as newline-delimited JSON, applied as the body streams in"""
+    try:
+        auth_error = ingest_auth_error(request.headers.get('Authorization'))
+        if auth_error:
+            error, status = auth_error
+            return jsonify({
+                'success': False,
+                'error': error
+            }), status
+
+        unavailable = ingest_unavailable()
+        if unavailable:
+            return jsonify({
+                'success': False,
+                'error': unavailable
+            }), 503, {'Retry-After': '1'}
+
+        # Read in chunks as the gateway sends them, never the whole body at once
+        session = event_ingestor.session()
+        for chunk in iter(lambda: request.stream.read(INGEST_CHUNK_SIZE), b''):
+            session.feed(chunk)
+
+        return jsonify({
+            'success': True,
+            **session.finish()
+        }), 200
+
+    except Exception:
+        logger.exception("Parking event ingest error")
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
+@app.route('/api/parking/stream/ticket', methods=['POST'])
+def parking_stream_ticket():
+    """Stream ticket for EventSource clients, which cannot send the Authorization header"""
+    try:
+        user_id, error = bearer_user(request.headers)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 401
+
+        return jsonify({
+            'success': True,
+            'ticket': generate_stream_ticket(user_id),
+            'expiresIn': STREAM_TICKET_SECONDS
+        }), 200
+
+    except Exception:
+        logger.exception("Stream ticket error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/parking/stream', methods=['GET'])
+def parking_stream():
+    """Server-sent events: a snapshot of the subscribed lots/tiles, then only their changes"""
+    try:
+        user_id = stream_user(request.headers, request.args)
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid or expired token or ticket'
+            }), 401
+
+        topics, error = parse_stream_topics(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        if not parking_index.loaded:
+            return jsonify({
+                'success': False,
+                'error': 'Parking data is still loading, please try again shortly'
+            }), 503, {'Retry-After': '1'}
+
+        if availability_broker.full():
+            return jsonify({
+                'success': False,
+                'error': 'Too many open streams, please try again later'
+            }), 503, {'Retry-After': '5'}
+
+        return Response(
+            availability_events(user_id, topics),
+            mimetype='text/event-stream',
+            headers=SSE_HEADERS
+        )
+
+    except Exception:
+        logger.exception("Parking stream error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/parking/history', methods=['GET'])
+def parking_history():
+    """Occupancy of a lot over time (0..1 per interval, null for gaps)"""
+    try:
+        query, error = parse_history_query(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        body, status = history_response(query)
+        return jsonify(body), status
+
+    except Exception:
+        logger.exception("Parking history error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/parking/history/aggregate', methods=['GET'])
+def parking_history_aggregate():
+    """Mean/min/max occupancy of a lot over a time range"""
+    try:
+        query, error = parse_history_query(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        body, status = history_response(query, aggregate=True)
+        return jsonify(body), status
+
+    except Exception:
+        logger.exception("Parking history aggregate error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/parking/forecast', methods=['GET'])
+def parking_forecast():
+    """Expected occupancy and free spots of a lot at an arrival time (eta)"""
+    try:
+        lot_id, eta, error = parse_forecast_query(request.args)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        body, status = forecast_response(lot_id, eta)
+        return jsonify(body), status
+
+    except Exception:
+        logger.exception("Parking forecast error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/reservations', methods=['POST'])
+def create_reservation():
+    """Hold a spot for a time window; the hold expires unless it is confirmed"""
+    try:
+        user_id, error = bearer_user(request.headers)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 401
+
+        fields, error = parse_reservation_request(request.get_json(silent=True))
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+
+        error = reservations_unavailable()
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 503, {'Retry-After': '1'}
+
+        body, status = hold_response(user_id, fields)
+        return jsonify(body), status
+
+    except Exception:
+        logger.exception("Create reservation error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/reservations/<reservation_id>', methods=['GET', 'DELETE'])
+def reservation_by_id(reservation_id):
+    """Read (GET) or cancel (DELETE) one of the user's reservations"""
+    try:
+        user_id, error = bearer_user(request.headers)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 401
+
+        action = 'cancel' if request.method == 'DELETE' else 'get'
+        body, status = reservation_response(action, reservation_id, user_id)
+        return jsonify(body), status
+
+    except Exception:
+        logger.exception("Reservation error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+@app.route('/api/reservations/<reservation_id>/confirm', methods=['POST'])
+def confirm_reservation(reservation_id):
+    """Confirm a hold (after payment) before it expires"""
+    try:
+        user_id, error = bearer_user(request.headers)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 401
+
+        body, status = reservation_response('confirm', reservation_id, user_id)
+        return jsonify(body), status
+
+    except Exception:
+        logger.exception("Confirm reservation error")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+# CLI commands
+@app.cli.command('backfill-email-index')
+def backfill_email_index():
+    """Index existing users by email (run once after upgrading)"""
+    create_app(warm_up=False)
+    if not user_store:
+        print("❌ User store not available")
+        return
+
+    counts = user_store.backfill_email_index()
+    if counts is None:
+        print(f"✅ Nothing to backfill, {user_store.name} enforces unique emails itself")
+        return
+
+    print(f"✅ Email index backfilled: {counts['scanned']} users scanned, "
+          f"{counts['created']} created, {counts['existing']} already indexed, "
+          f"{counts['stale']} stale entries removed")
+    if counts['duplicates']:
+        print(f"⚠️ {counts['duplicates']} duplicate emails need manual cleanup")
+
+@app.cli.command('import-lots')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_lots(path):
+    """Create or replace parking lots from a JSON list of {id, name, lat, lng, capacity, free}"""
+    create_app(warm_up=False)
+    if not parking_store:
+        print("❌ Parking store not available")
+        return
+
+    with open(path) as f:
+        entries = json.load(f)
+    lots = {}
+    for entry in entries:
+        lot = Lot(entry['id'], entry.get('name', ''), entry['lat'], entry['lng'], entry['capacity'], entry.get('free'))
+        lot.updated_at = datetime.utcnow()
+        lots[lot.id] = lot.to_document()
+    parking_store.put_lots(lots)
+    print(f"✅ {len(lots)} parking lots imported into {parking_store.name}")
+
+@app.cli.command('revoke-tokens')
+@click.argument('email')
+def revoke_tokens(email):
+    """Invalidate every token issued so far to a user"""
+    create_app(warm_up=False)
+    existing_user = user_store.find_by_email(email.lower().strip()) if user_store else None
+    if not existing_user:
+        print(f"❌ User not found: {email}")
+        return
+
+    user_id, user_data = existing_user
+    token_version = user_data.get('tokenVersion', 0) + 1
+    user_store.update(user_id, {'tokenVersion': token_version, 'updatedAt': datetime.utcnow()})
+    print(f"✅ Tokens revoked for {email} (token version {token_version})")
+    # Running workers learn about it from the store: their cached user documents
+    # expire after USER_CACHE_TTL, and their revocation filters are rebuilt every
+    # REVOCATION_SYNC_INTERVAL. Until then, they still accept the old tokens.
+    delay = max(USER_CACHE_TTL, REVOCATION_SYNC_INTERVAL if STATELESS_VERIFY else 0)
+    if delay:
+        print(f"   Running workers keep accepting them for up to {delay:g}s")
+
+@app.cli.command('generate-signing-key')
+@click.option('--kid', default=None, help='Key id, defaults to the current UTC time')
+@click.option('--type', 'key_type', type=click.Choice(['rsa', 'ed25519']), default='rsa')
+def generate_signing_key_command(kid, key_type):
+    """Add a token signing key to JWT_KEYS_DIR"""
+    if not JWT_KEYS_DIR:
+        print("❌ Set JWT_KEYS_DIR first")
+        return
+
+    kid = kid or datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    path = generate_signing_key(JWT_KEYS_DIR, kid, key_type)
+    print(f"✅ Signing key created: {path}")
+    print(f"   Publish it (deploy, wait {JWKS_MAX_AGE}s), then set JWT_ACTIVE_KID={kid}")
+
+@app.cli.command('debug-token')
+@click.option('--purpose', type=click.Choice(['profile', 'admin']), default='profile',
+              help='profile: X-Profile header, admin: X-Debug-Token for /debug/profiles')
+@click.option('--ttl', default=900, help='Seconds the token stays valid')
+def debug_token(purpose, ttl):
+    """Print a signed profiling or debug admin token"""
+    if not PROFILE_SECRET:
+        print("❌ Set PROFILE_SECRET first")
+        return
+
+    header = 'X-Profile' if purpose == 'profile' else 'X-Debug-Token'
+    print(f"{header}: {request_profiler.sign(purpose, ttl)}")
+
 # Error handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -661,11 +2107,13 @@ def internal_error(error):
     }), 500
 
 if __name__ == '__main__':
+    create_app()
     print(f"🚀 Starting SmartParking API")
     print(f"📍 Host: 0.0.0.0")
     print(f"🔌 Port: {PORT}")
     print(f"🔧 Debug: {DEBUG}")
     print(f"🔑 Firebase: {'Connected' if db else 'Not Connected'}")
+    print(f"🗄️ User store: {user_store.name if user_store else 'Unavailable'}")
     print(f"🌐 CORS: Enabled for all origins")
     print(f"🌍 Access URLs:")
     print(f"   - Local: http://localhost:{PORT}")
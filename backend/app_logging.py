@@ -0,0 +1,215 @@
+"""
+Non-blocking structured logging.
+
+Request threads never write to stdout themselves. configure_logging()
+installs a QueueHandler on the root logger: a log call renders its message,
+tags the record with the current request id and drops it on a bounded queue.
+A single background thread (QueueListener) serializes records as JSON lines
+and writes them. If the writer falls behind and the queue fills up, records
+are dropped and counted instead of blocking the request.
+
+Two filters keep the cost from scaling with traffic:
+
+- sampling: per-level keep rates, e.g. LOG_SAMPLING='INFO=0.1' keeps one
+  in ten success logs (WARNING and above are always kept unless configured)
+- traceback rate limit: at most N tracebacks per exception type and call
+  site per minute; further occurrences are logged without the traceback and
+  counted in `tracebacksSuppressed` on the next one that gets through
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# LogRecord attributes that are not user supplied `extra` fields
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id', 'tracebacks_suppressed'}
+
+_listener = None
+_queue_handler = None
+
+
+def new_request_id(incoming=None):
+    """Use the caller's X-Request-ID if it looks sane, otherwise make one; returns the id"""
+    if incoming and len(incoming) <= 128 and incoming.isprintable():
+        request_id = incoming
+    else:
+        request_id = uuid.uuid4().hex
+    request_id_var.set(request_id)
+    return request_id
+
+
+def parse_sampling(spec):
+    """'INFO=0.1,DEBUG=0' -> {logging.INFO: 0.1, logging.DEBUG: 0.0}"""
+    rates = {}
+    for part in filter(None, (part.strip() for part in (spec or '').split(','))):
+        level, _, rate = part.partition('=')
+        level_number = logging.getLevelName(level.strip().upper())
+        if not isinstance(level_number, int):
+            raise ValueError(f"Unknown log level in LOG_SAMPLING: '{level}'")
+        rates[level_number] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records of each configured level"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.sampled_out = 0
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class TracebackRateLimiter(logging.Filter):
+    """Strips tracebacks beyond `limit` per (exception type, call site) per interval"""
+
+    def __init__(self, limit=10, interval=60.0, clock=time.monotonic):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.clock = clock
+        self._windows = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if not record.exc_info or not record.exc_info[0]:
+            return True
+
+        key = (record.exc_info[0].__name__, record.pathname, record.lineno)
+        now = self.clock()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.interval:
+                started, count = now, 0
+            if count < self.limit:
+                self._windows[key] = (started, count + 1, 0)
+                if suppressed:
+                    record.tracebacks_suppressed = suppressed
+                return True
+            self._windows[key] = (started, count, suppressed + 1)
+            self.suppressed += 1
+
+        # Keep the log line, drop the expensive part
+        record.excType = record.exc_info[0].__name__
+        record.exc_info = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra` fields become top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['requestId'] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        suppressed = getattr(record, 'tracebacks_suppressed', 0)
+        if suppressed:
+            entry['tracebacksSuppressed'] = suppressed
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable lines for local development (LOG_FORMAT=text)"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s [%(request_id)s] %(name)s: %(message)s')
+
+    def format(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = '-'
+        return super().format(record)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only the cheap parts run on the request thread; formatting and the
+        # traceback rendering happen on the writer thread (same process, so
+        # exc_info can be handed over as is)
+        record.request_id = request_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level='INFO', fmt='json', sampling=None, tracebacks_per_minute=10, queue_size=10000, stream=None):
+    """Route all logging through a background writer thread (idempotent)"""
+    global _listener, _queue_handler
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(TextFormatter() if fmt == 'text' else JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(SamplingFilter(parse_sampling(sampling) if isinstance(sampling, str) else sampling or {}))
+    _queue_handler.addFilter(TracebackRateLimiter(limit=tracebacks_per_minute))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats():
+    if _queue_handler is None:
+        return None
+    sampling, tracebacks = _queue_handler.filters
+    return {
+        'queued': _queue_handler.queue.qsize(),
+        'dropped': _queue_handler.dropped,
+        'sampledOut': sampling.sampled_out,
+        'tracebacksSuppressed': tracebacks.suppressed
+    }
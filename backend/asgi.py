@@ -0,0 +1,971 @@
+"""
+Async serving mode for the SmartParking auth API.
+
+Same routes and responses as app.py, but handlers are coroutines running on
+one event loop: Firestore calls go through the async client, Google signing
+keys are fetched with httpx, and bcrypt is awaited from the worker pool.
+A single process can then keep thousands of I/O-bound auth requests in
+flight without a thread per request.
+
+Run it with an ASGI server, e.g.:
+
+    hypercorn asgi:app --bind 0.0.0.0:5000
+
+The sync Flask app (python app.py / gunicorn app:app) keeps working, so the
+two can be benchmarked side by side against the same store.
+"""
+
+from datetime import datetime
+import asyncio
+import logging
+import time
+
+from quart import Quart, g, request, jsonify, make_response
+from quart.json.provider import JSONProvider
+from quart_cors import cors
+
+import app as sync_app
+import app_logging
+from app_logging import new_request_id, request_id_var
+from app import (
+    GOOGLE_CLIENT_ID, GOOGLE_CERTS_URL, PORT, DEBUG, USER_STORE, PROXY_FIX_HOPS,
+    generate_token, decode_token, verify_token, validate_email, token_revoked, trusted_token_claims,
+    verify_user_response, profile_etag, profile_not_modified, parse_verify_batch, users_to_fetch, verify_batch_results,
+    readiness, parse_nearby_query, nearby_lots, parking_index,
+    event_ingestor, ingest_auth_error, ingest_unavailable,
+    availability_broker, stream_user, generate_stream_ticket, parse_stream_topics, stream_snapshot, sse_message,
+    first_stream_message, next_stream_message, SSE_HEADERS, STREAM_HEARTBEAT, STREAM_MAX_SECONDS,
+    STREAM_TICKET_SECONDS,
+    occupancy_history, parse_history_query, history_response,
+    occupancy_forecaster, parse_forecast_query, forecast_response,
+    reservation_engine, bearer_user, reservations_unavailable, parse_reservation_request, hold_response,
+    reservation_response,
+    user_cache, password_hasher, login_writer, rate_limiter,
+    metrics_registry, request_seconds, dependency_seconds
+)
+from json_provider import FastJSONMixin, PrecomputedJSON
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, TimedProxy
+from google_certs import AsyncHttpCertSource, GoogleCertCache, decode_google_id_token_async
+from password_hasher import HasherBusy
+from user_store import AsyncFirestoreUserRepository, EmailAlreadyRegistered, ThreadedAsyncUserRepository
+
+logger = logging.getLogger('smartparking.asgi')
+
+
+class FastJSONProvider(FastJSONMixin, JSONProvider):
+    """Quart JSON provider backed by orjson (see json_provider.py)"""
+
+
+app = Quart(__name__)
+app.json = FastJSONProvider(app)
+app = cors(app, allow_origin='*')  # Allow all origins for development
+
+if PROXY_FIX_HOPS:
+    # Same trusted-hops X-Forwarded-For/-Proto handling as the sync app's ProxyFix,
+    # so rate limits key on the client's IP instead of the load balancer's
+    from hypercorn.middleware import ProxyFixMiddleware
+    app.asgi_app = ProxyFixMiddleware(app.asgi_app, mode='legacy', trusted_hops=PROXY_FIX_HOPS)
+
+# Set up in before_serving so async clients bind to the server's event loop
+user_store = None
+google_cert_source = None
+google_cert_cache = None
+home_payload = None
+health_payload = None
+
+
+@app.before_serving
+async def startup():
+    global user_store, google_cert_source, google_cert_cache, home_payload, health_payload
+
+    # Firebase, the shared sync services and their warm-up (see app.create_app)
+    sync_app.create_app()
+
+    if USER_STORE == 'firestore' and sync_app.db:
+        from firebase_admin import firestore_async
+        user_store = TimedProxy(AsyncFirestoreUserRepository(firestore_async.client()), dependency_seconds, 'firestore', (
+            'get', 'get_many', 'find_by_email', 'create', 'update'
+        ))
+    elif sync_app.user_store:
+        # The wrapped sync store already times its calls
+        user_store = ThreadedAsyncUserRepository(sync_app.user_store)
+
+    google_cert_source = AsyncHttpCertSource(GOOGLE_CERTS_URL)
+    google_cert_cache = GoogleCertCache(google_cert_source)
+
+    # Everything but the timestamp and live stats is serialized once
+    home_payload = PrecomputedJSON({
+        'message': '🚗 SmartParking API is running!',
+        'version': '1.0.0',
+        'status': 'active',
+        'mode': 'async',
+        'firebase_status': 'connected' if sync_app.db else 'disconnected',
+        'user_store': user_store.name if user_store else 'unavailable',
+        'google_oauth': 'configured' if GOOGLE_CLIENT_ID else 'not configured',
+        'endpoints': {
+            'health': 'GET /',
+            'liveness': 'GET /livez',
+            'readiness': 'GET /readyz',
+            'signup': 'POST /api/auth/signup',
+            'login': 'POST /api/auth/login',
+            'google_login': 'POST /api/auth/google',
+            'verify': 'POST /api/auth/verify',
+            'verify_batch': 'POST /api/auth/verify/batch',
+            'profile': 'GET /api/auth/profile',
+            'parking_nearby': 'GET /api/parking/nearby',
+            'parking_events': 'POST /api/parking/events',
+            'parking_stream': 'GET /api/parking/stream',
+            'parking_stream_ticket': 'POST /api/parking/stream/ticket',
+            'parking_history': 'GET /api/parking/history',
+            'parking_history_aggregate': 'GET /api/parking/history/aggregate',
+            'parking_forecast': 'GET /api/parking/forecast',
+            'reservations': 'POST /api/reservations',
+            'reservation': 'GET|DELETE /api/reservations/<id>',
+            'reservation_confirm': 'POST /api/reservations/<id>/confirm',
+            'metrics': 'GET /metrics',
+            'jwks': 'GET /.well-known/jwks.json'
+        }
+    })
+    health_payload = PrecomputedJSON({
+        'status': 'healthy',
+        'mode': 'async',
+        'service': 'SmartParking API',
+        'firebase': 'connected' if sync_app.db else 'disconnected',
+        'user_store': user_store.name if user_store else 'unavailable',
+        'google_oauth': 'configured' if GOOGLE_CLIENT_ID else 'not configured'
+    })
+    logger.info(f"Async mode ready (user store: {user_store.name if user_store else 'unavailable'})")
+
+
+@app.after_serving
+async def shutdown():
+    # Ends open event streams, which would otherwise hold the server open
+    availability_broker.close_all()
+    if google_cert_source:
+        await google_cert_source.aclose()
+
+
+# Helper Functions
+async def get_user_data(user_id):
+    """Get user document as dict (cached), or None if it does not exist"""
+    user_data = user_cache.get(user_id)
+    if user_data is not None:
+        return user_data
+
+    user_data = await user_store.get(user_id)
+    if user_data is None:
+        return None
+
+    user_cache.set(user_id, user_data)
+    return user_data
+
+
+async def get_many_user_data(user_ids):
+    """Get several user documents: cached ones first, the rest in one multi-document read"""
+    users = {}
+    missing = []
+    for user_id in user_ids:
+        user_data = user_cache.get(user_id)
+        if user_data is None:
+            missing.append(user_id)
+        else:
+            users[user_id] = user_data
+
+    if missing:
+        for user_id, user_data in (await user_store.get_many(missing)).items():
+            user_cache.set(user_id, user_data)
+            users[user_id] = user_data
+    return users
+
+
+@dependency_seconds.timer('google', 'verify_id_token')
+async def verify_google_token(id_token_string):
+    """Verify Google ID token and return user info"""
+    try:
+        if not GOOGLE_CLIENT_ID:
+            raise ValueError("Google Client ID not configured")
+
+        idinfo = await decode_google_id_token_async(
+            id_token_string,
+            google_cert_cache,
+            GOOGLE_CLIENT_ID
+        )
+
+        return {
+            'google_id': idinfo['sub'],
+            'email': idinfo['email'],
+            'name': idinfo.get('name', ''),
+            'picture': idinfo.get('picture', ''),
+            'email_verified': idinfo.get('email_verified', False)
+        }
+
+    except Exception as e:
+        logger.warning(f"Google token verification error: {e}")
+        return None
+
+
+def error_response(error, status):
+    return jsonify({
+        'success': False,
+        'error': error
+    }), status
+
+
+def rate_limited_response(retry_after):
+    """429 with the seconds until the client's next attempt is allowed"""
+    return jsonify({
+        'success': False,
+        'error': 'Too many attempts, please try again later'
+    }), 429, {'Retry-After': str(retry_after)}
+
+
+def hasher_busy_response():
+    """Fast 503 when the bcrypt pool is saturated"""
+    return jsonify({
+        'success': False,
+        'error': 'Server is busy, please try again shortly'
+    }), 503, {'Retry-After': '1'}
+
+
+def internal_error_response(label):
+    # Called from an except block: logs the active exception
+    logger.exception(f"{label} error")
+    return error_response('Internal server error', 500)
+
+
+@app.before_request
+async def assign_request_id():
+    # Each request runs in its own task, so the context variable is per request
+    new_request_id(request.headers.get('X-Request-ID'))
+
+
+@app.after_request
+async def return_request_id(response):
+    response.headers['X-Request-ID'] = request_id_var.get() or ''
+    return response
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_seconds.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
+
+
+# Routes
+@app.route('/')
+async def home():
+    """API home endpoint"""
+    return app.response_class(home_payload.render(timestamp=datetime.utcnow()), mimetype='application/json')
+
+
+@app.route('/health')
+async def health_check():
+    """Health check endpoint"""
+    return app.response_class(health_payload.render(
+        timestamp=datetime.utcnow(),
+        user_cache=user_cache.stats(),
+        google_certs=google_cert_cache.stats(),
+        password_hasher=password_hasher.stats(),
+        login_writer=login_writer.stats(),
+        revocation_filter=sync_app.revocation_filter.stats() if sync_app.revocation_filter else 'disabled',
+        token_keys=sync_app.token_keys.stats(),
+        logging=app_logging.stats(),
+        rate_limiter=rate_limiter.stats(),
+        parking_index=parking_index.stats(),
+        event_ingest=event_ingestor.stats(),
+        availability_stream=availability_broker.stats(),
+        occupancy_history=occupancy_history.stats(),
+        occupancy_forecast=occupancy_forecaster.stats(),
+        reservations=reservation_engine.stats()
+    ), mimetype='application/json')
+
+
+@app.route('/livez')
+async def liveness_check():
+    """Liveness probe: the event loop is serving requests"""
+    return jsonify({'status': 'alive'}), 200
+
+
+@app.route('/readyz')
+async def readiness_check():
+    """Readiness probe: 503 until the shared services have warmed up"""
+    body, status = readiness(request.args.get('component'))
+    return jsonify(body), status
+
+
+@app.route('/metrics')
+async def metrics():
+    """Prometheus metrics (shared with the sync app's histograms)"""
+    return app.response_class(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/.well-known/jwks.json')
+async def jwks():
+    """Public keys for verifying API tokens locally (JWKS)"""
+    return app.response_class(
+        sync_app.token_keys.jwks_json,
+        mimetype='application/json',
+        headers={'Cache-Control': f'public, max-age={sync_app.JWKS_MAX_AGE}'}
+    )
+
+
+@app.route('/api/auth/google', methods=['POST'])
+async def google_login():
+    """Google OAuth login/signup endpoint"""
+    try:
+        if not user_store:
+            return error_response('Database connection not available', 500)
+
+        # Rate limits are checked before any store read or password hash
+        retry_after = rate_limiter.check('ip', request.remote_addr)
+        if retry_after:
+            return rate_limited_response(retry_after)
+
+        if not GOOGLE_CLIENT_ID:
+            return error_response('Google OAuth not configured', 500)
+
+        data = await request.get_json(silent=True)
+
+        if not data:
+            return error_response('No data provided', 400)
+
+        id_token_string = data.get('idToken')
+        if not id_token_string:
+            return error_response('ID token is required', 400)
+
+        google_user = await verify_google_token(id_token_string)
+        if not google_user:
+            return error_response('Invalid Google token', 400)
+
+        email = google_user['email'].lower().strip()
+
+        existing_user = await user_store.find_by_email(email)
+
+        if existing_user:
+            user_id, user_data = existing_user
+
+            update_data = {}
+            if not user_data.get('googleId'):
+                update_data['googleId'] = google_user['google_id']
+            if not user_data.get('profilePicture'):
+                update_data['profilePicture'] = google_user['picture']
+            if 'emailVerified' not in user_data:
+                update_data['emailVerified'] = google_user['email_verified']
+
+            if update_data:
+                update_data['updatedAt'] = datetime.utcnow()
+                await user_store.update(user_id, update_data)
+                user_cache.invalidate(user_id)
+
+            # The write-behind buffer is shared with the sync app; record() never blocks
+            last_login = datetime.utcnow()
+            queued_logins = login_writer.record(user_id, last_login)
+            user_data.update(update_data)
+            user_data['lastLogin'] = last_login
+            user_data['loginCount'] = user_data.get('loginCount', 0) + queued_logins
+
+        else:
+            user_data = {
+                'fullName': google_user['name'],
+                'email': email,
+                'phoneNumber': '',
+                'password': None,
+                'googleId': google_user['google_id'],
+                'profilePicture': google_user['picture'],
+                'emailVerified': google_user['email_verified'],
+                'createdAt': datetime.utcnow(),
+                'updatedAt': datetime.utcnow(),
+                'lastLogin': datetime.utcnow(),
+                'isActive': True,
+                'loginCount': 1,
+                'authProvider': 'google'
+            }
+
+            try:
+                user_id = await user_store.create(user_data)
+            except EmailAlreadyRegistered:
+                existing_user = await user_store.find_by_email(email)
+                if existing_user is None:
+                    return error_response('This email is being registered by another request, please try again', 409)
+                user_id, user_data = existing_user
+
+        token = generate_token(user_id, user_data)
+
+        user_response = {
+            'id': user_id,
+            'fullName': user_data['fullName'],
+            'email': user_data['email'],
+            'phoneNumber': user_data.get('phoneNumber', ''),
+            'profilePicture': user_data.get('profilePicture', ''),
+            'emailVerified': user_data.get('emailVerified', False),
+            'createdAt': user_data['createdAt'],
+            'loginCount': user_data['loginCount'],
+            'authProvider': user_data.get('authProvider', 'google')
+        }
+
+        return jsonify({
+            'success': True,
+            'message': 'Google login successful',
+            'user': user_response,
+            'token': token
+        }), 200
+
+    except Exception:
+        return internal_error_response('Google login')
+
+
+@app.route('/api/auth/signup', methods=['POST'])
+async def signup():
+    """User registration endpoint"""
+    try:
+        if not user_store:
+            return error_response('Database connection not available', 500)
+
+        # Rate limits are checked before any store read or password hash
+        retry_after = rate_limiter.check('ip', request.remote_addr)
+        if retry_after:
+            return rate_limited_response(retry_after)
+
+        data = await request.get_json(silent=True)
+
+        if not data:
+            return error_response('No data provided', 400)
+
+        required_fields = ['fullName', 'email', 'phoneNumber', 'password']
+        for field in required_fields:
+            if field not in data or not data[field] or str(data[field]).strip() == '':
+                return error_response(f'{field} is required and cannot be empty', 400)
+
+        full_name = str(data['fullName']).strip()
+        email = str(data['email']).lower().strip()
+        phone_number = str(data['phoneNumber']).strip()
+        password = str(data['password'])
+
+        if not validate_email(email):
+            return error_response('Invalid email format', 400)
+        if len(password) < 6:
+            return error_response('Password must be at least 6 characters long', 400)
+        if len(full_name) < 2:
+            return error_response('Full name must be at least 2 characters long', 400)
+        if len(phone_number) < 10:
+            return error_response('Phone number must be at least 10 digits', 400)
+
+        if await user_store.find_by_email(email):
+            return error_response('Email is already registered', 400)
+
+        hashed_password = await password_hasher.hash_async(password)
+
+        user_data = {
+            'fullName': full_name,
+            'email': email,
+            'phoneNumber': phone_number,
+            'password': hashed_password,
+            'createdAt': datetime.utcnow(),
+            'updatedAt': datetime.utcnow(),
+            'lastLogin': None,
+            'isActive': True,
+            'loginCount': 0
+        }
+
+        try:
+            user_id = await user_store.create(user_data)
+        except EmailAlreadyRegistered:
+            return error_response('Email is already registered', 400)
+        user_cache.invalidate(user_id)
+
+        token = generate_token(user_id, user_data)
+
+        user_response = {
+            'id': user_id,
+            'fullName': full_name,
+            'email': email,
+            'phoneNumber': phone_number,
+            'createdAt': user_data['createdAt'],
+            'loginCount': 0
+        }
+
+        return jsonify({
+            'success': True,
+            'message': 'User created successfully',
+            'user': user_response,
+            'token': token
+        }), 201
+
+    except HasherBusy:
+        return hasher_busy_response()
+    except Exception:
+        return internal_error_response('Signup')
+
+
+@app.route('/api/auth/login', methods=['POST'])
+async def login():
+    """User login endpoint"""
+    try:
+        if not user_store:
+            return error_response('Database connection not available', 500)
+
+        # Rate limits are checked before any store read or password hash
+        retry_after = rate_limiter.check('ip', request.remote_addr)
+        if retry_after:
+            return rate_limited_response(retry_after)
+
+        data = await request.get_json(silent=True)
+
+        if not data:
+            return error_response('No data provided', 400)
+
+        if 'email' not in data or 'password' not in data:
+            return error_response('Email and password are required', 400)
+
+        email = str(data['email']).lower().strip()
+        password = str(data['password'])
+
+        if not email or not password:
+            return error_response('Email and password cannot be empty', 400)
+
+        retry_after = rate_limiter.check('email', email)
+        if retry_after:
+            return rate_limited_response(retry_after)
+
+        existing_user = await user_store.find_by_email(email)
+
+        if not existing_user:
+            return error_response('Invalid email or password', 401)
+
+        user_id, user_data = existing_user
+
+        if not await password_hasher.check_async(password, user_data['password']):
+            return error_response('Invalid email or password', 401)
+
+        if not user_data.get('isActive', True):
+            return error_response('Account has been deactivated', 401)
+
+        token = generate_token(user_id, user_data)
+
+        queued_logins = login_writer.record(user_id, datetime.utcnow())
+        login_count = user_data.get('loginCount', 0) + queued_logins
+
+        user_response = {
+            'id': user_id,
+            'fullName': user_data['fullName'],
+            'email': user_data['email'],
+            'phoneNumber': user_data['phoneNumber'],
+            'createdAt': user_data.get('createdAt'),
+            'loginCount': login_count
+        }
+
+        return jsonify({
+            'success': True,
+            'message': 'Login successful',
+            'user': user_response,
+            'token': token
+        }), 200
+
+    except HasherBusy:
+        return hasher_busy_response()
+    except Exception:
+        return internal_error_response('Login')
+
+
+@app.route('/api/auth/verify', methods=['POST'])
+async def verify():
+    """Token verification endpoint"""
+    try:
+        if not user_store:
+            return error_response('Database connection not available', 500)
+
+        data = await request.get_json(silent=True)
+
+        if not data or 'token' not in data:
+            return error_response('Token is required', 400)
+
+        payload = decode_token(data['token'])
+
+        if not payload:
+            return error_response('Invalid or expired token', 401)
+
+        user_id = payload['user_id']
+
+        if trusted_token_claims(payload):
+            return jsonify({
+                'success': True,
+                'message': 'Token is valid',
+                'user': verify_user_response(user_id, user_cache.get(user_id))
+            }), 200
+
+        user_data = await get_user_data(user_id)
+
+        if user_data is None:
+            return error_response('User not found', 404)
+
+        if not user_data.get('isActive', True):
+            return error_response('Account has been deactivated', 401)
+
+        if token_revoked(payload, user_data):
+            return error_response('Token has been revoked', 401)
+
+        return jsonify({
+            'success': True,
+            'message': 'Token is valid',
+            'user': verify_user_response(user_id, user_data)
+        }), 200
+
+    except Exception:
+        return internal_error_response('Verify')
+
+
+@app.route('/api/auth/verify/batch', methods=['POST'])
+async def verify_batch():
+    """Verify many tokens at once (gateways, background jobs)"""
+    try:
+        if not user_store:
+            return error_response('Database connection not available', 500)
+
+        tokens, error = parse_verify_batch(await request.get_json(silent=True))
+        if error:
+            return error_response(error, 400)
+
+        payloads = [decode_token(token) for token in tokens]
+        users = await get_many_user_data(users_to_fetch(payloads))
+
+        return jsonify({
+            'success': True,
+            'results': verify_batch_results(payloads, users)
+        }), 200
+
+    except Exception:
+        return internal_error_response('Batch verify')
+
+
+@app.route('/api/auth/profile', methods=['GET'])
+async def get_profile():
+    """Get user profile endpoint (requires authentication)"""
+    try:
+        if not user_store:
+            return error_response('Database connection not available', 500)
+
+        auth_header = request.headers.get('Authorization')
+
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return error_response('Authorization header is required (Bearer token)', 401)
+
+        user_id = verify_token(auth_header.split(' ')[1])
+
+        if not user_id:
+            return error_response('Invalid or expired token', 401)
+
+        user_data = await get_user_data(user_id)
+
+        if user_data is None:
+            return error_response('User not found', 404)
+
+        etag = profile_etag(user_id, user_data)
+        cache_headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if profile_not_modified(request.if_none_match, etag):
+            return '', 304, cache_headers
+
+        user_response = {
+            'id': user_id,
+            'fullName': user_data['fullName'],
+            'email': user_data['email'],
+            'phoneNumber': user_data['phoneNumber'],
+            'createdAt': user_data.get('createdAt'),
+            'lastLogin': user_data.get('lastLogin'),
+            'loginCount': user_data.get('loginCount', 0),
+            'isActive': user_data.get('isActive', True)
+        }
+
+        return jsonify({
+            'success': True,
+            'message': 'Profile retrieved successfully',
+            'user': user_response
+        }), 200, cache_headers
+
+    except Exception:
+        return internal_error_response('Profile')
+
+
+@app.route('/api/parking/nearby', methods=['GET'])
+async def parking_nearby():
+    """Lots with free spots near a point, from the shared in-memory index"""
+    try:
+        query, error = parse_nearby_query(request.args)
+        if error:
+            return error_response(error, 400)
+
+        if not parking_index.loaded:
+            return jsonify({
+                'success': False,
+                'error': 'Parking data is still loading, please try again shortly'
+            }), 503, {'Retry-After': '1'}
+
+        # Sub-millisecond and CPU-only, so it runs on the event loop
+        lots = nearby_lots(query)
+
+        return jsonify({
+            'success': True,
+            'count': len(lots),
+            'lots': lots
+        }), 200
+
+    except Exception:
+        return internal_error_response('Nearby parking')
+
+
+@app.route('/api/parking/events', methods=['POST'])
+async def parking_events():
+    """Occupancy sensor events as newline-delimited JSON, applied as the body streams in"""
+    try:
+        auth_error = ingest_auth_error(request.headers.get('Authorization'))
+        if auth_error:
+            return error_response(*auth_error)
+
+        unavailable = ingest_unavailable()
+        if unavailable:
+            return jsonify({
+                'success': False,
+                'error': unavailable
+            }), 503, {'Retry-After': '1'}
+
+        # Chunks are consumed as they arrive; parsing and applying them is CPU
+        # work under the ingestor's lock, so it runs off the event loop
+        session = event_ingestor.session()
+        async for chunk in request.body:
+            await asyncio.to_thread(session.feed, chunk)
+
+        return jsonify({
+            'success': True,
+            **session.finish()
+        }), 200
+
+    except Exception:
+        return internal_error_response('Parking event ingest')
+
+
+async def availability_events(user_id, topics):
+    """Body of an async /api/parking/stream response (a coroutine per client, no thread)"""
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+
+    def notify():
+        # Changes are published from ingest threads, not from the event loop
+        if not wakeup.is_set():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    subscriber = availability_broker.subscribe(user_id, topics, notify)
+    if subscriber is None:
+        yield sse_message('closed', {'reason': 'tooManyStreams'})
+        return
+
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    try:
+        yield first_stream_message(stream_snapshot(topics))
+        done = False
+        while not done:
+            try:
+                await asyncio.wait_for(wakeup.wait(), STREAM_HEARTBEAT)
+                woken = True
+            except asyncio.TimeoutError:
+                woken = False
+            wakeup.clear()
+            message, done = next_stream_message(subscriber, woken, deadline)
+            if message:
+                yield message
+    finally:
+        availability_broker.unsubscribe(subscriber)
+
+
+@app.route('/api/parking/stream/ticket', methods=['POST'])
+async def parking_stream_ticket():
+    """Stream ticket for EventSource clients, which cannot send the Authorization header"""
+    try:
+        user_id, error = bearer_user(request.headers)
+        if error:
+            return error_response(error, 401)
+
+        return jsonify({
+            'success': True,
+            'ticket': generate_stream_ticket(user_id),
+            'expiresIn': STREAM_TICKET_SECONDS
+        }), 200
+
+    except Exception:
+        return internal_error_response('Stream ticket')
+
+
+@app.route('/api/parking/stream', methods=['GET'])
+async def parking_stream():
+    """Server-sent events: a snapshot of the subscribed lots/tiles, then only their changes"""
+    try:
+        user_id = stream_user(request.headers, request.args)
+        if not user_id:
+            return error_response('Invalid or expired token or ticket', 401)
+
+        topics, error = parse_stream_topics(request.args)
+        if error:
+            return error_response(error, 400)
+
+        if not parking_index.loaded:
+            return jsonify({
+                'success': False,
+                'error': 'Parking data is still loading, please try again shortly'
+            }), 503, {'Retry-After': '1'}
+
+        if availability_broker.full():
+            return jsonify({
+                'success': False,
+                'error': 'Too many open streams, please try again later'
+            }), 503, {'Retry-After': '5'}
+
+        response = await make_response(availability_events(user_id, topics), 200, SSE_HEADERS)
+        response.mimetype = 'text/event-stream'
+        # Outlives RESPONSE_TIMEOUT; the stream ends itself after STREAM_MAX_SECONDS
+        response.timeout = STREAM_MAX_SECONDS + STREAM_HEARTBEAT
+        return response
+
+    except Exception:
+        return internal_error_response('Parking stream')
+
+
+@app.route('/api/parking/history', methods=['GET'])
+async def parking_history():
+    """Occupancy of a lot over time, read from the shared in-memory ring buffers"""
+    try:
+        query, error = parse_history_query(request.args)
+        if error:
+            return error_response(error, 400)
+
+        # A slice of one array row, cheap enough for the event loop
+        body, status = history_response(query)
+        return jsonify(body), status
+
+    except Exception:
+        return internal_error_response('Parking history')
+
+
+@app.route('/api/parking/history/aggregate', methods=['GET'])
+async def parking_history_aggregate():
+    """Mean/min/max occupancy of a lot over a time range"""
+    try:
+        query, error = parse_history_query(request.args)
+        if error:
+            return error_response(error, 400)
+
+        body, status = history_response(query, aggregate=True)
+        return jsonify(body), status
+
+    except Exception:
+        return internal_error_response('Parking history aggregate')
+
+
+@app.route('/api/parking/forecast', methods=['GET'])
+async def parking_forecast():
+    """Expected occupancy and free spots of a lot at an arrival time (eta)"""
+    try:
+        lot_id, eta, error = parse_forecast_query(request.args)
+        if error:
+            return error_response(error, 400)
+
+        # Interpolates two precomputed points; the NumPy work runs on the forecast thread
+        body, status = forecast_response(lot_id, eta)
+        return jsonify(body), status
+
+    except Exception:
+        return internal_error_response('Parking forecast')
+
+
+@app.route('/api/reservations', methods=['POST'])
+async def create_reservation():
+    """Hold a spot for a time window; the hold expires unless it is confirmed"""
+    try:
+        user_id, error = bearer_user(request.headers)
+        if error:
+            return error_response(error, 401)
+
+        fields, error = parse_reservation_request(await request.get_json(silent=True))
+        if error:
+            return error_response(error, 400)
+
+        error = reservations_unavailable()
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 503, {'Retry-After': '1'}
+
+        # The conditional store write blocks, so it runs off the event loop
+        body, status = await asyncio.to_thread(hold_response, user_id, fields)
+        return jsonify(body), status
+
+    except Exception:
+        return internal_error_response('Create reservation')
+
+
+@app.route('/api/reservations/<reservation_id>', methods=['GET', 'DELETE'])
+async def reservation_by_id(reservation_id):
+    """Read (GET) or cancel (DELETE) one of the user's reservations"""
+    try:
+        user_id, error = bearer_user(request.headers)
+        if error:
+            return error_response(error, 401)
+
+        if request.method == 'GET':
+            # In memory only
+            body, status = reservation_response('get', reservation_id, user_id)
+        else:
+            body, status = await asyncio.to_thread(reservation_response, 'cancel', reservation_id, user_id)
+        return jsonify(body), status
+
+    except Exception:
+        return internal_error_response('Reservation')
+
+
+@app.route('/api/reservations/<reservation_id>/confirm', methods=['POST'])
+async def confirm_reservation(reservation_id):
+    """Confirm a hold (after payment) before it expires"""
+    try:
+        user_id, error = bearer_user(request.headers)
+        if error:
+            return error_response(error, 401)
+
+        body, status = await asyncio.to_thread(reservation_response, 'confirm', reservation_id, user_id)
+        return jsonify(body), status
+
+    except Exception:
+        return internal_error_response('Confirm reservation')
+
+
+# Error handlers
+@app.errorhandler(404)
+async def not_found_error(error):
+    return error_response('Endpoint not found', 404)
+
+
+@app.errorhandler(405)
+async def method_not_allowed_error(error):
+    return error_response('Method not allowed', 405)
+
+
+@app.errorhandler(500)
+async def internal_error(error):
+    return error_response('Internal server error', 500)
+
+
+if __name__ == '__main__':
+    import asyncio
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f'0.0.0.0:{PORT}']
+    config.use_reloader = DEBUG
+    print(f"🚀 Starting SmartParking API (async mode) on port {PORT}")
+    asyncio.run(serve(app, config))
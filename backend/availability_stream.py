@@ -0,0 +1,171 @@
+"""
+Server-sent events of parking availability changes.
+
+Instead of polling /api/parking/nearby, a client opens one long-lived
+GET /api/parking/stream and subscribes to topics: single lots ('lot:<id>')
+or map tiles ('tile:<row>:<col>', the nearby index's grid cells). It first
+receives a snapshot of those lots and afterwards only deltas, i.e. the lots
+whose free count changed.
+
+Fan-out goes through per-topic subscriber sets. Publishing a change looks up
+the lot's two topics and hands the delta to each subscriber, without waiting
+for any of them. A subscriber's buffer keeps one pending delta per lot (a
+newer delta for the same lot replaces the older one) and holds at most
+`max_buffer` lots. A client that falls so far behind that its buffer would
+overflow is evicted: its stream ends with a 'closed' event (reason
+'slowConsumer') and it has to reconnect and take a fresh snapshot. A slow phone then costs a reconnect
+instead of unbounded memory or delays for everyone else.
+
+Topic sets are tuples that are replaced rather than mutated, as in
+parking_index.py, so publishers read them without taking the lock.
+"""
+
+import itertools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def lot_topic(lot_id):
+    return f'lot:{lot_id}'
+
+
+def tile_topic(cell):
+    return f'tile:{cell[0]}:{cell[1]}'
+
+
+def parse_tile(topic):
+    """(row, col) of a 'tile:<row>:<col>' topic; raises ValueError"""
+    _, row, col = topic.split(':')
+    return int(row), int(col)
+
+
+def lot_delta(lot):
+    return {
+        'id': lot.id,
+        'free': lot.free,
+        'capacity': lot.capacity,
+        'updatedAt': lot.updated_at
+    }
+
+
+class Subscriber:
+    """One connected client: its topics and a bounded buffer of pending deltas"""
+
+    def __init__(self, subscriber_id, user_id, topics, max_buffer, notify):
+        self.id = subscriber_id
+        self.user_id = user_id
+        self.topics = topics
+        self.max_buffer = max_buffer
+        self.notify = notify  # Wakes the client's stream (a threading or asyncio event)
+        self._pending = {}  # lot_id -> delta, latest wins
+        self._lock = threading.Lock()
+        self.closed = None  # Reason once the stream must end
+
+    def offer(self, lot_id, delta):
+        """Buffer a delta; False if the buffer is full"""
+        with self._lock:
+            if self.closed:
+                return True
+            if lot_id not in self._pending and len(self._pending) >= self.max_buffer:
+                return False
+            self._pending[lot_id] = delta
+        self.notify()
+        return True
+
+    def drain(self):
+        """Pending deltas, oldest lot first; empties the buffer"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+    def close(self, reason):
+        with self._lock:
+            if self.closed is None:
+                self.closed = reason
+        self.notify()
+
+
+class AvailabilityBroker:
+    """Per-topic subscriber sets; publish() fans lot changes out to their subscribers"""
+
+    def __init__(self, max_subscribers=1000, max_buffer=256):
+        self.max_subscribers = max_subscribers
+        self.max_buffer = max_buffer
+        self._topics = {}  # topic -> tuple of subscribers
+        self._subscribers = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    def full(self):
+        return len(self._subscribers) >= self.max_subscribers
+
+    def subscribe(self, user_id, topics, notify):
+        """New Subscriber, or None when max_subscribers are connected"""
+        topics = tuple(dict.fromkeys(topics))
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            subscriber = Subscriber(next(self._ids), user_id, topics, self.max_buffer, notify)
+            self._subscribers[subscriber.id] = subscriber
+            for topic in topics:
+                self._topics[topic] = self._topics.get(topic, ()) + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber, reason='closed'):
+        subscriber.close(reason)
+        with self._lock:
+            if self._subscribers.pop(subscriber.id, None) is None:
+                return
+            for topic in subscriber.topics:
+                members = tuple(member for member in self._topics.get(topic, ()) if member is not subscriber)
+                if members:
+                    self._topics[topic] = members
+                else:
+                    self._topics.pop(topic, None)
+
+    def publish(self, lots):
+        """Deltas of changed lots to the subscribers of each lot and of its tile"""
+        slow = []
+        for lot in lots:
+            subscribers = self._topics.get(lot_topic(lot.id), ()) + self._topics.get(tile_topic(lot.cell), ())
+            if not subscribers:
+                continue
+            delta = lot_delta(lot)
+            self.published += 1
+            for subscriber in subscribers:
+                if not subscriber.offer(lot.id, delta):
+                    slow.append(subscriber)
+
+        for subscriber in slow:
+            if subscriber.closed is None:
+                self.evicted += 1
+                logger.info("Evicted slow availability subscriber", extra={
+                    'subscriber': subscriber.id, 'bufferSize': subscriber.max_buffer
+                })
+            self.unsubscribe(subscriber, 'slowConsumer')
+
+    def close_all(self, reason='shutdown'):
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        for subscriber in subscribers:
+            self.unsubscribe(subscriber, reason)
+
+    def stats(self):
+        with self._lock:
+            subscribers = len(self._subscribers)
+            topics = len(self._topics)
+        return {
+            'subscribers': subscribers,
+            'topics': topics,
+            'published': self.published,
+            'evicted': self.evicted,
+            'rejected': self.rejected,
+            'maxSubscribers': self.max_subscribers,
+            'bufferSize': self.max_buffer
+        }
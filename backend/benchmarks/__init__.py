@@ -0,0 +1 @@
+"""Offline benchmarks for the SmartParking backend (run from backend/ with python -m)"""
@@ -0,0 +1,292 @@
+"""
+Load test for the auth endpoints.
+
+Drives a weighted mix of signup, login, google, verify and profile requests
+at a given concurrency (closed-loop) or request rate (open-loop) and reports
+p50/p95/p99 latency, a latency histogram and throughput per endpoint.
+
+By default it runs fully offline, in-process through Flask's test client:
+the user store is an in-memory SQLite database and Google ID token
+verification is replaced by a stub that sleeps for --google-latency-ms, so
+the numbers measure this service and not the network. --url points the same
+mix at a running server instead (google requests need a real Google token
+there, so leave them out of the mix).
+
+    cd backend
+    python -m benchmarks.auth_load --concurrency 16 --duration 20
+    python -m benchmarks.auth_load --rate 200 --mix verify=8,profile=2
+    python -m benchmarks.auth_load --compare benchmarks/results/baseline.json
+
+Results are written as JSON to benchmarks/results/ (see harness.py).
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+from benchmarks.harness import (
+    compare_results, environment_info, load_results, print_summary, run_load, write_results
+)
+
+DEFAULT_MIX = 'signup=1,login=3,google=1,verify=10,profile=5'
+PASSWORD = 'bench-password'
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}' (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class InProcessClient:
+    """Calls the Flask app directly through its test client"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, payload=None, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else None
+        response = self.client.open(path, method=method, json=payload, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Calls a running server over HTTP with a keep-alive session"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, payload=None, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else None
+        response = self.session.request(method, self.base_url + path, json=payload, headers=headers, timeout=30)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+
+class StubGoogleVerifier:
+    """Stands in for verify_google_token: ID tokens are 'bench-google:<n>'"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+
+    def __call__(self, id_token_string):
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        prefix, _, number = id_token_string.partition(':')
+        if prefix != 'bench-google' or not number:
+            return None
+        return {
+            'google_id': f'google-{number}',
+            'email': f'google-{number}@bench.local',
+            'name': f'Google User {number}',
+            'picture': '',
+            'email_verified': True
+        }
+
+
+class Workload:
+    """Accounts and tokens shared by the load threads"""
+
+    def __init__(self, make_client, concurrency, google_users, run_id):
+        self.clients = [make_client() for _ in range(concurrency)]
+        self.google_users = google_users
+        self.run_id = run_id
+        self.accounts = []
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def add_account(self, email, token):
+        with self._lock:
+            self.accounts.append((email, token))
+
+    def random_account(self):
+        with self._lock:
+            return random.choice(self.accounts)
+
+    def signup(self, client):
+        email = f'bench-{self.run_id}-{next(self._sequence)}@bench.local'
+        status, body = client.request('POST', '/api/auth/signup', {
+            'fullName': 'Bench User',
+            'email': email,
+            'phoneNumber': '081234567890',
+            'password': PASSWORD
+        })
+        if status == 201 and body:
+            self.add_account(email, body['token'])
+        return status
+
+
+def op_signup(workload, client):
+    return workload.signup(client)
+
+
+def op_login(workload, client):
+    email, _ = workload.random_account()
+    status, _ = client.request('POST', '/api/auth/login', {'email': email, 'password': PASSWORD})
+    return status
+
+
+def op_google(workload, client):
+    # Mostly returning Google users, now and then a first-time sign in
+    number = random.randrange(workload.google_users)
+    status, _ = client.request('POST', '/api/auth/google', {'idToken': f'bench-google:{workload.run_id}-{number}'})
+    return status
+
+
+def op_verify(workload, client):
+    _, token = workload.random_account()
+    status, _ = client.request('POST', '/api/auth/verify', {'token': token})
+    return status
+
+
+def op_profile(workload, client):
+    _, token = workload.random_account()
+    status, _ = client.request('GET', '/api/auth/profile', token=token)
+    return status
+
+
+OPERATIONS = {
+    'signup': op_signup,
+    'login': op_login,
+    'google': op_google,
+    'verify': op_verify,
+    'profile': op_profile,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Load test the auth endpoints')
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process app')
+    parser.add_argument('--concurrency', type=int, default=8, help='Load threads (default 8)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of measured load (default 10)')
+    parser.add_argument('--rate', type=float, default=0.0, help='Open-loop requests/second in total (default: closed-loop)')
+    parser.add_argument('--requests', type=int, default=0, help='Stop after this many requests')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'Operation weights (default {DEFAULT_MIX})')
+    parser.add_argument('--users', type=int, default=200, help='Accounts created before the measured run (default 200)')
+    parser.add_argument('--google-users', type=int, default=500, help='Distinct Google identities used by google requests')
+    parser.add_argument('--google-latency-ms', type=float, default=0.0, help='Latency injected into the stubbed Google verifier')
+    parser.add_argument('--google-jitter-ms', type=float, default=0.0, help='Uniform +/- jitter on that latency')
+    parser.add_argument('--bcrypt-rounds', type=int, help='BCRYPT_ROUNDS for the in-process app (default: app default)')
+    parser.add_argument('--seed', type=int, help='Random seed for the request mix')
+    parser.add_argument('--output', help='Result file (default benchmarks/results/auth-<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline result file; exit 1 on regressions')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed p95/throughput regression vs baseline (default 0.2)')
+    parser.add_argument('--verbose', action='store_true', help="Keep the app's own log output")
+    return parser
+
+
+def load_app(args):
+    """Import app.py configured for an offline run"""
+    os.environ['USER_STORE'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = ':memory:'
+    os.environ.setdefault('GOOGLE_CLIENT_ID', 'bench-client-id')
+    if not args.verbose:
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # All load comes from one address; set these explicitly to measure the limiter
+    os.environ.setdefault('RATE_LIMIT_IP', '0')
+    os.environ.setdefault('RATE_LIMIT_EMAIL', '0')
+    if args.bcrypt_rounds:
+        os.environ['BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+
+    import app as app_module
+    app_module.verify_google_token = StubGoogleVerifier(args.google_latency_ms, args.google_jitter_ms)
+    # No warm-up: it would fetch Google's real signing keys
+    app_module.create_app(warm_up=False)
+    return app_module
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    run_id = format(int(time.time() * 1000), 'x')
+
+    app_module = None
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        app_module = load_app(args)
+        make_client = lambda: InProcessClient(app_module.app)
+
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    workload = Workload(make_client, args.concurrency, args.google_users, run_id)
+
+    def operation(worker_index):
+        name = random.choices(names, weights)[0]
+        try:
+            return name, OPERATIONS[name](workload, workload.clients[worker_index])
+        except Exception as e:
+            return name, type(e).__name__
+
+    print(f"🏁 Creating {args.users} accounts...")
+    setup, _ = run_load(
+        lambda i: ('signup', workload.signup(workload.clients[i])),
+        concurrency=args.concurrency, duration=3600, max_requests=args.users
+    )
+    if not workload.accounts:
+        print(f"❌ Setup failed, no accounts created: {setup.summary(1)['operations']}")
+        return 2
+
+    mode = f'{args.rate:g} req/s open-loop' if args.rate else 'closed-loop'
+    print(f"🚀 Running {mode} with {args.concurrency} threads for {args.duration:g}s...")
+    recorder, elapsed = run_load(
+        operation, concurrency=args.concurrency, duration=args.duration,
+        rate=args.rate, max_requests=args.requests
+    )
+    if app_module is not None:
+        app_module.shutdown()
+
+    results = {
+        'benchmark': 'auth_load',
+        'environment': environment_info(),
+        'config': {
+            'target': args.url or 'in-process',
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'rate': args.rate,
+            'mix': args.mix,
+            'users': args.users,
+            'googleLatencyMs': args.google_latency_ms,
+            'googleJitterMs': args.google_jitter_ms,
+            'bcryptRounds': app_module.BCRYPT_ROUNDS if app_module else None,
+            'bcryptWorkers': app_module.BCRYPT_WORKERS if app_module else None,
+        },
+        'elapsedSeconds': round(elapsed, 3),
+        'results': recorder.summary(elapsed),
+    }
+
+    print_summary(results)
+    path = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results', f'auth-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    )
+    print(f"💾 Results written to {write_results(path, results)}")
+
+    if args.compare:
+        regressions = compare_results(load_results(args.compare), results, args.max_regression)
+        for name, description in regressions:
+            print(f"⚠️ Regression in {name}: {description}")
+        if regressions:
+            return 1
+        print(f"✅ No regressions beyond {args.max_regression:.0%} vs {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
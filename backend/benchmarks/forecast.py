@@ -0,0 +1,207 @@
+"""
+Benchmark of the occupancy forecaster.
+
+Fills an OccupancyHistory with synthetic lots (weekly patterns that differ
+per lot, noise, and a share of lots that are unusually busy right now)
+and measures:
+
+    compute   one full recomputation of every lot's forecast (what the schedule runs)
+    lookup    one /api/parking/forecast answer from the precomputed forecast
+
+The synthetic generator knows the true future occupancy, so the run also
+reports the forecast's mean absolute error over the horizon. Two baselines
+are included for comparison: the weekly profile alone, and persistence
+(the latest sample stays as it is).
+
+    cd backend
+    python -m benchmarks.forecast --lots 10000
+    python -m benchmarks.forecast --weeks 4 --busy-share 0.5
+    python -m benchmarks.forecast --compare benchmarks/results/forecast-baseline.json
+
+Results are written as JSON to benchmarks/results/ (see harness.py).
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from benchmarks.harness import (
+    LatencyRecorder, compare_results, environment_info, load_results, write_results
+)
+from occupancy_forecast import OccupancyForecaster, hour_of_week
+from occupancy_history import MISSING, SCALE, OccupancyHistory
+from parking_index import GeoGridIndex, Lot
+
+
+def weekly_shape():
+    """Typical occupancy per hour of the week: busy weekday daytime, quieter weekends"""
+    hours = np.arange(168)
+    hour = hours % 24
+    weekday = hours // 24 < 5
+    daytime = np.exp(-((hour - 13) / 4.0) ** 2)
+    return np.where(weekday, 0.15 + 0.75 * daytime, 0.1 + 0.45 * daytime)
+
+
+class SyntheticCity:
+    """Per-lot weekly patterns plus noise, and a decaying surge on the 'busy' lots"""
+
+    def __init__(self, rng, lots, busy_share, noise, now):
+        self.now = now
+        shape = weekly_shape()
+        # Each lot: its own peak level and an hour or two of shift
+        scale = rng.uniform(0.6, 1.1, size=(lots, 1))
+        shift = rng.integers(-2, 3, size=lots)
+        self.profiles = np.clip(np.stack([np.roll(shape, s) for s in shift]) * scale, 0, 1)
+        self.noise = noise
+        self.rng = rng
+        busy = rng.random(lots) < busy_share
+        self.surge = np.where(busy, rng.uniform(0.15, 0.35, size=lots), 0.0)
+
+    def occupancy(self, epochs, noisy=True):
+        """lots x len(epochs) occupancy; the surge fades linearly over 4 hours from now"""
+        epochs = np.asarray(epochs, dtype=np.int64)
+        values = self.profiles[:, hour_of_week(epochs)]
+        fade = np.clip(1 - (epochs - self.now) / (4 * 3600), 0, 1) * (epochs > self.now - 3 * 3600)
+        values = values + self.surge[:, None] * fade[None, :]
+        if noisy:
+            values = values + self.rng.normal(0, self.noise, size=values.shape)
+        return np.clip(values, 0, 1)
+
+
+def fill_history(history, city, now, weeks):
+    """Write `weeks` of hourly means and the last hours of fine samples straight into the tiers"""
+    hourly = next(tier for tier in history.tiers if tier.interval == 3600)
+    finest = history.tiers[0]
+    first_hour = int((now - weeks * 7 * 86400) // 3600)
+    last_hour = int(now // 3600) - 1  # The current hour is still open
+    for bucket in range(first_hour, last_hour + 1):
+        column = city.occupancy([bucket * 3600 + 1800])[:, 0]
+        hourly.write(bucket, array('H', np.round(column * SCALE).astype(np.uint16).tobytes()))
+    recent = int(now // finest.interval)
+    for bucket in range(recent - min(finest.slots, 6 * 3600 // finest.interval) + 1, recent + 1):
+        column = city.occupancy([bucket * finest.interval])[:, 0]
+        finest.write(bucket, array('H', np.round(column * SCALE).astype(np.uint16).tobytes()))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark occupancy forecasting over many lots')
+    parser.add_argument('--lots', type=int, default=10000, help='Lots (default 10000)')
+    parser.add_argument('--weeks', type=int, default=8, help='Weeks of hourly history (default 8)')
+    parser.add_argument('--busy-share', type=float, default=0.2, help='Share of lots with a surge right now (default 0.2)')
+    parser.add_argument('--noise', type=float, default=0.05, help='Standard deviation of sample noise (default 0.05)')
+    parser.add_argument('--horizon', type=int, default=24, help='Forecast horizon in hours (default 24)')
+    parser.add_argument('--runs', type=int, default=5, help='Full recomputations to time (default 5)')
+    parser.add_argument('--lookups', type=int, default=20000, help='Forecast lookups to time (default 20000)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default 42)')
+    parser.add_argument('--output', help='Result file (default benchmarks/results/forecast-<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline result file; exit 1 on regressions')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed p95/throughput regression vs baseline (default 0.2)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+    lookup_rng = random.Random(args.seed)
+    now = time.time()
+    city = SyntheticCity(rng, args.lots, args.busy_share, args.noise, now)
+
+    index = GeoGridIndex()
+    index.load([Lot(f'lot-{i}', '', 0, i * 1e-4, 100) for i in range(args.lots)])
+    history = OccupancyHistory(index)
+    # Registers every lot with the history (one sample, a long time ago)
+    history.sample(now - args.weeks * 7 * 86400 - 86400)
+    started = time.perf_counter()
+    fill_history(history, city, now, args.weeks)
+    print(f"🗓️ {args.lots} lots, {args.weeks} weeks of history generated in {time.perf_counter() - started:.1f} s")
+
+    forecaster = OccupancyForecaster(history, horizon_hours=args.horizon)
+    recorder = LatencyRecorder()
+    elapsed = {}
+
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        run_started = time.perf_counter()
+        forecaster.compute(now)
+        recorder.record('compute', (time.perf_counter() - run_started) * 1000, 200)
+    elapsed['compute'] = time.perf_counter() - started
+
+    lot_ids = [f'lot-{i}' for i in range(args.lots)]
+    started = time.perf_counter()
+    for _ in range(args.lookups):
+        lot_id = lookup_rng.choice(lot_ids)
+        eta = now + lookup_rng.uniform(0, args.horizon * 3600)
+        lookup_started = time.perf_counter()
+        forecaster.lookup(lot_id, eta)
+        recorder.record('lookup', (time.perf_counter() - lookup_started) * 1000, 200)
+    elapsed['lookup'] = time.perf_counter() - started
+
+    # Accuracy against the generator's noise-free future
+    times = now + np.arange(1, args.horizon + 1) * 3600
+    truth = city.occupancy(times.astype(np.int64), noisy=False)
+    predicted = forecaster.forecast.values[:, 1:].astype(np.float64)
+    profile_only = city.profiles[:, hour_of_week(times.astype(np.int64))]
+    finest = history.tiers[0]
+    latest = np.frombuffer(bytes(finest.values), dtype=np.uint16).reshape(-1, finest.slots)[:, finest.last_bucket % finest.slots]
+    persistence = np.where(latest == MISSING, np.nan, latest / SCALE)[:, None]
+    busy = city.surge > 0
+    accuracy = {
+        'forecastMae': round(float(np.mean(np.abs(predicted - truth))), 4),
+        'forecastMaeBusyLots': round(float(np.mean(np.abs(predicted[busy] - truth[busy]))), 4) if busy.any() else None,
+        'trueProfileMae': round(float(np.mean(np.abs(profile_only - truth))), 4),
+        'persistenceMae': round(float(np.nanmean(np.abs(persistence - truth))), 4),
+        'nextHourMae': round(float(np.mean(np.abs(predicted[:, 0] - truth[:, 0]))), 4),
+    }
+
+    operations = {}
+    for name, summary in recorder.summary(1)['operations'].items():
+        summary['throughput'] = round(summary['requests'] / elapsed[name], 2) if elapsed[name] else 0.0
+        operations[name] = summary
+
+    results = {
+        'benchmark': 'forecast',
+        'environment': environment_info(),
+        'config': {
+            'lots': args.lots,
+            'weeks': args.weeks,
+            'busyShare': args.busy_share,
+            'noise': args.noise,
+            'horizonHours': args.horizon,
+            'numpy': np.__version__,
+            'seed': args.seed,
+        },
+        'accuracy': accuracy,
+        'results': {'operations': operations},
+    }
+
+    print(f"{'operation':<10}{'ops':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name in ('compute', 'lookup'):
+        latency = operations[name]['latencyMs']
+        print(f"{name:<10}{operations[name]['requests']:>8}{latency['p50']:>10.3f}{latency['p95']:>10.3f}{latency['max']:>10.3f}")
+    print(f"🎯 Mean absolute error over {args.horizon} h: forecast {accuracy['forecastMae']}, "
+          f"profile only {accuracy['trueProfileMae']}, persistence {accuracy['persistenceMae']}")
+    if accuracy['forecastMaeBusyLots'] is not None:
+        print(f"   Lots with a surge right now: forecast {accuracy['forecastMaeBusyLots']}")
+
+    path = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results', f'forecast-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    )
+    print(f"💾 Results written to {write_results(path, results)}")
+
+    if args.compare:
+        regressions = compare_results(load_results(args.compare), results, args.max_regression)
+        for name, description in regressions:
+            print(f"⚠️ Regression in {name}: {description}")
+        if regressions:
+            return 1
+        print(f"✅ No regressions beyond {args.max_regression:.0%} vs {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
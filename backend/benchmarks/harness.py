@@ -0,0 +1,234 @@
+"""
+Load generator and result bookkeeping shared by the benchmarks.
+
+run_load() drives an operation from N worker threads, either closed-loop
+(every worker issues its next request as soon as the previous one returns)
+or open-loop at a fixed request rate. In open-loop mode latency is measured
+from the time a request was *scheduled*, not from when a worker got round to
+sending it, so a stalled server shows up as queueing delay instead of being
+hidden by the load generator slowing down (coordinated omission).
+
+Results are plain dicts written as JSON, so runs can be diffed and compared
+with compare_results() to catch regressions.
+"""
+
+import json
+import math
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def histogram(latencies_ms):
+    buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for value in latencies_ms:
+        for i, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if value <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+    labels = [f'<={bound}' for bound in HISTOGRAM_BOUNDS_MS] + [f'>{HISTOGRAM_BOUNDS_MS[-1]}']
+    return dict(zip(labels, buckets))
+
+
+class LatencyRecorder:
+    """Latencies and status codes per operation name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._statuses = {}
+        self._errors = {}
+
+    def record(self, name, latency_ms, status):
+        with self._lock:
+            self._latencies.setdefault(name, []).append(latency_ms)
+            statuses = self._statuses.setdefault(name, {})
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def summary(self, elapsed):
+        operations = {}
+        all_latencies = []
+        with self._lock:
+            for name, latencies in sorted(self._latencies.items()):
+                all_latencies.extend(latencies)
+                operations[name] = _summarize(
+                    latencies, elapsed, self._errors.get(name, 0), self._statuses[name]
+                )
+            errors = sum(self._errors.values())
+        overall = _summarize(all_latencies, elapsed, errors, None)
+        return {'overall': overall, 'operations': operations}
+
+
+def _summarize(latencies, elapsed, errors, statuses):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    summary = {
+        'requests': count,
+        'errors': errors,
+        'throughput': round(count / elapsed, 2) if elapsed else 0.0,
+        'latencyMs': {
+            'min': _round(ordered[0]) if ordered else None,
+            'mean': _round(sum(ordered) / count) if ordered else None,
+            'p50': _round(percentile(ordered, 50)),
+            'p95': _round(percentile(ordered, 95)),
+            'p99': _round(percentile(ordered, 99)),
+            'max': _round(ordered[-1]) if ordered else None,
+        },
+        'histogramMs': histogram(ordered),
+    }
+    if statuses is not None:
+        summary['statuses'] = dict(sorted(statuses.items()))
+    return summary
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def run_load(operation, concurrency=8, duration=10.0, rate=0.0, max_requests=0, recorder=None):
+    """
+    Call operation(worker_index) from `concurrency` threads for `duration`
+    seconds (or until max_requests). operation returns (name, status).
+    rate > 0 schedules requests open-loop at that many per second in total.
+    Returns (recorder, elapsed seconds).
+    """
+    recorder = recorder or LatencyRecorder()
+    lock = threading.Lock()
+    issued = [0]
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def next_slot():
+        # Sequence number of the next request, or None when the run is over
+        with lock:
+            if max_requests and issued[0] >= max_requests:
+                return None
+            slot = issued[0]
+            issued[0] += 1
+        return slot
+
+    def worker(index):
+        while True:
+            slot = next_slot()
+            if slot is None:
+                return
+            if rate > 0:
+                scheduled = started + slot / rate
+                if scheduled >= deadline:
+                    return
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+                if scheduled >= deadline:
+                    return
+
+            try:
+                name, status = operation(index)
+            except Exception as e:
+                name, status = getattr(e, 'operation', 'unknown'), type(e).__name__
+            recorder.record(name, (time.perf_counter() - scheduled) * 1000, status)
+
+    threads = [
+        threading.Thread(target=worker, args=(i,), name=f'load-{i}', daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def environment_info():
+    """Where a result came from, so runs on different machines are not compared blindly"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'gitCommit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+    }
+
+
+def write_results(path, results):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    return path
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, max_regression=0.2, metric='p95'):
+    """
+    Compare per-operation latency and throughput against a baseline run.
+    Returns a list of (operation, description) regressions beyond max_regression.
+    """
+    regressions = []
+    # Open-loop throughput is whatever rate was asked for, not a measurement
+    closed_loop = not baseline.get('config', {}).get('rate') and not current.get('config', {}).get('rate')
+    baseline_ops = baseline.get('results', {}).get('operations', {})
+    for name, result in current.get('results', {}).get('operations', {}).items():
+        before = baseline_ops.get(name)
+        if not before:
+            continue
+
+        old_latency = before['latencyMs'].get(metric)
+        new_latency = result['latencyMs'].get(metric)
+        if old_latency and new_latency and new_latency > old_latency * (1 + max_regression):
+            regressions.append((name, f'{metric} {old_latency}ms -> {new_latency}ms'))
+
+        old_rate = before.get('throughput')
+        new_rate = result.get('throughput')
+        if closed_loop and old_rate and new_rate is not None and new_rate < old_rate * (1 - max_regression):
+            regressions.append((name, f'throughput {old_rate}/s -> {new_rate}/s'))
+    return regressions
+
+
+def print_summary(results):
+    operations = results['results']['operations']
+    overall = results['results']['overall']
+    print(f"{'operation':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, result in list(operations.items()) + [('TOTAL', overall)]:
+        latency = result['latencyMs']
+        print(
+            f"{name:<12}{result['requests']:>10}{result['errors']:>8}{result['throughput']:>10}"
+            f"{_fmt(latency['p50']):>10}{_fmt(latency['p95']):>10}{_fmt(latency['p99']):>10}"
+        )
+
+
+def _fmt(value):
+    return '-' if value is None else f'{value:.1f}'
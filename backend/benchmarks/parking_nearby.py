@@ -0,0 +1,250 @@
+"""
+Benchmark of the nearby-parking index.
+
+Builds synthetic cities, i.e. clusters of lots around city centres that
+thin out towards the suburbs. It loads them into the GeoGridIndex that
+serves /api/parking/nearby and measures:
+
+    nearby   queries at random points in the cities
+    update   set_free() calls (occupancy changes), incl. lots filling up / freeing
+    scan     the same queries answered by scanning every lot, for comparison
+
+--writers N keeps N threads applying occupancy changes while the queries
+run, as ingestion does in production. Every scan query is also checked
+against the index's answer.
+
+    cd backend
+    python -m benchmarks.parking_nearby --cities 5 --lots 20000
+    python -m benchmarks.parking_nearby --radius 3000 --writers 2
+    python -m benchmarks.parking_nearby --compare benchmarks/results/nearby-baseline.json
+
+Results are written as JSON to benchmarks/results/ (see harness.py).
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+from benchmarks.harness import (
+    LatencyRecorder, compare_results, environment_info, load_results, write_results
+)
+from parking_index import METERS_PER_DEGREE, GeoGridIndex, Lot
+
+# Real city centres, so cells have realistic cos(latitude) distortion
+CITY_CENTRES = [
+    (-6.2088, 106.8456),   # Jakarta
+    (-6.9175, 107.6191),   # Bandung
+    (-7.2575, 112.7521),   # Surabaya
+    (1.3521, 103.8198),    # Singapore
+    (3.1390, 101.6869),    # Kuala Lumpur
+    (13.7563, 100.5018),   # Bangkok
+    (14.5995, 120.9842),   # Manila
+    (-33.8688, 151.2093),  # Sydney
+]
+
+
+def synthetic_city(rng, centre, lots, spread_m, first_id, min_spots, max_spots):
+    """Lots scattered around a centre, denser in the middle (normal distribution)"""
+    lat0, lng0 = centre
+    cos_lat = math.cos(math.radians(lat0))
+    city = []
+    for i in range(lots):
+        lat = lat0 + rng.gauss(0, spread_m) / METERS_PER_DEGREE
+        lng = lng0 + rng.gauss(0, spread_m) / (METERS_PER_DEGREE * cos_lat)
+        capacity = rng.randint(min_spots, max_spots)
+        # A quarter of the lots start full
+        free = 0 if rng.random() < 0.25 else rng.randint(1, capacity)
+        city.append(Lot(f'lot-{first_id + i}', f'Lot {first_id + i}', lat, lng, capacity, free))
+    return city
+
+
+def random_point(rng, centres, spread_m):
+    lat0, lng0 = rng.choice(centres)
+    cos_lat = math.cos(math.radians(lat0))
+    return (lat0 + rng.gauss(0, spread_m) / METERS_PER_DEGREE,
+            lng0 + rng.gauss(0, spread_m) / (METERS_PER_DEGREE * cos_lat))
+
+
+def scan(lots, lat, lng, radius, limit, min_free):
+    """Reference answer: every lot, exact distances (what the index replaces)"""
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    found = []
+    for lot in lots:
+        distance = math.hypot(lot.lat - lat, (lot.lng - lng) * cos_lat) * METERS_PER_DEGREE
+        if distance <= radius and lot.free >= min_free:
+            found.append((distance, lot.id))
+    found.sort()
+    return [lot_id for _, lot_id in found[:limit]]
+
+
+def timed(recorder, name, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    recorder.record(name, (time.perf_counter() - started) * 1000, 200)
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the nearby-parking grid index')
+    parser.add_argument('--cities', type=int, default=5, help=f'Synthetic cities (default 5, at most {len(CITY_CENTRES)})')
+    parser.add_argument('--lots', type=int, default=20000, help='Lots per city (default 20000)')
+    parser.add_argument('--min-spots', type=int, default=5, help='Smallest lot capacity (default 5)')
+    parser.add_argument('--max-spots', type=int, default=40, help='Largest lot capacity (default 40)')
+    parser.add_argument('--spread', type=float, default=6000, help='Standard deviation of lot positions around a centre, metres (default 6000)')
+    parser.add_argument('--cell-size', type=float, default=0.01, help='Grid cell size in degrees (default 0.01, PARKING_CELL_SIZE)')
+    parser.add_argument('--radius', type=float, default=1000, help='Query radius in metres (default 1000)')
+    parser.add_argument('--limit', type=int, default=20, help='Results per query (default 20)')
+    parser.add_argument('--min-free', type=int, default=1, help='Free spots a lot needs to be returned (default 1)')
+    parser.add_argument('--queries', type=int, default=20000, help='Index queries (default 20000)')
+    parser.add_argument('--updates', type=int, default=100000, help='Occupancy updates (default 100000)')
+    parser.add_argument('--scans', type=int, default=100, help='Queries also answered by a full scan and checked (default 100)')
+    parser.add_argument('--writers', type=int, default=0, help='Threads applying updates during the queries (default 0)')
+    parser.add_argument('--write-rate', type=float, default=2000, help='Updates/second per writer thread, 0 = as fast as possible (default 2000)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default 42)')
+    parser.add_argument('--output', help='Result file (default benchmarks/results/nearby-<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline result file; exit 1 on regressions')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed p95/throughput regression vs baseline (default 0.2)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    rng = random.Random(args.seed)
+    centres = CITY_CENTRES[:max(1, min(args.cities, len(CITY_CENTRES)))]
+
+    lots = []
+    for centre in centres:
+        lots.extend(synthetic_city(rng, centre, args.lots, args.spread, len(lots), args.min_spots, args.max_spots))
+    spots = sum(lot.capacity for lot in lots)
+    print(f"🏙️ {len(centres)} cities, {len(lots)} lots, {spots} spots")
+
+    index = GeoGridIndex(cell_size=args.cell_size)
+    started = time.perf_counter()
+    index.load(lots)
+    build_seconds = time.perf_counter() - started
+    print(f"🧱 Index built in {build_seconds * 1000:.0f} ms ({index.stats()['cells']} cells)")
+
+    recorder = LatencyRecorder()
+    elapsed = {}
+
+    # Occupancy updates, alone
+    lot_ids = [lot.id for lot in lots]
+    capacities = {lot.id: lot.capacity for lot in lots}
+    started = time.perf_counter()
+    for _ in range(args.updates):
+        lot_id = rng.choice(lot_ids)
+        timed(recorder, 'update', index.set_free, lot_id, rng.randint(0, capacities[lot_id]))
+    elapsed['update'] = time.perf_counter() - started
+
+    # Queries, optionally with writers changing occupancy underneath
+    stop = threading.Event()
+    background_updates = [0] * args.writers
+
+    def writer(slot):
+        writer_rng = random.Random(args.seed + slot + 1)
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            lot_id = writer_rng.choice(lot_ids)
+            index.set_free(lot_id, writer_rng.randint(0, capacities[lot_id]))
+            background_updates[slot] += 1
+            if args.write_rate > 0:
+                next_at += 1 / args.write_rate
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+    writers = [threading.Thread(target=writer, args=(slot,), daemon=True) for slot in range(args.writers)]
+    for thread in writers:
+        thread.start()
+    returned = 0
+    started = time.perf_counter()
+    for _ in range(args.queries):
+        lat, lng = random_point(rng, centres, args.spread)
+        returned += len(timed(recorder, 'nearby', index.nearby, lat, lng, args.radius, args.limit, args.min_free))
+    elapsed['nearby'] = time.perf_counter() - started
+    stop.set()
+    for thread in writers:
+        thread.join()
+
+    # Full scans for comparison, each checked against the index
+    mismatches = 0
+    started = time.perf_counter()
+    for _ in range(args.scans):
+        lat, lng = random_point(rng, centres, args.spread)
+        expected = timed(recorder, 'scan', scan, lots, lat, lng, args.radius, args.limit, args.min_free)
+        actual = [lot.id for _, lot in index.nearby(lat, lng, args.radius, args.limit, args.min_free)]
+        # Ties at equal distance may come back in either order
+        if sorted(actual) != sorted(expected):
+            mismatches += 1
+    elapsed['scan'] = time.perf_counter() - started
+
+    operations = {}
+    for name, summary in recorder.summary(1)['operations'].items():
+        summary['throughput'] = round(summary['requests'] / elapsed[name], 2) if elapsed[name] else 0.0
+        operations[name] = summary
+
+    results = {
+        'benchmark': 'parking_nearby',
+        'environment': environment_info(),
+        'config': {
+            'cities': len(centres),
+            'lotsPerCity': args.lots,
+            'spots': spots,
+            'spreadMeters': args.spread,
+            'cellSize': args.cell_size,
+            'radius': args.radius,
+            'limit': args.limit,
+            'minFree': args.min_free,
+            'writers': args.writers,
+            'writeRate': args.write_rate,
+            'seed': args.seed,
+        },
+        'buildSeconds': round(build_seconds, 3),
+        'index': index.stats(),
+        'avgResults': round(returned / args.queries, 2) if args.queries else 0,
+        'backgroundUpdates': sum(background_updates),
+        'scanMismatches': mismatches,
+        'results': {'operations': operations},
+    }
+
+    print(f"{'operation':<12}{'ops':>10}{'ops/s':>12}{'p50 µs':>10}{'p95 µs':>10}{'p99 µs':>10}")
+    for name in ('nearby', 'update', 'scan'):
+        if name not in operations:
+            continue
+        result = operations[name]
+        latency = result['latencyMs']
+        print(
+            f"{name:<12}{result['requests']:>10}{result['throughput']:>12}"
+            f"{latency['p50'] * 1000:>10.1f}{latency['p95'] * 1000:>10.1f}{latency['p99'] * 1000:>10.1f}"
+        )
+    print(f"📍 {results['avgResults']} lots per query on average")
+    if args.writers:
+        print(f"✍️ {results['backgroundUpdates']} updates applied by {args.writers} writer threads during the queries")
+    if mismatches:
+        print(f"❌ {mismatches}/{args.scans} queries disagree with the full scan")
+    elif args.scans:
+        print(f"✅ {args.scans} queries match a full scan")
+
+    path = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results', f'nearby-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    )
+    print(f"💾 Results written to {write_results(path, results)}")
+
+    if mismatches and not args.writers:
+        return 1
+    if args.compare:
+        regressions = compare_results(load_results(args.compare), results, args.max_regression)
+        for name, description in regressions:
+            print(f"⚠️ Regression in {name}: {description}")
+        if regressions:
+            return 1
+        print(f"✅ No regressions beyond {args.max_regression:.0%} vs {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,354 @@
+"""
+Concurrency benchmark of the reservation engine.
+
+Many threads book a few hot spots at once: they hold a window (on a given
+spot or on any free spot of the lot), then confirm it, cancel it or
+abandon it so the hold expires. Some confirmed reservations are cancelled
+again later, so windows keep getting freed and rebooked. Engines run against
+one SQLite file; with --workers > 1, each engine plays a separate app worker
+with its own in-memory schedules, and only the store's conditional writes
+keep them from booking the same windows.
+
+After the run, the benchmark counts double bookings in two ways:
+
+    client    pairs of confirmed reservations on the same spot with overlapping
+              windows that were both definitely held at the same moment (from
+              the moment the hold returned until the cancel was sent)
+    store     pairs of reservations still confirmed in the store with
+              overlapping windows on the same spot
+
+--naive runs the same workload against a read-then-write implementation
+(look for overlaps, then insert, no transaction or lock), which is what
+the engine replaces.
+
+    cd backend
+    python -m benchmarks.reservations --threads 32 --spots 10
+    python -m benchmarks.reservations --workers 4 --naive
+    python -m benchmarks.reservations --store none --duration 5
+    python -m benchmarks.reservations --compare benchmarks/results/reservations-baseline.json
+
+Results are written as JSON to benchmarks/results/ (see harness.py).
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from benchmarks.harness import (
+    LatencyRecorder, compare_results, environment_info, load_results, run_load, write_results
+)
+from parking_index import GeoGridIndex, Lot
+from parking_store import ReservationConflict, SQLiteParkingRepository
+from reservations import ReservationEngine, ReservationStateError
+
+_DOUBLE_BOOKINGS = (
+    'SELECT COUNT(*) FROM reservations a JOIN reservations b'
+    ' ON a.lot_id = b.lot_id AND a.spot_id = b.spot_id AND a.id < b.id'
+    ' AND a.start_at < b.end_at AND b.start_at < a.end_at'
+    " WHERE a.status = 'confirmed' AND b.status = 'confirmed'"
+)
+
+
+class NaiveReservations:
+    """Read-then-write against the same table: check for overlaps, then insert, in separate statements"""
+
+    def __init__(self, path, index, hold_seconds):
+        self.path = path
+        self.index = index
+        self.hold_seconds = hold_seconds
+        self._local = threading.local()
+
+    @property
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                                      check_same_thread=False)
+        return conn
+
+    def hold(self, user_id, lot_id, start, end, spot_id=None):
+        now = time.time()
+        spot_ids = [spot_id] if spot_id else [str(n) for n in range(1, self.index.get(lot_id).capacity + 1)]
+        for candidate in spot_ids:
+            taken = self._conn.execute(
+                'SELECT 1 FROM reservations WHERE lot_id = ? AND spot_id = ? AND start_at < ? AND end_at > ?'
+                " AND (status = 'confirmed' OR (status = 'held' AND expires_at > ?)) LIMIT 1",
+                (lot_id, candidate, end, start, now)
+            ).fetchone()
+            if taken:
+                continue
+            reservation = NaiveReservation(uuid.uuid4().hex, lot_id, candidate)
+            self._conn.execute(
+                'INSERT INTO reservations (id, lot_id, spot_id, user_id, start_at, end_at, status, expires_at,'
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'held', ?, ?, ?)",
+                (reservation.id, lot_id, candidate, user_id, start, end, now + self.hold_seconds, now, now)
+            )
+            return reservation
+        raise ReservationConflict(lot_id, spot_id)
+
+    def confirm(self, reservation_id, user_id):
+        row = self._conn.execute('SELECT status, expires_at FROM reservations WHERE id = ?', (reservation_id,)).fetchone()
+        if row[0] != 'held' or row[1] <= time.time():
+            raise ReservationStateError('Reservation is expired')
+        self._conn.execute("UPDATE reservations SET status = 'confirmed' WHERE id = ?", (reservation_id,))
+
+    def cancel(self, reservation_id, user_id):
+        self._conn.execute("UPDATE reservations SET status = 'cancelled' WHERE id = ?", (reservation_id,))
+
+
+class NaiveReservation:
+    __slots__ = ('id', 'lot_id', 'spot_id')
+
+    def __init__(self, reservation_id, lot_id, spot_id):
+        self.id = reservation_id
+        self.lot_id = lot_id
+        self.spot_id = spot_id
+
+
+class Client:
+    """One thread's booking loop, a step per call: hold, then confirm, cancel or abandon the hold"""
+
+    def __init__(self, index, engine, args, lot_ids, base):
+        self.user_id = f'user-{index}'
+        self.engine = engine
+        self.args = args
+        self.lot_ids = lot_ids
+        self.base = base
+        self.rng = random.Random(args.seed + index)
+        self.state = None
+        self.confirmed = []  # [key, start, end, held_from, held_until]
+
+    def window(self):
+        slot = self.args.slot_minutes * 60
+        start = self.base + self.rng.randrange(self.args.horizon_hours * 3600 // slot) * slot
+        return start, start + self.rng.randint(1, self.args.max_slots) * slot
+
+    def step(self):
+        state, self.state = self.state, None
+        if state is None:
+            return self.hold()
+        action, reservation, record = state
+        if action == 'confirm':
+            try:
+                self.engine.confirm(reservation.id, self.user_id)
+            except ReservationStateError:
+                return 'confirm', 409
+            self.confirmed.append(record)
+            if self.rng.random() < self.args.cancel_confirmed:
+                self.state = ('cancel', reservation, record)
+            return 'confirm', 200
+        # Cancelling: from here on the reservation may be released
+        if record is not None:
+            record[4] = time.perf_counter()
+        try:
+            self.engine.cancel(reservation.id, self.user_id)
+        except ReservationStateError:
+            return 'cancel', 409  # The hold expired first
+        return 'cancel', 200
+
+    def hold(self):
+        lot_id = self.rng.choice(self.lot_ids)
+        start, end = self.window()
+        spot_id = None if self.rng.random() < self.args.any_spot else str(self.rng.randint(1, self.args.spots))
+        try:
+            reservation = self.engine.hold(self.user_id, lot_id, start, end, spot_id=spot_id)
+        except ReservationConflict:
+            return 'hold', 409
+        held_from = time.perf_counter()
+
+        fate = self.rng.random()
+        if fate < self.args.confirm_share:
+            record = [(reservation.lot_id, reservation.spot_id), start, end, held_from, float('inf')]
+            self.state = ('confirm', reservation, record)
+        elif fate < self.args.confirm_share + self.args.cancel_share:
+            self.state = ('cancel', reservation, None)
+        return 'hold', 201
+
+
+def client_double_bookings(clients):
+    """Pairs of confirmed reservations that overlapped in window and in the time both were held"""
+    by_spot = {}
+    for client in clients:
+        for record in client.confirmed:
+            by_spot.setdefault(record[0], []).append(record)
+    doubles = 0
+    for records in by_spot.values():
+        records.sort(key=lambda record: record[1])
+        for i, (_, start, end, held_from, held_until) in enumerate(records):
+            for _, other_start, other_end, other_from, other_until in records[i + 1:]:
+                if other_start >= end:
+                    break
+                if held_from < other_until and other_from < held_until:
+                    doubles += 1
+    return doubles
+
+
+def store_double_bookings(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(_DOUBLE_BOOKINGS).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run(args, naive=False):
+    """One run; returns (results dict, per-operation summary)"""
+    scratch = tempfile.mkdtemp(prefix='reservations-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    try:
+        path = os.path.join(scratch, 'reservations.db')
+        index = GeoGridIndex()
+        index.load([Lot(f'lot-{i}', '', 0, i * 0.01, args.spots) for i in range(args.lots)])
+        lot_ids = [lot.id for lot in index.lots()]
+
+        stores = []
+        if naive:
+            SQLiteParkingRepository(path)  # Creates the schema
+            engines = [NaiveReservations(path, index, args.hold_seconds)]
+        else:
+            engines = []
+            for _ in range(args.workers):
+                store = SQLiteParkingRepository(path) if args.store == 'sqlite' else None
+                stores.append(store)
+                engine = ReservationEngine(index, store, hold_seconds=args.hold_seconds,
+                                           max_advance=args.horizon_hours * 3600 + 86400, sweep_interval=1)
+                engine.load({})
+                engine.start()
+                engines.append(engine)
+
+        base = (int(time.time()) // 3600 + 1) * 3600
+        clients = [Client(i, engines[i % len(engines)], args, lot_ids, base) for i in range(args.threads)]
+        recorder, elapsed = run_load(lambda i: clients[i].step(), concurrency=args.threads,
+                                     duration=args.duration, recorder=LatencyRecorder())
+        if not naive:
+            for engine in engines:
+                engine.stop()
+
+        summary = recorder.summary(elapsed)
+        operations = summary['operations']
+        statuses = {name: operation['statuses'] for name, operation in operations.items()}
+        holds = operations.get('hold', {}).get('statuses', {})
+        bookings = {
+            'operationsPerSecond': summary['overall']['throughput'],
+            'holdAttempts': sum(holds.values()),
+            'holds': holds.get('201', 0),
+            'holdConflicts': holds.get('409', 0),
+            'confirmed': sum(len(client.confirmed) for client in clients),
+            'confirmedPerSecond': round(sum(len(client.confirmed) for client in clients) / elapsed, 1),
+            'doubleBookingsClient': client_double_bookings(clients),
+            'doubleBookingsStore': store_double_bookings(path) if (naive or args.store == 'sqlite') else None,
+        }
+        if not naive:
+            bookings['scheduleOverlaps'] = sum(len(engine.check_schedules()) for engine in engines)
+            bookings['storeConflicts'] = sum(engine.store_conflicts for engine in engines)
+        return {'bookings': bookings, 'statuses': statuses}, operations
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark reservations under high contention')
+    parser.add_argument('--threads', type=int, default=32, help='Booking threads (default 32)')
+    parser.add_argument('--workers', type=int, default=2, help='Engines sharing the store, like app workers (default 2)')
+    parser.add_argument('--store', choices=('sqlite', 'none'), default='sqlite', help='Engine store (default sqlite)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run (default 10)')
+    parser.add_argument('--lots', type=int, default=1, help='Lots (default 1)')
+    parser.add_argument('--spots', type=int, default=10, help='Spots per lot (default 10)')
+    parser.add_argument('--horizon-hours', type=int, default=48, help='Windows start within this many hours (default 48)')
+    parser.add_argument('--slot-minutes', type=int, default=30, help='Window granularity (default 30)')
+    parser.add_argument('--max-slots', type=int, default=4, help='Longest window in slots (default 4)')
+    parser.add_argument('--any-spot', type=float, default=0.5, help='Share of holds on any free spot (default 0.5)')
+    parser.add_argument('--confirm-share', type=float, default=0.7, help='Share of holds confirmed (default 0.7)')
+    parser.add_argument('--cancel-share', type=float, default=0.1, help='Share of holds cancelled; the rest expire (default 0.1)')
+    parser.add_argument('--cancel-confirmed', type=float, default=0.5, help='Share of confirmed reservations cancelled later (default 0.5)')
+    parser.add_argument('--hold-seconds', type=float, default=1.0, help='Hold expiry (default 1)')
+    parser.add_argument('--naive', action='store_true', help='Also run the read-then-write baseline')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed (default 42)')
+    parser.add_argument('--output', help='Result file (default benchmarks/results/reservations-<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline result file; exit 1 on regressions')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed p95/throughput regression vs baseline (default 0.2)')
+    return parser
+
+
+def print_run(label, result, operations):
+    bookings = result['bookings']
+    print(f"{label}: {bookings['operationsPerSecond']:.0f} ops/s, {bookings['holdAttempts']} hold attempts "
+          f"({bookings['holds']} held, {bookings['holdConflicts']} conflicts), "
+          f"{bookings['confirmed']} confirmed ({bookings['confirmedPerSecond']}/s)")
+    print(f"{'operation':<10}{'ops':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, operation in operations.items():
+        latency = operation['latencyMs']
+        print(f"{name:<10}{operation['requests']:>8}{operation['throughput']:>10.0f}"
+              f"{latency['p50']:>10.3f}{latency['p95']:>10.3f}{latency['p99']:>10.3f}")
+    store = bookings['doubleBookingsStore']
+    marker = '✅' if bookings['doubleBookingsClient'] == 0 and not store else '❌'
+    print(f"{marker} Double bookings: {bookings['doubleBookingsClient']} (client check), "
+          f"{'-' if store is None else store} (store check)")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.naive and args.store == 'none':
+        print("--naive needs the SQLite store", file=sys.stderr)
+        return 2
+
+    print(f"🅿️ {args.threads} threads, {args.workers} worker engine(s), {args.lots} lot(s) x {args.spots} spots, "
+          f"{args.duration:g} s")
+    result, operations = run(args)
+    print_run('engine', result, operations)
+
+    results = {
+        'benchmark': 'reservations',
+        'environment': environment_info(),
+        'config': {
+            'threads': args.threads,
+            'workers': args.workers,
+            'store': args.store,
+            'duration': args.duration,
+            'lots': args.lots,
+            'spots': args.spots,
+            'horizonHours': args.horizon_hours,
+            'slotMinutes': args.slot_minutes,
+            'maxSlots': args.max_slots,
+            'anySpot': args.any_spot,
+            'confirmShare': args.confirm_share,
+            'cancelShare': args.cancel_share,
+            'cancelConfirmed': args.cancel_confirmed,
+            'holdSeconds': args.hold_seconds,
+            'seed': args.seed,
+        },
+        'bookings': result['bookings'],
+        'results': {'operations': operations},
+    }
+    double_booked = result['bookings']['doubleBookingsClient'] or result['bookings']['doubleBookingsStore']
+
+    if args.naive:
+        naive_result, naive_operations = run(args, naive=True)
+        print_run('naive read-then-write', naive_result, naive_operations)
+        results['naive'] = naive_result['bookings']
+
+    path = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results', f'reservations-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    )
+    print(f"💾 Results written to {write_results(path, results)}")
+
+    if double_booked:
+        return 1
+    if args.compare:
+        regressions = compare_results(load_results(args.compare), results, args.max_regression)
+        for name, description in regressions:
+            print(f"⚠️ Regression in {name}: {description}")
+        if regressions:
+            return 1
+        print(f"✅ No regressions beyond {args.max_regression:.0%} vs {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
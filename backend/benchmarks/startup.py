@@ -0,0 +1,212 @@
+"""
+Cold start benchmark.
+
+Starts the app in fresh interpreters, the way an autoscaled container does,
+and times each phase of a start:
+
+    interpreter   process launch until the first line of Python runs
+    import        `import app` (module-level setup, no Firebase)
+    init          create_app(): Firebase / user store, static payloads
+    warm_up       until /readyz answers 200 (bcrypt workers, Google keys, ...)
+    request       the first request through the app
+    ready         process launch until ready, i.e. what a load balancer waits for
+
+Every run also records which heavy dependencies were already loaded after
+`import app`; they should only be loaded on first use. --importtime lists
+the slowest imports pulled in by app.py (python -X importtime).
+
+    cd backend
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.startup --store firestore   # needs firebase-key.json
+    python -m benchmarks.startup --compare benchmarks/results/startup-baseline.json
+
+Results are written as JSON to benchmarks/results/ (see harness.py).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import (
+    LatencyRecorder, compare_results, environment_info, load_results, write_results
+)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ('interpreter', 'import', 'init', 'warm_up', 'request', 'ready')
+
+# Modules app.py should not import until they are used
+LAZY_MODULES = ('firebase_admin', 'google.cloud.firestore', 'grpc', 'requests', 'dotenv', 'numpy', 'jwt', 'cryptography')
+
+# Runs in the child interpreter; reports wall-clock timestamps as one JSON line
+CHILD = r'''
+import json, sys, time
+started = time.time()
+import app
+imported = time.time()
+lazy_loaded = [name for name in LAZY_MODULES if name in sys.modules]
+app.create_app()
+initialized = time.time()
+app.services_ready.wait()
+ready = time.time()
+response = app.app.test_client().get('/readyz')
+answered = time.time()
+app.shutdown()
+print(json.dumps({
+    'started': started, 'imported': imported, 'initialized': initialized,
+    'ready': ready, 'answered': answered, 'status': response.status_code,
+    'lazyLoaded': lazy_loaded, 'modules': len(sys.modules)
+}))
+'''
+
+
+def child_environment(args):
+    env = dict(os.environ)
+    env['USER_STORE'] = args.store
+    if args.store == 'sqlite':
+        env['SQLITE_PATH'] = ':memory:'
+    env.setdefault('HISTORY_PATH', '')  # Don't write history snapshots into the checkout
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    if args.bcrypt_workers is not None:
+        env['BCRYPT_WORKERS'] = str(args.bcrypt_workers)
+    if not args.google:
+        # An empty client id skips fetching Google's keys during warm-up
+        env['GOOGLE_CLIENT_ID'] = ''
+    return env
+
+
+def start_once(env):
+    """One cold start; returns the child's timestamps plus the launch time"""
+    launched = time.time()
+    completed = subprocess.run(
+        [sys.executable, '-c', f'LAZY_MODULES = {LAZY_MODULES!r}\n' + CHILD],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'child failed')
+    # App logs share stdout; the report is the last line
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    report['launched'] = launched
+    return report
+
+
+def phase_durations(report):
+    """Milliseconds per phase of one start"""
+    marks = [report['launched'], report['started'], report['imported'],
+             report['initialized'], report['ready'], report['answered']]
+    durations = {name: (end - start) * 1000 for name, start, end in zip(PHASES, marks, marks[1:])}
+    durations['ready'] = (report['ready'] - report['launched']) * 1000
+    return durations
+
+
+def slowest_imports(env, top):
+    """Direct imports of app.py by cumulative import time (one -X importtime run)"""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    imports = []
+    pending = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        if not cumulative.strip().isdigit():
+            continue  # Header line
+        # Children are printed before their parent, two spaces deeper per level
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        module = name.strip()
+        if depth == 1:
+            pending.append((module, int(cumulative) / 1000))
+        elif depth == 0:
+            if module == 'app':
+                imports = pending
+            pending = []
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return [{'module': module, 'cumulativeMs': round(ms, 1)} for module, ms in imports[:top]]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Measure cold start time of the app')
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts to measure (default 5)')
+    parser.add_argument('--store', choices=['sqlite', 'firestore'], default='sqlite', help='USER_STORE of the started app')
+    parser.add_argument('--bcrypt-workers', type=int, help='BCRYPT_WORKERS of the started app (default: app default)')
+    parser.add_argument('--google', action='store_true', help="Keep GOOGLE_CLIENT_ID, so warm-up fetches Google's keys")
+    parser.add_argument('--importtime', type=int, default=10, metavar='N', help='List the N slowest imports of app.py (0 skips)')
+    parser.add_argument('--output', help='Result file (default benchmarks/results/startup-<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline result file; exit 1 on regressions')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed p95 regression vs baseline (default 0.2)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    env = child_environment(args)
+
+    print(f"🏁 Starting the app {args.runs} times ({args.store} store)...")
+    recorder = LatencyRecorder()
+    lazy_loaded = set()
+    modules = []
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        try:
+            report = start_once(env)
+        except (RuntimeError, subprocess.TimeoutExpired, ValueError) as e:
+            print(f"❌ Start failed: {e}")
+            return 2
+        for phase, ms in phase_durations(report).items():
+            recorder.record(phase, ms, report['status'])
+        lazy_loaded.update(report['lazyLoaded'])
+        modules.append(report['modules'])
+    elapsed = time.perf_counter() - started
+
+    summary = recorder.summary(elapsed)
+    results = {
+        'benchmark': 'startup',
+        'environment': environment_info(),
+        'config': {
+            'runs': args.runs,
+            'store': args.store,
+            'bcryptWorkers': args.bcrypt_workers,
+            'google': args.google,
+        },
+        'elapsedSeconds': round(elapsed, 3),
+        # Starts run one after another; requests/second means nothing here
+        'results': {'operations': {
+            phase: {key: value for key, value in summary['operations'][phase].items() if key != 'throughput'}
+            for phase in PHASES
+        }},
+        'lazyModulesLoadedAtImport': sorted(lazy_loaded),
+        'modulesLoaded': max(modules),
+        'slowestImports': slowest_imports(env, args.importtime) if args.importtime else [],
+    }
+
+    print(f"{'phase':<12}{'p50':>10}{'p95':>10}{'max':>10}")
+    for phase in PHASES:
+        latency = results['results']['operations'][phase]['latencyMs']
+        print(f"{phase:<12}{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['max']:>10.1f}")
+    print(f"📦 {results['modulesLoaded']} modules loaded")
+    if lazy_loaded:
+        print(f"⚠️ Loaded by `import app` although only needed later: {', '.join(sorted(lazy_loaded))}")
+    for entry in results['slowestImports']:
+        print(f"   {entry['cumulativeMs']:>8.1f} ms  {entry['module']}")
+
+    path = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results', f'startup-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    )
+    print(f"💾 Results written to {write_results(path, results)}")
+
+    if args.compare:
+        regressions = compare_results(load_results(args.compare), results, args.max_regression)
+        for name, description in regressions:
+            print(f"⚠️ Regression in {name}: {description}")
+        if regressions:
+            return 1
+        print(f"✅ No regressions beyond {args.max_regression:.0%} vs {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+Google ID token signing keys.
+
+google.oauth2.id_token.verify_oauth2_token() downloads Google's signing
+certificates on every call. Google publishes how long those keys may be
+cached (Cache-Control: max-age, usually several hours), so we keep them in
+memory for that long, fetch them over a long-lived pooled HTTP session, and
+verify ID token signatures locally in the common case.
+
+The key source is pluggable: anything callable returning
+``(jwks_dict, max_age_seconds)`` works, e.g. StaticCertSource with a local
+stand-in JWKS for tests that must not touch the network.
+"""
+
+import asyncio
+import inspect
+import logging
+import re
+import threading
+import time
+
+# jwt is imported where it is used: PyJWT imports cryptography with it, and
+# deployments without Google sign-in never need either (see token_keys.py)
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+_MAX_AGE_RE = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_max_age(cache_control):
+    """Return max-age in seconds from a Cache-Control header, or None"""
+    if not cache_control:
+        return None
+    if 'no-store' in cache_control.lower() or 'no-cache' in cache_control.lower():
+        return 0
+    match = _MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else None
+
+
+class HttpCertSource:
+    """Fetch a JWKS document over a pooled, long-lived HTTP session"""
+
+    def __init__(self, url=GOOGLE_CERTS_URL, session=None, timeout=5, pool_size=10):
+        self.url = url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # Created on the first fetch: importing requests is a noticeable part of app startup
+        self.session = session
+
+    def _new_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=2)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def __call__(self):
+        if self.session is None:
+            self.session = self._new_session()
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json(), parse_max_age(response.headers.get('Cache-Control'))
+
+
+class AsyncHttpCertSource:
+    """Fetch a JWKS document with a pooled httpx.AsyncClient (async serving mode)"""
+
+    def __init__(self, url=GOOGLE_CERTS_URL, client=None, timeout=5, pool_size=10):
+        import httpx
+
+        self.url = url
+        self.client = client or httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    async def __call__(self):
+        response = await self.client.get(self.url)
+        response.raise_for_status()
+        return response.json(), parse_max_age(response.headers.get('Cache-Control'))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class StaticCertSource:
+    """Serve a fixed JWKS document, e.g. a local stand-in for Google in tests"""
+
+    def __init__(self, jwks, max_age=3600):
+        self.jwks = jwks
+        self.max_age = max_age
+
+    def __call__(self):
+        return self.jwks, self.max_age
+
+
+class GoogleCertCache:
+    """Signing keys by kid, refreshed when their Cache-Control max-age runs out"""
+
+    def __init__(self, source, default_max_age=300, min_refresh_interval=30,
+                 clock=time.monotonic):
+        self.source = source
+        self.default_max_age = default_max_age
+        # Unknown kids trigger a refresh, but not more often than this
+        self.min_refresh_interval = min_refresh_interval
+        self._clock = clock
+        self._keys = {}
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._async_lock = None
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.hits = 0
+
+    def _install(self, jwks, max_age):
+        import jwt
+
+        keys = {}
+        for jwk in jwt.PyJWKSet.from_dict(jwks).keys:
+            keys[jwk.key_id] = jwk.key
+        if max_age is None:
+            max_age = self.default_max_age
+        self._keys = keys
+        self._expires_at = self._fetched_at + max_age
+
+    def _fetch_failed(self, error):
+        self.fetch_errors += 1
+        if not self._keys:
+            raise error
+        # Keep serving the keys we have rather than failing every login
+        logger.warning(f"Google cert refresh failed, using cached keys: {error}")
+        self._expires_at = self._fetched_at + self.min_refresh_interval
+
+    def _cached_key(self, kid):
+        if self._clock() < self._expires_at and kid in self._keys:
+            self.hits += 1
+            return True, self._keys[kid]
+        return False, None
+
+    def _needs_fetch(self, kid):
+        now = self._clock()
+        expired = now >= self._expires_at
+        unknown_kid = kid not in self._keys
+        can_refetch = (self._fetched_at is None
+                       or now - self._fetched_at >= self.min_refresh_interval)
+        if expired or (unknown_kid and can_refetch):
+            self._fetched_at = now
+            self.fetches += 1
+            return True
+        return False
+
+    def get_key(self, kid):
+        """Return the public key for kid, fetching the key set if needed"""
+        found, key = self._cached_key(kid)
+        if found:
+            return key
+
+        with self._lock:
+            if self._needs_fetch(kid):
+                try:
+                    self._install(*self.source())
+                except Exception as e:
+                    self._fetch_failed(e)
+            return self._keys.get(kid)
+
+    def prefetch(self):
+        """Fetch the key set now (startup warm-up) instead of on the first sign-in"""
+        with self._lock:
+            self._fetched_at = self._clock()
+            self.fetches += 1
+            try:
+                self._install(*self.source())
+            except Exception as e:
+                self._fetch_failed(e)
+        return len(self._keys)
+
+    async def get_key_async(self, kid):
+        """get_key() for the async serving mode; the source may be a coroutine"""
+        found, key = self._cached_key(kid)
+        if found:
+            return key
+
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            if self._needs_fetch(kid):
+                try:
+                    result = self.source()
+                    if inspect.isawaitable(result):
+                        result = await result
+                    self._install(*result)
+                except Exception as e:
+                    self._fetch_failed(e)
+            return self._keys.get(kid)
+
+    def stats(self):
+        return {
+            'keys': len(self._keys),
+            'hits': self.hits,
+            'fetches': self.fetches,
+            'fetchErrors': self.fetch_errors,
+            'expiresIn': max(0, round(self._expires_at - self._clock())) if self._keys else 0
+        }
+
+
+def decode_google_id_token(token, cert_cache, audience, clock_skew=10):
+    """Verify an ID token's signature, audience and expiry; return its claims"""
+    import jwt
+
+    header = jwt.get_unverified_header(token)
+    return _decode_with_key(token, cert_cache.get_key(header.get('kid')), audience, clock_skew)
+
+
+async def decode_google_id_token_async(token, cert_cache, audience, clock_skew=10):
+    """decode_google_id_token() for the async serving mode"""
+    import jwt
+
+    header = jwt.get_unverified_header(token)
+    key = await cert_cache.get_key_async(header.get('kid'))
+    return _decode_with_key(token, key, audience, clock_skew)
+
+
+def _decode_with_key(token, key, audience, clock_skew):
+    import jwt
+
+    if key is None:
+        raise ValueError('Token signed with an unknown key')
+
+    idinfo = jwt.decode(
+        token,
+        key,
+        algorithms=['RS256'],
+        audience=audience,
+        leeway=clock_skew,
+        options={'require': ['exp', 'iat', 'aud', 'iss', 'sub']}
+    )
+
+    if idinfo['iss'] not in GOOGLE_ISSUERS:
+        raise ValueError('Wrong issuer.')
+    return idinfo
@@ -0,0 +1,128 @@
+"""
+Write-behind buffer for login bookkeeping.
+
+Every successful login used to read loginCount, add one, and write the
+user document back on the request path: an extra round-trip per login, and
+concurrent logins overwrote each other's increments. LoginWriter buffers
+those updates in memory instead and a background thread flushes them
+periodically through the user store as batched writes with atomic
+increments, so a burst of logins becomes a handful of batch commits.
+"""
+
+import logging
+import threading
+import time
+
+from user_store import LoginsNotRecorded
+
+logger = logging.getLogger(__name__)
+
+
+class LoginWriter:
+    """Buffers lastLogin/loginCount updates and flushes them in batches"""
+
+    def __init__(self, user_store, flush_interval=2.0, max_batch=500, on_flushed=None):
+        self.user_store = user_store
+        # flush_interval <= 0 writes through on every record()
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.on_flushed = on_flushed
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+
+    def _ensure_thread(self):
+        # Started on first use, so it runs in the process that serves requests
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='login-writer', daemon=True)
+            self._thread.start()
+
+    def record(self, user_id, when):
+        """Queue one login; returns this user's logins queued since the last flush"""
+        with self._lock:
+            count, last_login = self._pending.get(user_id, (0, when))
+            count += 1
+            self._pending[user_id] = (count, max(last_login, when))
+            self.recorded += 1
+            full = len(self._pending) >= self.max_batch
+
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+            if full:
+                self._wakeup.set()
+        return count
+
+    def flush(self):
+        """Write everything buffered so far; failed updates are kept for retry"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                self.user_store.record_logins(pending)
+                failed = {}
+            except LoginsNotRecorded as e:
+                # Part of the batch is written: only the rest may be retried
+                failed = e.logins
+                error = e
+            except Exception as e:
+                failed = pending
+                error = e
+
+            if failed:
+                self.failures += 1
+                logger.error(f"Login bookkeeping flush failed ({len(failed)} of {len(pending)} users), will retry: {error}")
+                with self._lock:
+                    for user_id, (count, last_login) in failed.items():
+                        newer_count, newer_login = self._pending.get(user_id, (0, last_login))
+                        self._pending[user_id] = (count + newer_count, max(last_login, newer_login))
+
+            written = [user_id for user_id in pending if user_id not in failed]
+            if not written:
+                return 0
+            self.flushes += 1
+            self.written += len(written)
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            if self.on_flushed:
+                self.on_flushed(written)
+            return len(written)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        """Stop the background thread and write whatever is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pendingUsers': pending,
+            'recorded': self.recorded,
+            'flushes': self.flushes,
+            'written': self.written,
+            'failures': self.failures,
+            'lastFlushMs': self.last_flush_ms,
+            'flushIntervalSeconds': self.flush_interval
+        }
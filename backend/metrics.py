@@ -0,0 +1,180 @@
+"""
+Latency histograms in Prometheus exposition format.
+
+Every request thread records into its own shard (a dict of label values ->
+bucket counts), so observe() takes no lock and never contends with other
+requests. A lock is only taken when a thread records for the first time and
+when /metrics is scraped, which sums the shards. Shards of threads that have
+exited are folded into a retired total, so servers that spawn a thread per
+request do not accumulate them.
+
+Buckets follow Prometheus conventions: upper bounds in seconds, cumulative
+counts, plus _sum and _count per label set.
+"""
+
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    return f'{bound:g}'
+
+
+class Histogram:
+    """Labelled latency histogram with per-thread shards"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) of live threads
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self):
+        # Per-bucket (non-cumulative) counts, the +Inf bucket, then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._retire_dead_threads()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_threads(self):
+        # Caller holds the lock; a dead thread no longer writes its shard
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    def _merge(self, into, shard):
+        # list() copies the items in one step, the owner thread may add series meanwhile
+        for labels, series in list(shard.items()):
+            total = into.get(labels)
+            if total is None:
+                total = into[labels] = self._new_series()
+            for i, value in enumerate(list(series)):
+                total[i] += value
+
+    def observe(self, seconds, *labels):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            series = shard[labels] = self._new_series()
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def wrap(self, func, *labels):
+        """Time every call of func (plain function or coroutine function)"""
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+            return timed_async
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - started, *labels)
+        return timed
+
+    def timer(self, *labels):
+        """Decorator form of wrap()"""
+        return lambda func: self.wrap(func, *labels)
+
+    def collect(self):
+        """{labels: series} summed over all threads"""
+        totals = {}
+        with self._lock:
+            self._retire_dead_threads()
+            self._merge(totals, self._retired)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+        return totals
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        bounds = [_format_bound(bound) for bound in self.buckets] + ['+Inf']
+        for labels, series in sorted(self.collect().items()):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            braces = f'{{{label_text}}}' if label_text else ''
+            lines.append(f'{self.name}_sum{braces} {series[-1]:.6f}')
+            lines.append(f'{self.name}_count{braces} {cumulative}')
+        return lines
+
+
+class TimedProxy:
+    """Times selected methods of an object; everything else passes through"""
+
+    def __init__(self, target, histogram, dependency, methods):
+        self._target = target
+        for method_name in methods:
+            method = getattr(target, method_name, None)
+            if callable(method):
+                setattr(self, method_name, histogram.wrap(method, dependency, method_name))
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class MetricsRegistry:
+    """The histograms served by /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
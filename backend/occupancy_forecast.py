@@ -0,0 +1,214 @@
+"""
+Occupancy forecasts for /api/parking/forecast.
+
+A forecast is the lot's usual occupancy at that hour of the week (its
+seasonal profile) plus how far it is from usual right now (its recent
+trend), which fades the further ahead the forecast looks:
+
+    forecast(t) = profile[hour_of_week(t)] + anomaly * 0.5 ** ((t - now) / half_life)
+
+The profile is the mean of the hourly history tier per lot and hour of the
+week. The anomaly is a recency-weighted mean of the last `trend_hours` of
+fine samples minus the profile. Lots without a profile for that hour fall
+back to their latest sample.
+
+Nothing is computed per request. A background thread recomputes the whole
+horizon for all lots every `interval` seconds as NumPy array operations on
+the history's ring buffers, and a request interpolates between two
+precomputed hourly points. NumPy is imported on first use, so importing
+the app stays cheap.
+
+Hours of the week are counted in UTC. Profiles and forecasts use the same
+clock, so a lot's local time zone does not matter.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from occupancy_history import MISSING, SCALE
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_WEEK = 168
+WEEK_SECONDS = HOURS_PER_WEEK * 3600
+STEP_SECONDS = 3600  # Precomputed points are an hour apart
+
+
+def hour_of_week(epochs):
+    """0 (Monday 00:00 UTC) .. 167 for an array of epoch seconds"""
+    days = epochs // 86400
+    # 1970-01-01 was a Thursday, day 3 of a Monday-based week
+    return ((days + 3) % 7) * 24 + (epochs % 86400) // 3600
+
+
+class Forecast:
+    """Precomputed occupancy of every lot at hourly points from `start`"""
+
+    def __init__(self, lot_ids, start, values, computed_at):
+        self.rows = {lot_id: row for row, lot_id in enumerate(lot_ids)}
+        self.start = start
+        self.values = values  # float32 array, lots x points, NaN where unknown
+        self.computed_at = computed_at
+
+    @property
+    def end(self):
+        return self.start + (self.values.shape[1] - 1) * STEP_SECONDS
+
+    def occupancy(self, lot_id, eta):
+        """Occupancy (0..1) of a lot at epoch `eta`, or None if there is no data"""
+        row = self.rows[lot_id]
+        position = max(0.0, (eta - self.start) / STEP_SECONDS)
+        index = min(int(position), self.values.shape[1] - 1)
+        fraction = position - index
+        value = float(self.values[row, index])
+        if fraction and index + 1 < self.values.shape[1]:
+            value += (float(self.values[row, index + 1]) - value) * fraction
+        return None if math.isnan(value) else value
+
+
+class OccupancyForecaster:
+    """Seasonal profile plus recent trend for all lots, recomputed on a schedule"""
+
+    def __init__(self, history, horizon_hours=24, trend_hours=3, half_life_hours=2, interval=900):
+        self.history = history
+        self.horizon_hours = horizon_hours
+        self.trend_hours = trend_hours
+        self.half_life = half_life_hours * 3600
+        self.interval = interval  # Seconds between recomputations
+        self.forecast = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self.computations = 0
+        self.failures = 0
+        self.last_compute_ms = 0.0
+
+    def _profile_interval(self):
+        # The coarsest tier that still resolves hours
+        intervals = [tier.interval for tier in self.history.tiers if STEP_SECONDS % tier.interval == 0]
+        if not intervals:
+            raise ValueError('Forecasts need a history tier of an hour or finer')
+        return max(intervals)
+
+    def compute(self, now=None):
+        """Recompute all forecasts from the history; returns the number of lots"""
+        import numpy as np
+
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        profile_interval = self._profile_interval()
+        recent_interval = self.history.interval
+        lot_ids, tiers = self.history.export({profile_interval, recent_interval})
+        if not lot_ids or tiers[recent_interval][0] is None:
+            return 0
+
+        profile = self._profile(np, len(lot_ids), profile_interval, *tiers[profile_interval])
+        anomaly, latest, latest_at = self._recent(np, len(lot_ids), profile, recent_interval, *tiers[recent_interval])
+
+        # Hourly points from now to the horizon, all lots at once
+        times = now + np.arange(self.horizon_hours + 1) * STEP_SECONDS
+        decay = 0.5 ** ((times - latest_at) / self.half_life)
+        values = profile[:, hour_of_week(times.astype(np.int64))] + anomaly[:, None] * decay[None, :]
+        # No profile for that hour: assume the lot stays as it was last seen
+        values = np.where(np.isnan(values), latest[:, None], values)
+        values = np.clip(values, 0.0, 1.0).astype(np.float32)
+
+        self.forecast = Forecast(lot_ids, now, values, now)
+        self.computations += 1
+        self.last_compute_ms = round((time.perf_counter() - started) * 1000, 2)
+        return len(lot_ids)
+
+    @staticmethod
+    def _profile(np, rows, interval, last_bucket, slots, raw):
+        """Mean occupancy per lot and hour of the week (rows x 168, NaN where never seen)"""
+        profile = np.full((rows, HOURS_PER_WEEK), np.nan)
+        if last_bucket is None:
+            return profile
+        data = np.frombuffer(raw, dtype=np.uint16).reshape(-1, slots)[:rows]
+        valid = data != MISSING
+        sums = np.where(valid, data, 0).astype(np.float32)
+        counts = valid.astype(np.float32)
+        # A ring that holds whole weeks has every slot at a fixed hour of the
+        # week: fold the weeks onto each other first (float32 sums of
+        # values <= SCALE stay exact)
+        period = WEEK_SECONDS // interval
+        if slots % period == 0:
+            sums = sums.reshape(rows, -1, period).sum(axis=1)
+            counts = counts.reshape(rows, -1, period).sum(axis=1)
+            period_slots = period
+        else:
+            period_slots = slots
+
+        # Slot -> hour of the week as a one-hot matrix; summing each lot's
+        # slots per hour is then a matrix product
+        buckets = np.arange(last_bucket - period_slots + 1, last_bucket + 1, dtype=np.int64)
+        hours = np.zeros((period_slots, HOURS_PER_WEEK), dtype=np.float32)
+        hours[buckets % period_slots, hour_of_week(buckets * interval)] = 1.0
+        sums = sums @ hours
+        counts = counts @ hours
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(sums, counts * SCALE, out=profile, where=counts > 0)
+        return profile
+
+    def _recent(self, np, rows, profile, interval, last_bucket, slots, raw):
+        """(anomaly vs the profile, latest occupancy, time of the latest samples) per lot"""
+        count = max(1, min(slots, self.trend_hours * 3600 // interval))
+        buckets = np.arange(last_bucket - count + 1, last_bucket + 1, dtype=np.int64)
+        data = np.frombuffer(raw, dtype=np.uint16).reshape(-1, slots)[:rows][:, buckets % slots]
+        valid = data != MISSING
+        observed = np.where(valid, data / SCALE, np.nan)
+        times = buckets * interval
+
+        expected = profile[:, hour_of_week(times)]
+        residual = observed - expected
+        weights = np.where(np.isnan(residual), 0.0, 0.5 ** ((times[-1] - times) / self.half_life))
+        total = weights.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            anomaly = np.where(total > 0, np.nansum(residual * weights, axis=1) / total, 0.0)
+
+        # Latest valid sample per lot: index of the last True in each row
+        last_valid = count - 1 - np.argmax(valid[:, ::-1], axis=1)
+        latest = np.where(valid.any(axis=1), observed[np.arange(len(observed)), last_valid], np.nan)
+        return anomaly, latest, float(times[-1])
+
+    def lookup(self, lot_id, eta):
+        """{'occupancy', 'computedAt'} for a lot at epoch `eta`, or None before the first computation
+
+        Raises KeyError for an unknown lot and ValueError for an eta outside the horizon.
+        """
+        forecast = self.forecast
+        if forecast is None:
+            return None
+        # A little slack for forecasts that are up to one interval old
+        if eta < forecast.start - self.interval or eta > forecast.end:
+            raise ValueError(f'eta must be within the next {self.horizon_hours} hours')
+        return {'occupancy': forecast.occupancy(lot_id, eta), 'computedAt': forecast.computed_at}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='occupancy-forecast', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.compute()
+            except Exception:
+                self.failures += 1
+                logger.exception("Occupancy forecast failed")
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        forecast = self.forecast
+        return {
+            'lots': len(forecast.rows) if forecast else 0,
+            'computations': self.computations,
+            'failures': self.failures,
+            'lastComputeMs': self.last_compute_ms,
+            'secondsSinceCompute': round(time.time() - forecast.computed_at) if forecast else None,
+            'horizonHours': self.horizon_hours,
+            'intervalSeconds': self.interval
+        }
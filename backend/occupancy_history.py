@@ -0,0 +1,448 @@
+"""
+Occupancy history of every lot, kept in process.
+
+A sampler records each lot's occupancy (occupied / capacity, in per mille)
+from the nearby index at a fixed interval. Samples go into preallocated
+ring buffers, one per tier, and never into the store:
+
+    300:576      5-minute samples for 2 days
+    3600:1344    hourly means for 8 weeks
+    86400:730    daily means for 2 years
+
+Each tier is a single array('H') with one row of `slots` values per lot.
+A sample's slot is its bucket number (time // interval) modulo `slots`, so
+there is no head pointer to maintain, and reading a time range of one lot
+is a slice or two of its row. Coarser tiers are downsampled as samples
+arrive: every tier keeps a running sum and count per lot for its current
+bucket and writes the mean when the bucket completes. With the default
+tiers, a lot takes about 5 KB; 10k lots take about 50 MB.
+
+The arrays are snapshotted periodically (and on shutdown) to one file
+written through mmap, and loaded back from it on start, so a restart costs
+a few memcpys instead of losing the history. Buckets missed while the
+process was down read as gaps.
+
+Under serve.py every worker keeps its own history but they share the
+snapshot path. Only one of them writes it: the worker holding an exclusive
+flock on `<path>.lock` (taken without blocking, kept until it stops, and
+retried by the others on every snapshot interval, so another worker takes
+over when the writer exits). Each snapshot goes to its own temporary file
+in the same directory before it replaces the old one.
+"""
+
+import json
+import logging
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; a single process snapshots without a lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MISSING = 0xFFFF  # No sample in this slot
+SCALE = 1000  # Stored values are occupancy in per mille
+SNAPSHOT_MAGIC = b'SPOCCH1\n'
+DEFAULT_TIERS = '300:576,3600:1344,86400:730'
+
+
+def parse_tiers(spec):
+    """[(interval seconds, slots)] from 'interval:slots,...', finest first"""
+    tiers = []
+    for part in spec.split(','):
+        interval, slots = (int(value) for value in part.split(':'))
+        if interval <= 0 or slots <= 0:
+            raise ValueError(f'Invalid history tier: {part}')
+        if tiers and interval % tiers[-1][0]:
+            raise ValueError(f'Tier interval {interval} is not a multiple of {tiers[-1][0]}')
+        tiers.append((interval, slots))
+    if not tiers:
+        raise ValueError('At least one history tier is required')
+    return tiers
+
+
+class Tier:
+    """Ring buffers of one resolution, plus the running means of its current bucket"""
+
+    def __init__(self, interval, slots):
+        self.interval = interval
+        self.slots = slots
+        self.values = array('H')  # rows * slots
+        self.sums = array('d')  # Per row, of the bucket being accumulated
+        self.counts = array('I')
+        self.last_bucket = None  # Newest bucket written to `values`
+        self.open_bucket = None  # Bucket `sums`/`counts` belong to
+
+    def add_rows(self, rows):
+        self.values.extend(array('H', [MISSING]) * (rows * self.slots))
+        self.sums.extend(array('d', [0.0]) * rows)
+        self.counts.extend(array('I', [0]) * rows)
+
+    @property
+    def rows(self):
+        return len(self.counts)
+
+    def advance(self, bucket):
+        """Make `bucket` the newest one, clearing the slots of buckets that were skipped"""
+        if self.last_bucket is not None and bucket - self.last_bucket >= self.slots:
+            # Down for longer than the ring holds: nothing is left
+            self.values = array('H', [MISSING]) * len(self.values)
+        elif self.last_bucket is not None:
+            gap = array('H', [MISSING]) * self.rows
+            for skipped in range(self.last_bucket + 1, bucket):
+                self.values[skipped % self.slots::self.slots] = gap
+        self.last_bucket = bucket
+
+    def write(self, bucket, samples):
+        """Store one value per row (array('H'), MISSING allowed) as `bucket`"""
+        self.advance(bucket)
+        # Row-major layout: a bucket is a column, every `slots`-th value
+        self.values[bucket % self.slots::self.slots] = samples
+
+    def accumulate(self, bucket, samples):
+        """Add samples to the running means; writes the previous bucket's means once it is complete"""
+        if self.open_bucket is not None and bucket != self.open_bucket:
+            means = array('H', [
+                round(total / count) if count else MISSING
+                for total, count in zip(self.sums, self.counts)
+            ])
+            self.write(self.open_bucket, means)
+            self.sums = array('d', [0.0]) * self.rows
+            self.counts = array('I', [0]) * self.rows
+        self.open_bucket = bucket
+        sums, counts = self.sums, self.counts
+        for row, value in enumerate(samples):
+            if value != MISSING:
+                sums[row] += value
+                counts[row] += 1
+
+    def read(self, row, first, last):
+        """Stored values of buckets first..last (inclusive) of one row; must be within retention"""
+        base = row * self.slots
+        start, end = first % self.slots, last % self.slots
+        if start <= end:
+            return self.values[base + start:base + end + 1].tolist()
+        return self.values[base + start:base + self.slots].tolist() + self.values[base:base + end + 1].tolist()
+
+    def retained(self):
+        """(oldest, newest) bucket held, or None before the first write"""
+        if self.last_bucket is None:
+            return None
+        return self.last_bucket - self.slots + 1, self.last_bucket
+
+
+class OccupancyHistory:
+    """Per-lot occupancy samples in tiered ring buffers, snapshotted to an mmap file"""
+
+    def __init__(self, index, tiers=DEFAULT_TIERS, path=None, snapshot_interval=300, max_points=2000):
+        self.index = index
+        self.tiers = [Tier(interval, slots) for interval, slots in parse_tiers(tiers)]
+        self.path = path  # None keeps the history in memory only
+        self.snapshot_interval = snapshot_interval
+        self.max_points = max_points  # Most values one range query returns
+        self._rows = {}  # lot_id -> row
+        self._lot_ids = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._snapshot_lock = None  # Open lock file while this process is the snapshot writer
+        self.samples = 0
+        self.last_sample_ms = 0.0
+        self.snapshots = 0
+        self.snapshot_errors = 0
+        self.last_snapshot_ms = 0.0
+        self.snapshot_at = None
+        self.restored_at = None
+
+    @property
+    def interval(self):
+        return self.tiers[0].interval
+
+    def _row(self, lot_id):
+        row = self._rows.get(lot_id)
+        if row is None:
+            row = self._rows[lot_id] = len(self._lot_ids)
+            self._lot_ids.append(lot_id)
+            for tier in self.tiers:
+                tier.add_rows(1)
+        return row
+
+    def sample(self, now=None):
+        """Record every lot's current occupancy; returns the number of lots sampled"""
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        lots = self.index.lots()
+        with self._lock:
+            for lot in lots:
+                self._row(lot.id)
+            samples = array('H', [MISSING]) * len(self._lot_ids)
+            for lot in lots:
+                if lot.capacity > 0:
+                    samples[self._rows[lot.id]] = round((lot.capacity - lot.free) * SCALE / lot.capacity)
+
+            finest = self.tiers[0]
+            bucket = int(now // finest.interval)
+            if finest.last_bucket is not None and bucket < finest.last_bucket:
+                return 0  # The clock went backwards
+            finest.write(bucket, samples)
+            for tier in self.tiers[1:]:
+                tier.accumulate(int(now // tier.interval), samples)
+            self.samples += 1
+        self.last_sample_ms = round((time.perf_counter() - started) * 1000, 2)
+        return len(lots)
+
+    def query(self, lot_id, start, end, resolution=None):
+        """Occupancy of a lot between two epoch times, from the finest tier that covers the range
+
+        Returns {'resolution', 'start' (epoch of the first value), 'values' (0..1 or None)}.
+        Raises KeyError for a lot without history and ValueError for an unanswerable range.
+        """
+        if end < start:
+            raise ValueError('from must not be after to')
+        with self._lock:
+            row = self._rows[lot_id]
+            tier = self._pick_tier(start, end, resolution)
+            retained = tier.retained()
+            if retained is None:
+                return {'resolution': tier.interval, 'start': None, 'values': []}
+            first = max(int(start // tier.interval), retained[0])
+            last = min(int(end // tier.interval), retained[1])
+            raw = tier.read(row, first, last) if first <= last else []
+
+        return {
+            'resolution': tier.interval,
+            'start': first * tier.interval if raw else None,
+            'values': [None if value == MISSING else value / SCALE for value in raw]
+        }
+
+    def _pick_tier(self, start, end, resolution):
+        if resolution is not None:
+            for tier in self.tiers:
+                if tier.interval == resolution:
+                    if (end - start) / tier.interval >= self.max_points:
+                        raise ValueError(f'At most {self.max_points} values per query, use a coarser resolution')
+                    return tier
+            raise ValueError(f'resolution must be one of {", ".join(str(tier.interval) for tier in self.tiers)}')
+
+        for tier in self.tiers:
+            retained = tier.retained()
+            covers = retained is None or int(start // tier.interval) >= retained[0]
+            if covers and (end - start) / tier.interval < self.max_points:
+                return tier
+        return self.tiers[-1]
+
+    def export(self, intervals):
+        """(lot ids, {interval: (last bucket, slots, values bytes)}) copied in one consistent step"""
+        with self._lock:
+            return list(self._lot_ids), {
+                tier.interval: (tier.last_bucket, tier.slots, bytes(tier.values))
+                for tier in self.tiers if tier.interval in intervals
+            }
+
+    def aggregate(self, lot_id, start, end, resolution=None):
+        """mean/min/max occupancy of a lot over a range, and how many values were missing"""
+        result = self.query(lot_id, start, end, resolution)
+        present = [value for value in result['values'] if value is not None]
+        return {
+            'resolution': result['resolution'],
+            'start': result['start'],
+            'count': len(present),
+            'missing': len(result['values']) - len(present),
+            'mean': round(sum(present) / len(present), 4) if present else None,
+            'min': min(present) if present else None,
+            'max': max(present) if present else None
+        }
+
+    def _acquire_snapshot_lock(self):
+        """True if this process is (or has just become) the one that writes the snapshot"""
+        if self._snapshot_lock is not None or fcntl is None:
+            return True
+        try:
+            lock = open(f'{self.path}.lock', 'a+b')
+        except OSError as e:
+            logger.error(f"Occupancy history lock {self.path}.lock failed: {e}")
+            return False
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()  # Another worker writes the snapshot
+            return False
+        self._snapshot_lock = lock
+        return True
+
+    def _release_snapshot_lock(self):
+        if self._snapshot_lock is not None:
+            self._snapshot_lock.close()  # Closing drops the flock
+            self._snapshot_lock = None
+
+    def snapshot(self):
+        """Write all tiers to `path` (via a temporary file, replaced atomically); returns bytes written
+
+        Returns 0 without writing while another process holds the snapshot lock.
+        """
+        if not self.path or not self._acquire_snapshot_lock():
+            return 0
+        started = time.perf_counter()
+        with self._lock:
+            header = {
+                'byteorder': sys.byteorder,
+                'lots': list(self._lot_ids),
+                'tiers': [{
+                    'interval': tier.interval,
+                    'slots': tier.slots,
+                    'lastBucket': tier.last_bucket,
+                    'openBucket': tier.open_bucket
+                } for tier in self.tiers]
+            }
+            # Copies, so sampling can go on while the file is written
+            blocks = [bytes(part) for tier in self.tiers for part in (tier.values, tier.sums, tier.counts)]
+
+        encoded = json.dumps(header).encode('utf-8')
+        prefix = SNAPSHOT_MAGIC + len(encoded).to_bytes(4, 'little') + encoded
+        size = len(prefix) + sum(len(block) for block in blocks)
+        temporary = None
+        try:
+            descriptor, temporary = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)), prefix=f'{os.path.basename(self.path)}.', suffix='.tmp'
+            )
+            with open(descriptor, 'wb+') as f:
+                f.truncate(size)
+                with mmap.mmap(f.fileno(), size) as mapped:
+                    mapped[:len(prefix)] = prefix
+                    offset = len(prefix)
+                    for block in blocks:
+                        mapped[offset:offset + len(block)] = block
+                        offset += len(block)
+                    mapped.flush()
+            os.replace(temporary, self.path)
+        except OSError as e:
+            if temporary is not None and os.path.exists(temporary):
+                os.unlink(temporary)
+            self.snapshot_errors += 1
+            logger.error(f"Occupancy history snapshot to {self.path} failed: {e}")
+            return 0
+
+        self.snapshots += 1
+        self.snapshot_at = time.time()
+        self.last_snapshot_ms = round((time.perf_counter() - started) * 1000, 2)
+        return size
+
+    def restore(self):
+        """Load the last snapshot, if there is one that matches the configured tiers; returns lots restored"""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < len(SNAPSHOT_MAGIC) + 4:
+                    raise ValueError('file is too short')
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    restored = self._read_snapshot(mapped)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring occupancy history {self.path}: unreadable snapshot ({e})")
+            return 0
+        if restored is None:
+            return 0
+
+        lot_ids, tiers = restored
+        with self._lock:
+            self.tiers = tiers
+            self._lot_ids = lot_ids
+            self._rows = {lot_id: row for row, lot_id in enumerate(self._lot_ids)}
+        self.restored_at = time.time()
+        return len(lot_ids)
+
+    def _read_snapshot(self, mapped):
+        """(lot ids, tiers) from a mapped snapshot, or None if it does not match this history
+
+        Raises ValueError (or KeyError/TypeError for a malformed header) if the file is damaged.
+        """
+        if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            logger.warning(f"Ignoring occupancy history {self.path}: not a snapshot")
+            return None
+        offset = len(SNAPSHOT_MAGIC)
+        header_size = int.from_bytes(mapped[offset:offset + 4], 'little')
+        offset += 4
+        if offset + header_size > len(mapped):
+            raise ValueError('header is truncated')
+        header = json.loads(mapped[offset:offset + header_size])
+        offset += header_size
+
+        layout = [(tier['interval'], tier['slots']) for tier in header['tiers']]
+        if header['byteorder'] != sys.byteorder or layout != [(t.interval, t.slots) for t in self.tiers]:
+            logger.warning(f"Ignoring occupancy history {self.path}: written with other tiers or byte order")
+            return None
+
+        rows = len(header['lots'])
+        tiers = [Tier(interval, slots) for interval, slots in layout]
+        expected = offset + sum(
+            count * part.itemsize
+            for tier in tiers
+            for part, count in ((tier.values, rows * tier.slots), (tier.sums, rows), (tier.counts, rows))
+        )
+        if len(mapped) != expected:
+            raise ValueError(f'{len(mapped)} bytes, the header describes {expected}')
+
+        for tier, saved in zip(tiers, header['tiers']):
+            for part, count in ((tier.values, rows * tier.slots), (tier.sums, rows), (tier.counts, rows)):
+                size = count * part.itemsize
+                part.frombytes(mapped[offset:offset + size])
+                offset += size
+            tier.last_bucket = saved['lastBucket']
+            tier.open_bucket = saved['openBucket']
+        return list(header['lots']), tiers
+
+    def start(self):
+        """Sample on every interval boundary and snapshot periodically, on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='occupancy-history', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        last_snapshot = time.monotonic()
+        while not self._stopped.is_set():
+            self._stopped.wait(self.interval - time.time() % self.interval)
+            if self._stopped.is_set():
+                break
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Occupancy sample failed")
+            if self.path and time.monotonic() - last_snapshot >= self.snapshot_interval:
+                self.snapshot()
+                last_snapshot = time.monotonic()
+
+    def stop(self):
+        """Stop sampling, write a final snapshot if this process is the writer, and hand the lock on"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self.snapshot()
+        self._release_snapshot_lock()
+
+    def stats(self):
+        with self._lock:
+            lots = len(self._lot_ids)
+            memory = sum(
+                len(part) * part.itemsize
+                for tier in self.tiers for part in (tier.values, tier.sums, tier.counts)
+            )
+        return {
+            'lots': lots,
+            'tiers': [f'{tier.interval}:{tier.slots}' for tier in self.tiers],
+            'memoryBytes': memory,
+            'samples': self.samples,
+            'lastSampleMs': self.last_sample_ms,
+            'snapshots': self.snapshots,
+            'snapshotErrors': self.snapshot_errors,
+            'lastSnapshotMs': self.last_snapshot_ms,
+            'secondsSinceSnapshot': round(time.time() - self.snapshot_at) if self.snapshot_at else None,
+            'snapshotWriter': self._snapshot_lock is not None or (fcntl is None and bool(self.path)),
+            'path': self.path
+        }
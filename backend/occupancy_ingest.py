@@ -0,0 +1,448 @@
+"""
+Streaming ingestion of occupancy sensor events.
+
+Sensor gateways POST newline-delimited JSON to /api/parking/events, one
+event per line, as a long stream:
+
+    {"lot": "lot-12", "spot": "B-07", "occupied": true, "ts": "2024-05-01T08:15:02Z"}
+    {"lot": "lot-40", "free": 17, "ts": 1714551302}
+
+Spot events come from per-spot sensors, which are enough to work out a lot's
+free count (capacity minus occupied spots). Count events come from lots that
+only count cars at the gate. `ts` is an ISO 8601 string or epoch seconds and
+defaults to the time the line was received.
+
+The body is read in chunks and split into lines as it arrives, so a request
+can carry any number of events without being held in memory. Events are
+applied to the nearby index right away, so /api/parking/nearby is current
+within the request. Store writes are not made per event: EventIngestor keeps
+the latest state of every changed spot and lot, and a background thread
+writes them every `window` seconds as batched writes. A spot that flips ten
+times within a window costs one write. Events that are older than the state
+they would replace are dropped as stale, so gateways may retry and reorder.
+
+Lots whose free count changed are passed to `on_change` once per chunk
+(availability_stream.py pushes them to subscribed clients).
+
+Each worker process applies only the events it receives itself. With
+`sync_interval` set, a second thread re-reads the lots every few seconds and
+takes over free counts that other workers (or instances) wrote to the store
+after this worker's latest event for the lot.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from json_provider import loads
+
+logger = logging.getLogger(__name__)
+
+DROP_REASONS = ('invalidJson', 'invalidEvent', 'tooLong', 'unknownLot', 'stale', 'future')
+
+
+class LineSplitter:
+    """Splits a byte stream arriving in chunks into lines; over-long lines come out as None"""
+
+    def __init__(self, max_line):
+        self.max_line = max_line
+        self._buffer = b''
+        self._skipping = False  # Inside a line that is already too long
+
+    def feed(self, chunk):
+        *lines, rest = (self._buffer + chunk).split(b'\n')
+        result = []
+        for line in lines:
+            if self._skipping or len(line) > self.max_line:
+                result.append(None)
+                self._skipping = False
+            else:
+                result.append(line)
+        if len(rest) > self.max_line:
+            # Don't buffer it: discard until the next newline
+            self._skipping = True
+            rest = b''
+        self._buffer = rest
+        return result
+
+    def close(self):
+        """The last line, if the stream did not end with a newline"""
+        line, self._buffer = self._buffer, b''
+        if self._skipping:
+            self._skipping = False
+            return [None]
+        return [line] if line.strip() else []
+
+
+def _utc(value):
+    """Naive UTC datetime, like datetime.utcnow()"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_timestamp(value, now):
+    if value is None:
+        return now
+    if isinstance(value, bool):
+        raise ValueError('ts must be a string or a number')
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    if isinstance(value, str):
+        # fromisoformat() only accepts 'Z' from Python 3.11
+        if value.endswith(('Z', 'z')):
+            value = value[:-1] + '+00:00'
+        return _utc(datetime.fromisoformat(value))
+    raise ValueError('ts must be a string or a number')
+
+
+def parse_event(line, now):
+    """(('spot', lot, spot, occupied, ts) or ('lot', lot, free, ts), None), or (None, drop reason)"""
+    try:
+        event = loads(line)
+    except ValueError:
+        return None, 'invalidJson'
+    if not isinstance(event, dict):
+        return None, 'invalidEvent'
+
+    lot_id = event.get('lot')
+    if not isinstance(lot_id, str) or not lot_id:
+        return None, 'invalidEvent'
+    try:
+        ts = parse_timestamp(event.get('ts'), now)
+    except (ValueError, OverflowError, OSError):
+        return None, 'invalidEvent'
+
+    spot_id = event.get('spot')
+    if spot_id is not None:
+        occupied = event.get('occupied')
+        if not isinstance(spot_id, str) or not spot_id or not isinstance(occupied, bool):
+            return None, 'invalidEvent'
+        return ('spot', lot_id, spot_id, occupied, ts), None
+
+    free = event.get('free')
+    if isinstance(free, bool) or not isinstance(free, int) or free < 0:
+        return None, 'invalidEvent'
+    return ('lot', lot_id, free, ts), None
+
+
+class IngestSession:
+    """One streamed request: feed() body chunks as they arrive, then finish()"""
+
+    def __init__(self, ingestor, max_line):
+        self.ingestor = ingestor
+        self.splitter = LineSplitter(max_line)
+        self.counts = {'lines': 0, 'accepted': 0, 'unchanged': 0, 'coalesced': 0}
+        self.dropped = dict.fromkeys(DROP_REASONS, 0)
+        self.started = time.perf_counter()
+
+    def feed(self, chunk):
+        self.ingestor.ingest(self.splitter.feed(chunk), self.counts, self.dropped)
+
+    def finish(self):
+        """Counts for the response"""
+        self.ingestor.ingest(self.splitter.close(), self.counts, self.dropped)
+        elapsed = time.perf_counter() - self.started
+        processed = self.counts['accepted'] + sum(self.dropped.values())
+        return {
+            **self.counts,
+            'dropped': sum(self.dropped.values()),
+            'droppedByReason': {reason: count for reason, count in self.dropped.items() if count},
+            'elapsedMs': round(elapsed * 1000, 2),
+            'eventsPerSecond': round(processed / elapsed) if elapsed > 0 else 0
+        }
+
+
+class EventIngestor:
+    """Applies occupancy events to the nearby index and writes them to the store in batches"""
+
+    def __init__(self, index, parking_store, window=1.0, max_batch=2000, max_line=1024, max_clock_skew=300,
+                 on_change=None, sync_interval=0):
+        self.index = index
+        self.parking_store = parking_store
+        self.on_change = on_change  # Called with the lots whose free count changed, outside the lock
+        # Seconds between batched writes; window <= 0 writes at the end of every chunk
+        self.window = window
+        self.max_batch = max_batch
+        self.max_line = max_line
+        self.max_clock_skew = timedelta(seconds=max_clock_skew)  # Events further in the future are dropped
+        self.sync_interval = sync_interval  # Seconds between re-reads of the stored free counts, 0 = never
+        self._spots = {}  # lot_id -> {spot_id: (occupied, ts)}
+        self._occupied = {}  # lot_id -> occupied spots
+        self._lot_ts = {}  # lot_id -> ts of its latest event
+        self._pending_spots = {}  # (lot_id, spot_id) -> (occupied, ts)
+        self._pending_lots = {}  # lot_id -> (free, ts)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._sync_thread = None
+        self.loaded = False
+        self.received = 0
+        self.accepted = 0
+        self.coalesced = 0
+        self.dropped = dict.fromkeys(DROP_REASONS, 0)
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+        self.syncs = 0
+        self.synced = 0
+        self.sync_errors = 0
+        self.events_per_second = 0.0
+        self._rate_mark = (time.monotonic(), 0)
+
+    def load(self, states):
+        """Restore spot states ({(lot_id, spot_id): (occupied, updated_at)}) and the free counts they imply"""
+        spots = {}
+        occupied = {}
+        for (lot_id, spot_id), (is_occupied, updated_at) in states.items():
+            ts = _utc(updated_at) if isinstance(updated_at, datetime) else datetime.min
+            spots.setdefault(lot_id, {})[spot_id] = (bool(is_occupied), ts)
+            occupied[lot_id] = occupied.get(lot_id, 0) + bool(is_occupied)
+
+        with self._lock:
+            self._spots = spots
+            self._occupied = occupied
+            for lot_id, count in occupied.items():
+                lot = self.index.get(lot_id)
+                if lot is not None:
+                    self.index.set_free(lot_id, lot.capacity - count)
+            self.loaded = True
+        return len(states)
+
+    def session(self):
+        return IngestSession(self, self.max_line)
+
+    def _ensure_thread(self):
+        # Started on first use, so it runs in the process that serves requests
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='event-ingestor', daemon=True)
+            self._thread.start()
+
+    def ingest(self, lines, counts, dropped):
+        """Parse and apply raw lines (None = too long), adding to a session's counts"""
+        now = datetime.utcnow()
+        latest = now + self.max_clock_skew
+        chunk = {'lines': 0, 'accepted': 0, 'unchanged': 0, 'coalesced': 0}
+        chunk_dropped = dict.fromkeys(DROP_REASONS, 0)
+        changed = {}
+        events = []
+        for line in lines:
+            if line is None:
+                chunk['lines'] += 1
+                chunk_dropped['tooLong'] += 1
+                continue
+            if not line.strip():
+                continue
+            chunk['lines'] += 1
+            event, reason = parse_event(line, now)
+            if reason is None and event[-1] > latest:
+                reason = 'future'
+            if reason:
+                chunk_dropped[reason] += 1
+            else:
+                events.append(event)
+
+        # One lock round per chunk rather than per event
+        with self._lock:
+            for event in events:
+                if event[0] == 'spot':
+                    reason = self._apply_spot_locked(*event[1:], chunk, changed)
+                else:
+                    reason = self._apply_lot_locked(*event[1:], chunk, changed)
+                if reason:
+                    chunk_dropped[reason] += 1
+                else:
+                    chunk['accepted'] += 1
+            self.received += chunk['lines']
+            self.accepted += chunk['accepted']
+            self.coalesced += chunk['coalesced']
+            for reason, count in chunk_dropped.items():
+                self.dropped[reason] += count
+            full = len(self._pending_spots) + len(self._pending_lots) >= self.max_batch
+
+        for key, count in chunk.items():
+            counts[key] += count
+        for reason, count in chunk_dropped.items():
+            dropped[reason] += count
+        if not events:
+            return
+        if self.on_change and changed:
+            try:
+                self.on_change(list(changed.values()))
+            except Exception:
+                logger.exception("Occupancy change callback failed")
+
+        if self.window <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+            if full:
+                self._wakeup.set()
+
+    def _apply_spot_locked(self, lot_id, spot_id, occupied, ts, counts, changed):
+        lot = self.index.get(lot_id)
+        if lot is None:
+            return 'unknownLot'
+        spots = self._spots.setdefault(lot_id, {})
+        previous = spots.get(spot_id)
+        if previous is not None and ts < previous[1]:
+            return 'stale'
+        spots[spot_id] = (occupied, ts)
+        if previous is not None and previous[0] == occupied:
+            counts['unchanged'] += 1
+            return None
+
+        key = (lot_id, spot_id)
+        if key in self._pending_spots:
+            counts['coalesced'] += 1
+        self._pending_spots[key] = (occupied, ts)
+        count = self._occupied.get(lot_id, 0) + (1 if occupied else -1 if previous is not None else 0)
+        self._occupied[lot_id] = count
+        self._set_free_locked(lot, lot.capacity - count, max(ts, self._lot_ts.get(lot_id, ts)), changed)
+        return None
+
+    def _apply_lot_locked(self, lot_id, free, ts, counts, changed):
+        lot = self.index.get(lot_id)
+        if lot is None:
+            return 'unknownLot'
+        if ts < self._lot_ts.get(lot_id, ts):
+            return 'stale'
+        if lot_id in self._pending_lots:
+            counts['coalesced'] += 1
+        self._set_free_locked(lot, free, ts, changed)
+        return None
+
+    def _set_free_locked(self, lot, free, ts, changed):
+        self._lot_ts[lot.id] = ts
+        _, previous = self.index.set_free(lot.id, free, ts)
+        self._pending_lots[lot.id] = (lot.free, ts)  # Clamped to the capacity by the index
+        if lot.free != previous:
+            changed[lot.id] = lot
+
+    def flush(self):
+        """Write every changed spot and lot; failed writes are kept for retry"""
+        with self._flush_lock:
+            with self._lock:
+                spots, self._pending_spots = self._pending_spots, {}
+                lots, self._pending_lots = self._pending_lots, {}
+            if not spots and not lots:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                if spots:
+                    self.parking_store.put_spots(spots)
+                if lots:
+                    self.parking_store.update_free(lots)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Occupancy flush failed ({len(spots)} spots, {len(lots)} lots), will retry: {e}")
+                with self._lock:
+                    # Anything queued meanwhile is newer and wins
+                    for key, state in spots.items():
+                        self._pending_spots.setdefault(key, state)
+                    for lot_id, state in lots.items():
+                        self._pending_lots.setdefault(lot_id, state)
+                return 0
+
+            self.flushes += 1
+            self.written += len(spots) + len(lots)
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            return len(spots) + len(lots)
+
+    def sync(self):
+        """Take over stored free counts newer than this worker's own; returns the number of lots changed"""
+        lots = self.parking_store.all_lots()
+        changed = {}
+        with self._lock:
+            for lot_id, lot_data in lots.items():
+                lot = self.index.get(lot_id)
+                updated_at = lot_data.get('updatedAt')
+                # Our unflushed changes are newer than anything in the store
+                if lot is None or not isinstance(updated_at, datetime) or lot_id in self._pending_lots:
+                    continue
+                ts = _utc(updated_at)
+                known = self._lot_ts.get(lot_id, lot.updated_at)
+                if isinstance(known, datetime) and ts <= _utc(known):
+                    continue
+                self._lot_ts[lot_id] = ts
+                _, previous = self.index.set_free(lot_id, lot_data.get('free', lot.free), ts)
+                if lot.free != previous:
+                    changed[lot_id] = lot
+            self.syncs += 1
+            self.synced += len(changed)
+
+        if self.on_change and changed:
+            try:
+                self.on_change(list(changed.values()))
+            except Exception:
+                logger.exception("Occupancy change callback failed")
+        return len(changed)
+
+    def start(self):
+        """Start re-reading the stored free counts every sync_interval seconds (if set)"""
+        if self.sync_interval > 0 and self._sync_thread is None:
+            self._sync_thread = threading.Thread(target=self._run_sync, name='occupancy-sync', daemon=True)
+            self._sync_thread.start()
+
+    def _run_sync(self):
+        while not self._stopped.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                logger.error(f"Occupancy sync failed: {e}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.window)
+            self._wakeup.clear()
+            self._update_rate()
+            self.flush()
+
+    def _update_rate(self):
+        marked_at, marked_accepted = self._rate_mark
+        now = time.monotonic()
+        if now - marked_at >= 1:
+            accepted = self.accepted
+            self.events_per_second = round((accepted - marked_accepted) / (now - marked_at), 1)
+            self._rate_mark = (now, accepted)
+
+    def stop(self):
+        """Stop the background thread and write whatever is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self.parking_store is not None:
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending_spots = len(self._pending_spots)
+            pending_lots = len(self._pending_lots)
+            tracked_spots = sum(len(spots) for spots in self._spots.values())
+        return {
+            'loaded': self.loaded,
+            'spots': tracked_spots,
+            'received': self.received,
+            'accepted': self.accepted,
+            'coalesced': self.coalesced,
+            'dropped': dict(self.dropped),
+            'pendingSpots': pending_spots,
+            'pendingLots': pending_lots,
+            'flushes': self.flushes,
+            'written': self.written,
+            'failures': self.failures,
+            'lastFlushMs': self.last_flush_ms,
+            'eventsPerSecond': self.events_per_second,
+            'windowSeconds': self.window,
+            'syncs': self.syncs,
+            'synced': self.synced,
+            'syncErrors': self.sync_errors,
+            'syncIntervalSeconds': self.sync_interval
+        }
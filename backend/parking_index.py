@@ -0,0 +1,242 @@
+"""
+In-memory geospatial index of parking lots for nearest-available queries.
+
+Lots are bucketed into a fixed grid of `cell_size`-degree cells, which is a
+geohash grid without the string encoding. A query for lots within r metres
+of a point only visits the cells that overlap the circle's bounding box and
+measures exact distances for the lots in them. Its cost depends on how many
+lots are nearby, not on how many exist. Each cell also keeps the lots that
+have free spots, so "nearest available" never looks at full lots.
+
+Free-spot counts change in place (set_free). A lot only moves between a
+cell's available and full lists when its count crosses zero. Writers take a
+lock. Readers take none: cell members are tuples that writers replace
+instead of mutating, so a query sees each cell either before or after a
+change, never halfway.
+
+Distances use the equirectangular approximation. Within the radii this
+index serves (tens of kilometres) it is within 0.1% of the great-circle
+distance, and it is several times cheaper to compute.
+"""
+
+import heapq
+import math
+import threading
+from operator import itemgetter
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+class Lot:
+    """A parking lot and its current free-spot count"""
+
+    __slots__ = ('id', 'name', 'lat', 'lng', 'capacity', 'free', 'updated_at', 'cell')
+
+    def __init__(self, lot_id, name, lat, lng, capacity, free=None, updated_at=None):
+        self.id = lot_id
+        self.name = name
+        self.lat = float(lat)
+        self.lng = float(lng)
+        self.capacity = int(capacity)
+        self.free = self.capacity if free is None else max(0, min(int(free), self.capacity))
+        self.updated_at = updated_at
+        self.cell = None
+
+    @classmethod
+    def from_document(cls, lot_id, lot_data):
+        return cls(
+            lot_id, lot_data.get('name', ''), lot_data['lat'], lot_data['lng'],
+            lot_data['capacity'], lot_data.get('free'), lot_data.get('updatedAt')
+        )
+
+    def to_document(self):
+        return {
+            'name': self.name,
+            'lat': self.lat,
+            'lng': self.lng,
+            'capacity': self.capacity,
+            'free': self.free,
+            'updatedAt': self.updated_at
+        }
+
+    def to_dict(self, distance=None):
+        """API representation"""
+        lot = {
+            'id': self.id,
+            'name': self.name,
+            'lat': self.lat,
+            'lng': self.lng,
+            'capacity': self.capacity,
+            'free': self.free,
+            'updatedAt': self.updated_at
+        }
+        if distance is not None:
+            lot['distance'] = round(distance, 1)
+        return lot
+
+
+class GeoGridIndex:
+    """Lots in a lat/lng grid with a per-cell list of lots that have free spots"""
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size  # Degrees; 0.01 is ~1.1 km north-south
+        self._lots = {}
+        self._cells = {}  # cell -> tuple of all its lots
+        self._free_cells = {}  # cell -> tuple of its lots with free > 0
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.capacity = 0
+        self.free = 0
+        self.updates = 0
+
+    def cell_of(self, lat, lng):
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def load(self, lots):
+        """Replace the whole index with `lots` ({lot_id: lot document} or Lot objects)"""
+        if isinstance(lots, dict):
+            lots = [Lot.from_document(lot_id, lot_data) for lot_id, lot_data in lots.items()]
+        by_id = {}
+        cells = {}
+        free_cells = {}
+        for lot in lots:
+            lot.cell = self.cell_of(lot.lat, lot.lng)
+            by_id[lot.id] = lot
+            cells.setdefault(lot.cell, []).append(lot)
+            if lot.free > 0:
+                free_cells.setdefault(lot.cell, []).append(lot)
+
+        # Built off to the side and swapped in, so queries never see half an index
+        with self._lock:
+            self._lots = by_id
+            self._cells = {cell: tuple(members) for cell, members in cells.items()}
+            self._free_cells = {cell: tuple(members) for cell, members in free_cells.items()}
+            self.capacity = sum(lot.capacity for lot in by_id.values())
+            self.free = sum(lot.free for lot in by_id.values())
+            self.loaded = True
+        return len(by_id)
+
+    def get(self, lot_id):
+        return self._lots.get(lot_id)
+
+    def lots(self):
+        return list(self._lots.values())
+
+    def __len__(self):
+        return len(self._lots)
+
+    def upsert(self, lot):
+        """Add a lot or replace the one with the same id (its cell may change)"""
+        lot.cell = self.cell_of(lot.lat, lot.lng)
+        with self._lock:
+            previous = self._lots.get(lot.id)
+            if previous is not None:
+                self._remove_locked(previous)
+            self._lots[lot.id] = lot
+            self._cells[lot.cell] = self._cells.get(lot.cell, ()) + (lot,)
+            if lot.free > 0:
+                self._free_cells[lot.cell] = self._free_cells.get(lot.cell, ()) + (lot,)
+            self.capacity += lot.capacity
+            self.free += lot.free
+
+    def remove(self, lot_id):
+        with self._lock:
+            lot = self._lots.get(lot_id)
+            if lot is not None:
+                self._remove_locked(lot)
+        return lot
+
+    def _remove_locked(self, lot):
+        del self._lots[lot.id]
+        self._replace(self._cells, lot.cell, tuple(member for member in self._cells[lot.cell] if member is not lot))
+        if lot.free > 0:
+            self._drop_free(lot)
+        self.capacity -= lot.capacity
+        self.free -= lot.free
+
+    def _drop_free(self, lot):
+        members = self._free_cells.get(lot.cell, ())
+        self._replace(self._free_cells, lot.cell, tuple(member for member in members if member is not lot))
+
+    @staticmethod
+    def _replace(cells, cell, members):
+        if members:
+            cells[cell] = members
+        else:
+            cells.pop(cell, None)
+
+    def set_free(self, lot_id, free, updated_at=None):
+        """Update a lot's free-spot count; returns (lot, previous free count), or None for an unknown lot"""
+        with self._lock:
+            lot = self._lots.get(lot_id)
+            if lot is None:
+                return None
+            free = max(0, min(int(free), lot.capacity))
+            previous = lot.free
+            if previous > 0 and free == 0:
+                self._drop_free(lot)
+            elif previous == 0 and free > 0:
+                self._free_cells[lot.cell] = self._free_cells.get(lot.cell, ()) + (lot,)
+            lot.free = free
+            if updated_at is not None:
+                lot.updated_at = updated_at
+            self.free += free - previous
+            self.updates += 1
+        return lot, previous
+
+    def cell_range(self, lat, lng, radius):
+        """(row_min, col_min, row_max, col_max) of the cells overlapping a circle's bounding box"""
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        lat_span = radius / METERS_PER_DEGREE
+        lng_span = lat_span / cos_lat
+        row_min, col_min = self.cell_of(lat - lat_span, lng - lng_span)
+        row_max, col_max = self.cell_of(lat + lat_span, lng + lng_span)
+        return row_min, col_min, row_max, col_max
+
+    def lots_in_cell(self, cell):
+        return self._cells.get(cell, ())
+
+    def nearby(self, lat, lng, radius, limit=20, min_free=1):
+        """[(distance in metres, lot)] within radius metres of lat/lng, nearest first"""
+        cells = self._free_cells if min_free > 0 else self._cells
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        row_min, col_min, row_max, col_max = self.cell_range(lat, lng, radius)
+
+        if (row_max - row_min + 1) * (col_max - col_min + 1) <= len(cells):
+            candidates = [
+                cells.get((row, col), ())
+                for row in range(row_min, row_max + 1)
+                for col in range(col_min, col_max + 1)
+            ]
+        else:
+            # A radius wider than the populated area: walk the occupied cells instead.
+            # list() copies the items in one step, writers may add cells meanwhile.
+            candidates = [
+                members for (row, col), members in list(cells.items())
+                if row_min <= row <= row_max and col_min <= col <= col_max
+            ]
+
+        radius_sq = (radius / METERS_PER_DEGREE) ** 2
+        found = []
+        for members in candidates:
+            for lot in members:
+                dlat = lot.lat - lat
+                dlng = (lot.lng - lng) * cos_lat
+                distance_sq = dlat * dlat + dlng * dlng
+                if distance_sq <= radius_sq and lot.free >= min_free:
+                    found.append((distance_sq, lot))
+
+        nearest = heapq.nsmallest(limit, found, key=itemgetter(0)) if len(found) > limit else sorted(found, key=itemgetter(0))
+        return [(math.sqrt(distance_sq) * METERS_PER_DEGREE, lot) for distance_sq, lot in nearest]
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'lots': len(self._lots),
+            'cells': len(self._cells),
+            'cellSizeDegrees': self.cell_size,
+            'capacity': self.capacity,
+            'free': self.free,
+            'updates': self.updates
+        }
@@ -0,0 +1,439 @@
+"""
+Parking lot storage.
+
+The store is the source of truth for lots and their free-spot counts. The
+nearby-parking index (parking_index.py) is loaded from all_lots() at startup
+and then kept current in memory, so queries never read the store. Occupancy
+changes are written back with update_free() in batches.
+
+Lots with spot sensors also have per-spot states ({(lot_id, spot_id):
+(occupied, updated_at)}, written by occupancy_ingest.py). Their free count is
+the capacity minus their occupied spots.
+
+Same backends as user_store.py: Firestore ('parking_lots' collection) in
+production, a local SQLite file for development and load tests. Lot
+documents look like {'name', 'lat', 'lng', 'capacity', 'free', 'updatedAt'}.
+
+Spot reservations (reservations.py) are documents like {'lotId', 'spotId',
+'userId', 'start', 'end', 'status', 'expiresAt', 'createdAt', 'updatedAt'}.
+A reservation blocks its spot while it is 'confirmed', or 'held' and its
+hold has not expired. The writes that create or change one are conditional,
+so workers that each keep their own schedules in memory cannot double-book
+a spot: SQLite re-checks overlaps inside a write transaction, Firestore
+runs an optimistic transaction on a per-spot schedule document
+('spot_reservations'). Conditions are evaluated with the clock at write
+time, not the caller's.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from user_store import SQLiteDatabase
+
+# Firestore batches are limited to 500 writes
+FIRESTORE_BATCH_SIZE = 500
+
+
+class ReservationConflict(Exception):
+    """Raised by create_reservation() when an active reservation on the spot overlaps the window"""
+
+    def __init__(self, lot_id, spot_id, blocking=None):
+        super().__init__(lot_id, spot_id)
+        self.blocking = blocking  # (reservation_id, start, end) of the reservation in the way, if known
+
+
+class ParkingRepository(ABC):
+    """Storage interface for parking lots; a backend missing a method fails at construction"""
+
+    name = 'base'
+
+    @abstractmethod
+    def all_lots(self):
+        """Return {lot_id: lot document} for every lot"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_lots(self, lots):
+        """Create or replace lots: {lot_id: lot document}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_free(self, counts):
+        """Set free-spot counts of existing lots: {lot_id: (free, updated_at)}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def all_spots(self):
+        """Return {(lot_id, spot_id): (occupied, updated_at)} for every spot with a sensor"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_spots(self, states):
+        """Create or replace spot states: {(lot_id, spot_id): (occupied, updated_at)}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def active_reservations(self):
+        """Return {reservation_id: reservation document} for reservations that block a spot now or later"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_reservation(self, reservation_id, reservation):
+        """Store a new reservation unless an active one on its spot overlaps (raises ReservationConflict)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def transition_reservation(self, reservation_id, from_status, to_status):
+        """Change a reservation's status if it still is from_status (and a hold is still valid); returns False otherwise"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def expire_reservations(self, reservation_ids):
+        """Mark holds whose time ran out as 'expired'; returns the number changed"""
+        raise NotImplementedError
+
+
+def _spot_key(lot_id, spot_id):
+    """Firestore document id of a spot ('/' is not allowed in ids)"""
+    return quote(f'{lot_id}:{spot_id}', safe=':@+')
+
+
+_RESERVATION_TIMES = ('start', 'end', 'expiresAt', 'createdAt', 'updatedAt')
+
+
+def _naive_utc(document):
+    """Firestore returns timezone-aware datetimes; the app compares naive UTC ones"""
+    for field in _RESERVATION_TIMES:
+        value = document.get(field)
+        if value is not None and value.tzinfo is not None:
+            document[field] = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return document
+
+
+def _overlaps(entry, start, end):
+    return entry['start'] < end and start < entry['end']
+
+
+def _active_entries(schedule, now):
+    """Entries of a spot schedule document that still block the spot at `now`"""
+    entries = ((schedule or {}).get('reservations') or {}).items()
+    return {
+        reservation_id: entry
+        for reservation_id, entry in ((reservation_id, _naive_utc(entry)) for reservation_id, entry in entries)
+        if entry['end'] > now and (entry['status'] == 'confirmed' or entry['expiresAt'] > now)
+    }
+
+
+class FirestoreParkingRepository(ParkingRepository):
+    """Lots stored in the Firestore 'parking_lots' collection"""
+
+    name = 'firestore'
+
+    def __init__(self, db, collection='parking_lots', spot_collection='parking_spots',
+                 reservation_collection='reservations', schedule_collection='spot_reservations'):
+        self.db = db
+        self.lots_ref = db.collection(collection)
+        self.spots_ref = db.collection(spot_collection)
+        self.reservations_ref = db.collection(reservation_collection)
+        # One document per spot: {'reservations': {reservation_id: {'start', 'end', 'status', 'expiresAt'}}}
+        self.schedules_ref = db.collection(schedule_collection)
+
+    def all_lots(self):
+        return {lot_doc.id: lot_doc.to_dict() for lot_doc in self.lots_ref.stream()}
+
+    def put_lots(self, lots):
+        items = list(lots.items())
+        for start in range(0, len(items), FIRESTORE_BATCH_SIZE):
+            batch = self.db.batch()
+            for lot_id, lot_data in items[start:start + FIRESTORE_BATCH_SIZE]:
+                batch.set(self.lots_ref.document(lot_id), lot_data)
+            batch.commit()
+
+    def update_free(self, counts):
+        items = list(counts.items())
+        for start in range(0, len(items), FIRESTORE_BATCH_SIZE):
+            batch = self.db.batch()
+            for lot_id, (free, updated_at) in items[start:start + FIRESTORE_BATCH_SIZE]:
+                batch.update(self.lots_ref.document(lot_id), {'free': free, 'updatedAt': updated_at})
+            batch.commit()
+
+    def all_spots(self):
+        states = {}
+        for spot_doc in self.spots_ref.stream():
+            spot = spot_doc.to_dict()
+            states[(spot['lotId'], spot['spotId'])] = (spot['occupied'], spot.get('updatedAt'))
+        return states
+
+    def put_spots(self, states):
+        items = list(states.items())
+        for start in range(0, len(items), FIRESTORE_BATCH_SIZE):
+            batch = self.db.batch()
+            for (lot_id, spot_id), (occupied, updated_at) in items[start:start + FIRESTORE_BATCH_SIZE]:
+                batch.set(self.spots_ref.document(_spot_key(lot_id, spot_id)), {
+                    'lotId': lot_id,
+                    'spotId': spot_id,
+                    'occupied': occupied,
+                    'updatedAt': updated_at
+                })
+            batch.commit()
+
+    def active_reservations(self):
+        now = datetime.utcnow()
+        reservations = {}
+        # A single-field range filter; status is checked here to avoid a composite index
+        for reservation_doc in self.reservations_ref.where('end', '>', now).stream():
+            reservation = _naive_utc(reservation_doc.to_dict())
+            if reservation['status'] == 'confirmed' or (reservation['status'] == 'held' and reservation['expiresAt'] > now):
+                reservations[reservation_doc.id] = reservation
+        return reservations
+
+    def create_reservation(self, reservation_id, reservation):
+        from firebase_admin import firestore
+
+        schedule_ref = self.schedules_ref.document(_spot_key(reservation['lotId'], reservation['spotId']))
+        reservation_ref = self.reservations_ref.document(reservation_id)
+
+        # Optimistic: if another worker writes the spot's schedule between our
+        # read and commit, the commit fails and Firestore reruns this function
+        @firestore.transactional
+        def _create(transaction):
+            schedule = schedule_ref.get(transaction=transaction)
+            active = _active_entries(schedule.to_dict() if schedule.exists else None, datetime.utcnow())
+            for other_id, entry in active.items():
+                if _overlaps(entry, reservation['start'], reservation['end']):
+                    raise ReservationConflict(reservation['lotId'], reservation['spotId'],
+                                              (other_id, entry['start'], entry['end']))
+            active[reservation_id] = {
+                'start': reservation['start'],
+                'end': reservation['end'],
+                'status': reservation['status'],
+                'expiresAt': reservation['expiresAt']
+            }
+            transaction.set(schedule_ref, {'reservations': active})
+            transaction.create(reservation_ref, reservation)
+
+        _create(self.db.transaction())
+
+    def transition_reservation(self, reservation_id, from_status, to_status):
+        from firebase_admin import firestore
+
+        reservation_ref = self.reservations_ref.document(reservation_id)
+
+        @firestore.transactional
+        def _transition(transaction):
+            reservation_doc = reservation_ref.get(transaction=transaction)
+            if not reservation_doc.exists or reservation_doc.get('status') != from_status:
+                return False
+            reservation = reservation_doc.to_dict()
+            schedule_ref = self.schedules_ref.document(_spot_key(reservation['lotId'], reservation['spotId']))
+            schedule = schedule_ref.get(transaction=transaction)
+            active = _active_entries(schedule.to_dict() if schedule.exists else None, datetime.utcnow())
+            # A hold that dropped out of the schedule has expired, and its window may be someone else's by now
+            still_active = reservation_id in active
+            if to_status == 'expired':
+                if still_active:
+                    return False
+            elif not still_active:
+                return False
+
+            if to_status == 'confirmed':
+                active[reservation_id]['status'] = to_status
+            else:
+                active.pop(reservation_id, None)
+            transaction.set(schedule_ref, {'reservations': active})
+            transaction.update(reservation_ref, {'status': to_status, 'updatedAt': datetime.utcnow()})
+            return True
+
+        return _transition(self.db.transaction())
+
+    def expire_reservations(self, reservation_ids):
+        return sum(1 for reservation_id in reservation_ids
+                   if self.transition_reservation(reservation_id, 'held', 'expired'))
+
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS parking_lots ('
+    ' id TEXT PRIMARY KEY,'
+    ' name TEXT NOT NULL,'
+    ' lat REAL NOT NULL,'
+    ' lng REAL NOT NULL,'
+    ' capacity INTEGER NOT NULL,'
+    ' free INTEGER NOT NULL,'
+    ' updated_at TEXT'
+    ')',
+    'CREATE TABLE IF NOT EXISTS parking_spots ('
+    ' lot_id TEXT NOT NULL,'
+    ' spot_id TEXT NOT NULL,'
+    ' occupied INTEGER NOT NULL,'
+    ' updated_at TEXT,'
+    ' PRIMARY KEY (lot_id, spot_id)'
+    ')',
+    # Times are epoch seconds, so overlap checks compare numbers
+    'CREATE TABLE IF NOT EXISTS reservations ('
+    ' id TEXT PRIMARY KEY,'
+    ' lot_id TEXT NOT NULL,'
+    ' spot_id TEXT NOT NULL,'
+    ' user_id TEXT NOT NULL,'
+    ' start_at REAL NOT NULL,'
+    ' end_at REAL NOT NULL,'
+    ' status TEXT NOT NULL,'
+    ' expires_at REAL NOT NULL,'
+    ' created_at REAL NOT NULL,'
+    ' updated_at REAL NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS reservations_by_spot ON reservations (lot_id, spot_id, start_at)',
+)
+_SELECT_ALL = 'SELECT id, name, lat, lng, capacity, free, updated_at FROM parking_lots'
+_UPSERT = 'INSERT OR REPLACE INTO parking_lots (id, name, lat, lng, capacity, free, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)'
+_UPDATE_FREE = 'UPDATE parking_lots SET free = ?, updated_at = ? WHERE id = ?'
+_SELECT_SPOTS = 'SELECT lot_id, spot_id, occupied, updated_at FROM parking_spots'
+_UPSERT_SPOT = 'INSERT OR REPLACE INTO parking_spots (lot_id, spot_id, occupied, updated_at) VALUES (?, ?, ?, ?)'
+_ACTIVE = "(status = 'confirmed' OR (status = 'held' AND expires_at > :now))"
+_SELECT_ACTIVE_RESERVATIONS = (
+    'SELECT id, lot_id, spot_id, user_id, start_at, end_at, status, expires_at, created_at, updated_at'
+    f' FROM reservations WHERE end_at > :now AND {_ACTIVE}'
+)
+_SELECT_OVERLAP = (
+    'SELECT id, start_at, end_at FROM reservations WHERE lot_id = :lot AND spot_id = :spot'
+    f' AND start_at < :end AND end_at > :start AND {_ACTIVE} LIMIT 1'
+)
+_INSERT_RESERVATION = (
+    'INSERT INTO reservations (id, lot_id, spot_id, user_id, start_at, end_at, status, expires_at, created_at, updated_at)'
+    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+# Holds can only change while they are valid, and only expire once they are not
+_TRANSITION_HOLD = "UPDATE reservations SET status = ?, updated_at = ? WHERE id = ? AND status = 'held' AND expires_at > ?"
+_EXPIRE_HOLD = "UPDATE reservations SET status = 'expired', updated_at = ? WHERE id = ? AND status = 'held' AND expires_at <= ?"
+_TRANSITION = 'UPDATE reservations SET status = ?, updated_at = ? WHERE id = ? AND status = ?'
+
+
+def _timestamp(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _epoch(value):
+    """Epoch seconds of a naive UTC datetime"""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class SQLiteParkingRepository(SQLiteDatabase, ParkingRepository):
+    """Lots stored in a local SQLite database"""
+
+    name = 'sqlite'
+    schema = _SCHEMA
+    scratch_name = 'parking.db'
+
+    def all_lots(self):
+        return {
+            lot_id: {
+                'name': name,
+                'lat': lat,
+                'lng': lng,
+                'capacity': capacity,
+                'free': free,
+                'updatedAt': datetime.fromisoformat(updated_at) if updated_at else None
+            }
+            for lot_id, name, lat, lng, capacity, free, updated_at in self._conn.execute(_SELECT_ALL)
+        }
+
+    def put_lots(self, lots):
+        rows = [
+            (lot_id, lot_data.get('name', ''), lot_data['lat'], lot_data['lng'], lot_data['capacity'],
+             lot_data.get('free', lot_data['capacity']), _timestamp(lot_data.get('updatedAt')))
+            for lot_id, lot_data in lots.items()
+        ]
+        self._write_many(_UPSERT, rows)
+
+    def update_free(self, counts):
+        self._write_many(_UPDATE_FREE, [
+            (free, _timestamp(updated_at), lot_id) for lot_id, (free, updated_at) in counts.items()
+        ])
+
+    def all_spots(self):
+        return {
+            (lot_id, spot_id): (bool(occupied), datetime.fromisoformat(updated_at) if updated_at else None)
+            for lot_id, spot_id, occupied, updated_at in self._conn.execute(_SELECT_SPOTS)
+        }
+
+    def put_spots(self, states):
+        self._write_many(_UPSERT_SPOT, [
+            (lot_id, spot_id, int(occupied), _timestamp(updated_at))
+            for (lot_id, spot_id), (occupied, updated_at) in states.items()
+        ])
+
+    def active_reservations(self):
+        rows = self._conn.execute(_SELECT_ACTIVE_RESERVATIONS, {'now': time.time()})
+        return {
+            reservation_id: {
+                'lotId': lot_id,
+                'spotId': spot_id,
+                'userId': user_id,
+                'start': datetime.utcfromtimestamp(start_at),
+                'end': datetime.utcfromtimestamp(end_at),
+                'status': status,
+                'expiresAt': datetime.utcfromtimestamp(expires_at),
+                'createdAt': datetime.utcfromtimestamp(created_at),
+                'updatedAt': datetime.utcfromtimestamp(updated_at)
+            }
+            for reservation_id, lot_id, spot_id, user_id, start_at, end_at, status, expires_at, created_at, updated_at in rows
+        }
+
+    def create_reservation(self, reservation_id, reservation):
+        start, end = _epoch(reservation['start']), _epoch(reservation['end'])
+        conn = self._conn
+        # IMMEDIATE takes the write lock up front, so no other worker can
+        # insert between the overlap check and the insert
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            overlap = conn.execute(_SELECT_OVERLAP, {
+                'lot': reservation['lotId'], 'spot': reservation['spotId'], 'start': start, 'end': end, 'now': time.time()
+            }).fetchone()
+            if overlap:
+                other_id, other_start, other_end = overlap
+                raise ReservationConflict(reservation['lotId'], reservation['spotId'], (
+                    other_id, datetime.utcfromtimestamp(other_start), datetime.utcfromtimestamp(other_end)
+                ))
+            conn.execute(_INSERT_RESERVATION, (
+                reservation_id, reservation['lotId'], reservation['spotId'], reservation['userId'], start, end,
+                reservation['status'], _epoch(reservation['expiresAt']), _epoch(reservation['createdAt']),
+                _epoch(reservation['updatedAt'])
+            ))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def transition_reservation(self, reservation_id, from_status, to_status):
+        now = time.time()
+        if to_status == 'expired':
+            cursor = self._conn.execute(_EXPIRE_HOLD, (now, reservation_id, now))
+        elif from_status == 'held':
+            cursor = self._conn.execute(_TRANSITION_HOLD, (to_status, now, reservation_id, now))
+        else:
+            cursor = self._conn.execute(_TRANSITION, (to_status, now, reservation_id, from_status))
+        return cursor.rowcount == 1
+
+    def expire_reservations(self, reservation_ids):
+        now = time.time()
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            expired = sum(conn.execute(_EXPIRE_HOLD, (now, reservation_id, now)).rowcount
+                          for reservation_id in reservation_ids)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return expired
+
+    def _write_many(self, statement, rows):
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(statement, rows)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
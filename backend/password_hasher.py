@@ -0,0 +1,148 @@
+"""
+bcrypt hashing off the request threads.
+
+bcrypt is deliberately slow and CPU-bound. Run inline in a Flask handler it
+pins the worker thread (and, because of the GIL, most of the process), so
+cheap requests like /health and /api/auth/verify queue behind login spikes.
+PasswordHasher sends the work to a process pool instead and bounds how many
+hashes may be pending at once; when the queue is full it raises HasherBusy
+so the route can answer 503 immediately instead of piling up requests.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+class HasherBusy(Exception):
+    """Raised when too many hashes are already pending"""
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Bounded bcrypt worker pool with queue depth and latency metrics"""
+
+    def __init__(self, workers=0, max_pending=None, wait_timeout=0.05, rounds=12,
+                 start_method='spawn'):
+        # workers=0 hashes inline on the calling thread (still bounded)
+        self.workers = workers
+        self.max_pending = max_pending or max(1, workers) * 4
+        self.wait_timeout = wait_timeout
+        self.rounds = rounds
+        # spawn: workers must not inherit the parent's gRPC/Firebase state
+        self.start_method = start_method
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats_lock = threading.Lock()
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    context = multiprocessing.get_context(self.start_method)
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    def _acquire(self, timeout):
+        acquired = self._slots.acquire(timeout=timeout) if timeout else self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._stats_lock:
+                self.rejected += 1
+            raise HasherBusy('Password hashing queue is full')
+
+        with self._stats_lock:
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        return time.perf_counter()
+
+    def _release(self, started):
+        elapsed = time.perf_counter() - started
+        self._slots.release()
+        with self._stats_lock:
+            self.pending -= 1
+            self.completed += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+
+    def _run(self, fn, *args):
+        started = self._acquire(self.wait_timeout)
+        try:
+            if self.workers > 0:
+                return self._get_executor().submit(fn, *args).result()
+            return fn(*args)
+        finally:
+            self._release(started)
+
+    async def _run_async(self, fn, *args):
+        # Never block the event loop waiting for a slot
+        started = self._acquire(None)
+        try:
+            if self.workers > 0:
+                return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+            return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        finally:
+            self._release(started)
+
+    def hash(self, password):
+        """Hash password using bcrypt"""
+        return self._run(_hashpw, password, self.rounds)
+
+    def check(self, password, hashed):
+        """Check password against hash"""
+        return self._run(_checkpw, password, hashed)
+
+    async def hash_async(self, password):
+        """Hash password from a coroutine without blocking the event loop"""
+        return await self._run_async(_hashpw, password, self.rounds)
+
+    async def check_async(self, password, hashed):
+        """Check password from a coroutine without blocking the event loop"""
+        return await self._run_async(_checkpw, password, hashed)
+
+    def warm_up(self):
+        """Start the worker processes now, so the first signup/login does not pay for it"""
+        if self.workers <= 0:
+            return 0
+        executor = self._get_executor()
+        # One cheap hash per worker: each process is spawned and has imported bcrypt
+        futures = [executor.submit(_hashpw, 'warm-up', 4) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+        return self.workers
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'peakPending': self.peak_pending,
+                'maxPending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avgLatencyMs': round(self.latency_total / self.completed * 1000, 2) if self.completed else 0.0,
+                'maxLatencyMs': round(self.latency_max * 1000, 2)
+            }
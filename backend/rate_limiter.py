@@ -0,0 +1,165 @@
+"""
+Token-bucket rate limiting for the credential endpoints.
+
+Each key (a client IP, an email) owns a bucket of `capacity` tokens that
+refills continuously at capacity/period tokens per second; a request takes
+one token or is rejected with the number of seconds until the next token.
+Checks run before the user store is read or bcrypt is called, so a
+credential-stuffing burst is turned away for the cost of a dict lookup.
+
+Bucket state lives in a pluggable store:
+
+- MemoryBucketStore: per process, split into independently locked shards.
+  A bucket that has refilled completely is indistinguishable from a new
+  one, so such entries are dropped lazily during periodic shard sweeps.
+- SQLiteBucketStore: a local database file shared by all worker processes
+  on the host, so the limit holds per machine instead of per worker.
+"""
+
+import math
+import sqlite3
+import threading
+import time
+import zlib
+
+
+def parse_rate(spec):
+    """'20/60' -> (20, 60.0): 20 requests per 60 seconds; '0' or '' disables"""
+    if not spec or spec.strip() == '0':
+        return None
+    capacity, _, period = spec.partition('/')
+    return int(capacity), float(period or 60)
+
+
+def _refill(tokens, updated, now, capacity, period):
+    return min(capacity, tokens + (now - updated) * capacity / period)
+
+
+class MemoryBucketStore:
+    """Buckets in sharded in-process dicts"""
+
+    name = 'memory'
+
+    def __init__(self, shards=16, sweep_every=1024):
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self.sweep_every = sweep_every
+        self._operations = [0] * shards
+
+    def take(self, key, capacity, period, now):
+        """Take a token; returns seconds to wait (0.0 when allowed)"""
+        index = zlib.crc32(key.encode('utf-8')) % len(self._shards)
+        buckets, lock = self._shards[index]
+        with lock:
+            tokens, updated = buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, period)
+            if tokens >= 1:
+                buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                buckets[key] = (tokens, now)
+                wait = (1 - tokens) * period / capacity
+
+            self._operations[index] += 1
+            if self._operations[index] % self.sweep_every == 0:
+                self._sweep(buckets, now, period)
+        return wait
+
+    def _sweep(self, buckets, now, period):
+        # Caller holds the shard lock. An entry untouched for a whole period
+        # has refilled completely, whatever its capacity.
+        for key in [key for key, (_, updated) in buckets.items() if now - updated >= period]:
+            del buckets[key]
+
+    def size(self):
+        return sum(len(buckets) for buckets, _ in self._shards)
+
+
+class SQLiteBucketStore:
+    """Buckets in a local SQLite file shared by the worker processes"""
+
+    name = 'sqlite'
+
+    def __init__(self, path='ratelimit.db', timeout=1.0, sweep_every=1024):
+        self.path = path
+        self.timeout = timeout
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        self._operations = 0
+        conn = self._conn
+        conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    @property
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # Losing buckets on a crash only resets limits
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, period, now):
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = _refill(row[0], row[1], now, capacity, period) if row else capacity
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) * period / capacity
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+
+            self._operations += 1
+            if self._operations % self.sweep_every == 0:
+                conn.execute('DELETE FROM buckets WHERE updated <= ?', (now - period,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def size(self):
+        return self._conn.execute('SELECT COUNT(*) FROM buckets').fetchone()[0]
+
+
+class RateLimiter:
+    """Named token-bucket rules over one bucket store"""
+
+    def __init__(self, store=None, rules=None, clock=time.time):
+        self.store = store or MemoryBucketStore()
+        # rule name -> (capacity, period); None disables the rule
+        self.rules = {name: rule for name, rule in (rules or {}).items() if rule}
+        self.clock = clock
+        self.allowed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def check(self, rule, value):
+        """Seconds the caller must wait (0 when allowed) for one request under rule/value"""
+        limits = self.rules.get(rule)
+        if limits is None or not value:
+            return 0
+        capacity, period = limits
+        try:
+            wait = self.store.take(f'{rule}:{value}', capacity, period, self.clock())
+        except sqlite3.Error:
+            # A broken shared store must not lock everybody out
+            self.errors += 1
+            return 0
+        if wait > 0:
+            self.rejected += 1
+            return max(1, math.ceil(wait))
+        self.allowed += 1
+        return 0
+
+    def stats(self):
+        return {
+            'store': self.store.name,
+            'rules': {name: f'{capacity}/{period:g}s' for name, (capacity, period) in self.rules.items()},
+            'buckets': self.store.size(),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'errors': self.errors
+        }
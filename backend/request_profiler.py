@@ -0,0 +1,163 @@
+"""
+On-demand profiling of individual requests.
+
+A request is profiled when it carries a valid signed X-Profile header or
+when it is picked by PROFILE_SAMPLE_RATE. While it runs, a sampler thread
+reads the request thread's Python stack (sys._current_frames) every
+interval, so time spent waiting on Firestore, Google or the bcrypt pool
+shows up as well as CPU time. Nothing is instrumented for requests that are
+not profiled.
+
+The last N profiles are kept in a ring buffer and exported as folded stacks
+(`frame;frame;frame count` per line), the input format of flamegraph.pl,
+speedscope and inferno.
+
+Tokens are `<expiry>.<hmac>` signed with PROFILE_SECRET for one purpose:
+'profile' to trigger profiling, 'admin' to read /debug/profiles.
+"""
+
+import collections
+import hashlib
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+PURPOSES = ('profile', 'admin')
+
+
+def _frame_label(code):
+    # Parent directory too, so flask/app.py and our app.py stay apart;
+    # ';' separates frames in the folded format
+    path = os.path.join(os.path.basename(os.path.dirname(code.co_filename)), os.path.basename(code.co_filename))
+    label = f'{code.co_name} ({path}:{code.co_firstlineno})'
+    return label.replace(';', ':')
+
+
+class StackSampler:
+    """Samples one thread's stack from a background thread"""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+        return self
+
+
+class RequestProfiler:
+    """Decides which requests to profile and keeps the last buffer_size profiles"""
+
+    def __init__(self, secret=None, sample_rate=0.0, buffer_size=50, interval=0.001, max_token_ttl=86400):
+        self.secret = secret.encode('utf-8') if secret else None
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_token_ttl = max_token_ttl
+        self._profiles = collections.deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.captured = 0
+
+    @property
+    def enabled(self):
+        return bool(self.secret) or self.sample_rate > 0
+
+    def _signature(self, purpose, expiry):
+        return hmac.new(self.secret, f'{purpose}:{expiry}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def sign(self, purpose, ttl=900):
+        """Token valid for ttl seconds (needs PROFILE_SECRET)"""
+        if purpose not in PURPOSES:
+            raise ValueError(f'Unknown token purpose: {purpose}')
+        if not self.secret:
+            raise ValueError('PROFILE_SECRET is not set')
+        expiry = int(time.time() + ttl)
+        return f'{expiry}.{self._signature(purpose, expiry)}'
+
+    def check_token(self, token, purpose):
+        if not self.secret or not token:
+            return False
+        expiry, _, signature = token.partition('.')
+        if not expiry.isdigit():
+            return False
+        remaining = int(expiry) - time.time()
+        if remaining <= 0 or remaining > self.max_token_ttl:
+            return False
+        return hmac.compare_digest(signature, self._signature(purpose, expiry))
+
+    def trigger(self, header_value):
+        """'header', 'sample' or None for a request with this X-Profile value"""
+        if header_value and self.check_token(header_value, 'profile'):
+            return 'header'
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return 'sample'
+        return None
+
+    def start(self):
+        return StackSampler(threading.get_ident(), self.interval).start()
+
+    def finish(self, sampler, **details):
+        """Stop sampling and store the profile; returns its summary"""
+        sampler.stop()
+        profile = {
+            'id': next(self._ids),
+            'capturedAt': datetime.utcnow(),  # Serialized by the JSON provider
+            'durationMs': round(sampler.duration * 1000, 2),
+            'samples': sampler.samples,
+            'intervalMs': self.interval * 1000,
+            **details
+        }
+        with self._lock:
+            self._profiles.append((profile, sampler.stacks))
+            self.captured += 1
+        return profile
+
+    def list(self):
+        with self._lock:
+            return [profile for profile, _ in reversed(self._profiles)]
+
+    def folded(self, profile_id):
+        """Folded stacks of one profile, or None if it left the buffer"""
+        with self._lock:
+            for profile, stacks in self._profiles:
+                if profile['id'] == profile_id:
+                    break
+            else:
+                return None
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'sampleRate': self.sample_rate,
+            'captured': self.captured,
+            'buffered': len(self._profiles)
+        }
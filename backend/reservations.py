@@ -0,0 +1,467 @@
+"""
+Parking spot reservations.
+
+A reservation holds one spot for a time window. It starts as a hold, which
+the client confirms (after paying) within `hold_seconds`. Holds that are
+not confirmed in time expire and free the window again:
+
+    held --confirm--> confirmed --cancel--> cancelled
+    held --cancel--> cancelled
+    held --(hold_seconds pass)--> expired
+
+A naive read-then-write (look for overlapping bookings, then insert, like
+login() does for loginCount) double-books as soon as two requests for the
+same spot interleave. Here, double bookings are ruled out at two levels:
+
+- Within a worker, every spot has a schedule of its active reservations,
+  sorted by start. Active windows on a spot never overlap, so their ends are
+  sorted too, and the only reservation a new window can collide with is the
+  last one that starts before the new window ends (found by bisection).
+  Spots are guarded by striped locks: a spot uses one of `stripes` locks, so
+  bookings of different spots rarely wait for each other. A lock is only
+  held to check and claim a window in memory, never during store I/O. A
+  claimed reservation is marked pending while it is written, so it keeps
+  blocking the window even if its hold runs out meanwhile, and it is
+  released again if the write fails.
+- Across workers, the parking store has the final word: its writes are
+  conditional (see parking_store.py), so a window another worker booked is
+  rejected by the store even though this worker's schedule does not know
+  about it. The reservation the store reports in the way is then kept in
+  the schedule for `foreign_seconds`, so further requests for that window
+  are turned down in memory instead of costing a store round trip each. A
+  window freed through another worker can therefore look taken here for
+  that long.
+
+Holds stop blocking as soon as they expire. A background thread removes
+them from the schedules and marks them expired in the store every
+`sweep_interval` seconds, and forgets reservations that are over.
+
+Times are epoch seconds. A lot's reservable spots are numbered
+'1'..capacity.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from parking_store import ReservationConflict
+
+logger = logging.getLogger(__name__)
+
+HELD = 'held'
+CONFIRMED = 'confirmed'
+CANCELLED = 'cancelled'
+EXPIRED = 'expired'
+
+
+class ReservationStateError(Exception):
+    """Raised when a reservation cannot make the requested transition (expired, cancelled, busy)"""
+
+
+def _epoch(value):
+    """Epoch seconds of a naive UTC datetime"""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class Reservation:
+    """One spot for one time window"""
+
+    __slots__ = ('id', 'lot_id', 'spot_id', 'user_id', 'start', 'end', 'status',
+                 'expires_at', 'created_at', 'updated_at', 'pending')
+
+    def __init__(self, reservation_id, lot_id, spot_id, user_id, start, end, status, expires_at, created_at,
+                 updated_at=None):
+        self.id = reservation_id
+        self.lot_id = lot_id
+        self.spot_id = spot_id
+        self.user_id = user_id
+        self.start = start
+        self.end = end
+        self.status = status
+        self.expires_at = expires_at
+        self.created_at = created_at
+        self.updated_at = created_at if updated_at is None else updated_at
+        self.pending = False  # A store write for this reservation is in flight
+
+    @property
+    def key(self):
+        return self.lot_id, self.spot_id
+
+    def blocks(self, now):
+        """True while no one else may book an overlapping window on this spot"""
+        return self.status == CONFIRMED or self.pending or (self.status == HELD and self.expires_at > now)
+
+    @classmethod
+    def from_document(cls, reservation_id, document):
+        return cls(
+            reservation_id, document['lotId'], document['spotId'], document['userId'],
+            _epoch(document['start']), _epoch(document['end']), document['status'],
+            _epoch(document['expiresAt']), _epoch(document['createdAt']), _epoch(document['updatedAt'])
+        )
+
+    def to_document(self):
+        return {
+            'lotId': self.lot_id,
+            'spotId': self.spot_id,
+            'userId': self.user_id,
+            'start': datetime.utcfromtimestamp(self.start),
+            'end': datetime.utcfromtimestamp(self.end),
+            'status': self.status,
+            'expiresAt': datetime.utcfromtimestamp(self.expires_at),
+            'createdAt': datetime.utcfromtimestamp(self.created_at),
+            'updatedAt': datetime.utcfromtimestamp(self.updated_at)
+        }
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'lot': self.lot_id,
+            'spot': self.spot_id,
+            'status': self.status,
+            'start': datetime.utcfromtimestamp(self.start),
+            'end': datetime.utcfromtimestamp(self.end),
+            'expiresAt': datetime.utcfromtimestamp(self.expires_at) if self.status == HELD else None,
+            'createdAt': datetime.utcfromtimestamp(self.created_at)
+        }
+
+
+class SpotSchedule:
+    """Active reservations of one spot, sorted by start; their windows never overlap"""
+
+    __slots__ = ('starts', 'reservations')
+
+    def __init__(self):
+        self.starts = []
+        self.reservations = []
+
+    def __len__(self):
+        return len(self.reservations)
+
+    def conflict(self, start, end, now):
+        """The reservation that blocks [start, end), or None; drops expired holds in the way"""
+        while True:
+            # Reservations starting before `end` are [0, position); the last of
+            # them also ends last, so it is the only one that can overlap
+            position = bisect_left(self.starts, end)
+            if position == 0:
+                return None
+            previous = self.reservations[position - 1]
+            if previous.end <= start:
+                return None
+            if previous.blocks(now):
+                return previous
+            del self.starts[position - 1]
+            del self.reservations[position - 1]
+
+    def insert(self, reservation):
+        position = bisect_left(self.starts, reservation.start)
+        self.starts.insert(position, reservation.start)
+        self.reservations.insert(position, reservation)
+
+    def remove(self, reservation):
+        position = bisect_left(self.starts, reservation.start)
+        if position < len(self.reservations) and self.reservations[position] is reservation:
+            del self.starts[position]
+            del self.reservations[position]
+
+
+class ReservationEngine:
+    """Holds, confirmations and cancellations of spot reservations, without double bookings"""
+
+    def __init__(self, index, parking_store=None, hold_seconds=600, max_duration=86400, max_advance=30 * 86400,
+                 stripes=64, sweep_interval=30, foreign_seconds=5):
+        self.index = index
+        self.parking_store = parking_store
+        self.hold_seconds = hold_seconds
+        self.max_duration = max_duration  # Longest window, seconds
+        self.max_advance = max_advance  # How far ahead a window may start, seconds
+        self.sweep_interval = sweep_interval
+        self.foreign_seconds = foreign_seconds  # How long a reservation made through another worker blocks here
+        self._schedules = {}  # (lot_id, spot_id) -> SpotSchedule, guarded by the spot's stripe lock
+        self._reservations = {}  # reservation_id -> Reservation, until it is over
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._expired_ids = []  # Expired outside a sweep, for the next sweep to report to the store
+        self._stats_lock = threading.Lock()  # Counters and _expired_ids, bumped under different stripe locks
+        self._stopped = threading.Event()
+        self._thread = None
+        self.loaded = False
+        self.held = 0
+        self.confirmed = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.conflicts = 0
+        self.store_conflicts = 0  # Windows the store rejected although this worker saw them free
+        self.store_failures = 0
+
+    def _lock_for(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def load(self, documents):
+        """Add active reservations from the store (warm-up); returns the number loaded"""
+        loaded = 0
+        for reservation_id, document in documents.items():
+            if reservation_id in self._reservations:
+                continue
+            reservation = Reservation.from_document(reservation_id, document)
+            if self._claim(reservation, time.time()):
+                loaded += 1
+            else:
+                logger.warning("Skipping overlapping reservation from the store", extra={'reservation': reservation_id})
+        self.loaded = True
+        return loaded
+
+    def spot_ids(self, lot):
+        return [str(number) for number in range(1, lot.capacity + 1)]
+
+    def check_window(self, start, end, now):
+        """Raises ValueError for a window that cannot be booked"""
+        if end <= start:
+            raise ValueError('end must be after start')
+        if end <= now:
+            raise ValueError('The window is already over')
+        if end - start > self.max_duration:
+            raise ValueError(f'Reservations are limited to {self.max_duration / 3600:g} hours')
+        if start - now > self.max_advance:
+            raise ValueError(f'start must be within the next {self.max_advance / 86400:g} days')
+
+    def hold(self, user_id, lot_id, start, end, spot_id=None, now=None):
+        """Hold a spot (the given one, or the first free one) for [start, end); returns the Reservation
+
+        Raises KeyError for an unknown lot or spot, ValueError for an invalid
+        window and ReservationConflict when no spot is free.
+        """
+        now = time.time() if now is None else now
+        self.check_window(start, end, now)
+        lot = self.index.get(lot_id)
+        if lot is None:
+            raise KeyError(lot_id)
+        spot_ids = self.spot_ids(lot)
+        if spot_id is not None:
+            if spot_id not in spot_ids:
+                raise KeyError(spot_id)
+            spot_ids = [spot_id]
+
+        reservation = Reservation(uuid.uuid4().hex, lot_id, None, user_id, start, end, HELD,
+                                  now + self.hold_seconds, now)
+        for candidate in spot_ids:
+            reservation.spot_id = candidate
+            if not self._claim(reservation, now, pending=True):
+                continue
+            try:
+                if self.parking_store is not None:
+                    self.parking_store.create_reservation(reservation.id, reservation.to_document())
+            except ReservationConflict as e:
+                # Booked through another worker; this one's schedule did not know
+                with self._stats_lock:
+                    self.store_conflicts += 1
+                self._release(reservation)
+                if e.blocking:
+                    self._remember_foreign(lot_id, candidate, e.blocking, now)
+                continue
+            except Exception:
+                with self._stats_lock:
+                    self.store_failures += 1
+                self._release(reservation)
+                raise
+            reservation.pending = False
+            with self._stats_lock:
+                self.held += 1
+            return reservation
+
+        with self._stats_lock:
+            self.conflicts += 1
+        raise ReservationConflict(lot_id, spot_id)
+
+    def _claim(self, reservation, now, pending=False):
+        """Put a reservation in its spot's schedule if the window is free there"""
+        key = reservation.key
+        with self._lock_for(key):
+            schedule = self._schedules.get(key)
+            if schedule is None:
+                schedule = self._schedules[key] = SpotSchedule()
+            elif schedule.conflict(reservation.start, reservation.end, now):
+                return False
+            reservation.pending = pending
+            schedule.insert(reservation)
+            self._reservations[reservation.id] = reservation
+        return True
+
+    def _remember_foreign(self, lot_id, spot_id, blocking, now):
+        """Block a window another worker booked for foreign_seconds (an expiring hold without an owner)"""
+        reservation_id, start, end = blocking
+        if reservation_id in self._reservations:
+            return
+        foreign = Reservation(reservation_id, lot_id, spot_id, None, _epoch(start), _epoch(end), HELD,
+                              now + self.foreign_seconds, now)
+        self._claim(foreign, now)
+
+    def _release(self, reservation):
+        with self._lock_for(reservation.key):
+            self._remove_locked(reservation)
+
+    def _remove_locked(self, reservation):
+        reservation.pending = False
+        schedule = self._schedules.get(reservation.key)
+        if schedule is not None:
+            schedule.remove(reservation)
+        self._reservations.pop(reservation.id, None)
+
+    def get(self, reservation_id, user_id):
+        """The user's reservation; raises KeyError (also for other users' reservations)"""
+        reservation = self._reservations.get(reservation_id)
+        if reservation is None or reservation.user_id != user_id:
+            raise KeyError(reservation_id)
+        return reservation
+
+    def confirm(self, reservation_id, user_id, now=None):
+        """Turn a hold into a confirmed reservation; confirming twice is fine"""
+        return self._transition(reservation_id, user_id, CONFIRMED, (HELD,), now)
+
+    def cancel(self, reservation_id, user_id, now=None):
+        """Cancel a hold or a confirmed reservation, freeing its window"""
+        return self._transition(reservation_id, user_id, CANCELLED, (HELD, CONFIRMED), now)
+
+    def _transition(self, reservation_id, user_id, to_status, from_statuses, now):
+        now = time.time() if now is None else now
+        reservation = self.get(reservation_id, user_id)
+        lock = self._lock_for(reservation.key)
+        with lock:
+            if reservation.status == to_status:
+                return reservation
+            if reservation.pending:
+                raise ReservationStateError('Reservation is being updated, please try again')
+            if reservation.status == HELD and reservation.expires_at <= now:
+                self._expire_locked(reservation)
+            if reservation.status not in from_statuses:
+                raise ReservationStateError(f'Reservation is {reservation.status}')
+            from_status = reservation.status
+            reservation.pending = True
+
+        try:
+            changed = True
+            if self.parking_store is not None:
+                changed = self.parking_store.transition_reservation(reservation_id, from_status, to_status)
+        except Exception:
+            with self._stats_lock:
+                self.store_failures += 1
+            with lock:
+                reservation.pending = False
+            raise
+
+        with lock:
+            reservation.pending = False
+            if not changed:
+                # Expired or cancelled through another worker in the meantime
+                with self._stats_lock:
+                    self.store_conflicts += 1
+                self._remove_locked(reservation)
+                reservation.status = EXPIRED if from_status == HELD else CANCELLED
+                raise ReservationStateError(f'Reservation is {reservation.status}')
+            reservation.status = to_status
+            reservation.updated_at = now
+            if to_status == CANCELLED:
+                schedule = self._schedules.get(reservation.key)
+                if schedule is not None:
+                    schedule.remove(reservation)
+
+        with self._stats_lock:
+            if to_status == CONFIRMED:
+                self.confirmed += 1
+            else:
+                self.cancelled += 1
+        return reservation
+
+    def _expire_locked(self, reservation):
+        reservation.status = EXPIRED
+        schedule = self._schedules.get(reservation.key)
+        if schedule is not None:
+            schedule.remove(reservation)
+        with self._stats_lock:
+            self._expired_ids.append(reservation.id)
+            self.expired += 1
+
+    def sweep(self, now=None):
+        """Expire holds that ran out and forget finished reservations; returns the ids expired"""
+        now = time.time() if now is None else now
+        for reservation in list(self._reservations.values()):
+            if reservation.pending:
+                continue
+            key = reservation.key
+            with self._lock_for(key):
+                if reservation.pending:
+                    continue
+                if reservation.user_id is None:
+                    # Another worker's reservation, remembered for a while
+                    if reservation.expires_at > now:
+                        continue
+                    self._remove_locked(reservation)
+                elif reservation.status == HELD and reservation.expires_at <= now:
+                    self._expire_locked(reservation)
+                elif reservation.status in (CANCELLED, EXPIRED) or reservation.end <= now:
+                    # Already out of the schedule, or over: nothing can change it any more
+                    self._remove_locked(reservation)
+                else:
+                    continue
+                schedule = self._schedules.get(key)
+                if schedule is not None and not schedule:
+                    del self._schedules[key]
+
+        with self._stats_lock:
+            expired, self._expired_ids = self._expired_ids, []
+        if expired and self.parking_store is not None:
+            try:
+                self.parking_store.expire_reservations(expired)
+            except Exception:
+                # Harmless: the store ignores holds past expiresAt anyway
+                with self._stats_lock:
+                    self.store_failures += 1
+                logger.exception("Marking expired holds failed")
+        return expired
+
+    def check_schedules(self):
+        """Overlapping active windows on any spot (should always be empty); for tests and benchmarks"""
+        overlaps = []
+        for key, schedule in list(self._schedules.items()):
+            with self._lock_for(key):
+                reservations = [r for r in schedule.reservations if r.status in (HELD, CONFIRMED)]
+            for previous, current in zip(reservations, reservations[1:]):
+                if current.start < previous.end:
+                    overlaps.append((previous.id, current.id))
+        return overlaps
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='reservation-sweeper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Reservation sweep failed")
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        with self._stats_lock:
+            counters = {
+                'held': self.held,
+                'confirmed': self.confirmed,
+                'cancelled': self.cancelled,
+                'expired': self.expired,
+                'conflicts': self.conflicts,
+                'storeConflicts': self.store_conflicts,
+                'storeFailures': self.store_failures
+            }
+        return {
+            'loaded': self.loaded,
+            'reservations': len(self._reservations),
+            'spots': len(self._schedules),
+            **counters,
+            'holdSeconds': self.hold_seconds
+        }
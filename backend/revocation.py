@@ -0,0 +1,129 @@
+"""
+Revocation filter for stateless token verification.
+
+Tokens from generate_token() carry the claims /api/auth/verify needs to
+authorize a request (active flag, token version). What a token cannot know
+is whether the account was deactivated or its tokens revoked after it was
+issued. RevocationFilter keeps that in memory as a Bloom filter of affected
+user ids, rebuilt periodically from the user store:
+
+- "definitely not revoked" -> the token claims are trusted, zero I/O
+- "maybe revoked"          -> fall back to reading the user document
+
+False positives only cost the regular store read, never a wrong answer.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, expected_items, false_positive_rate=0.001):
+        expected_items = max(1, expected_items)
+        self.size = max(8, int(-expected_items * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / expected_items * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+    """Users whose tokens may no longer be trusted from claims alone"""
+
+    def __init__(self, user_store, sync_interval=30, expected_items=10000, false_positive_rate=0.001):
+        self.user_store = user_store
+        self.sync_interval = sync_interval
+        self.expected_items = expected_items
+        self.false_positive_rate = false_positive_rate
+        self._filter = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self.synced_at = None
+        self.syncs = 0
+        self.sync_errors = 0
+        self.fast_path = 0
+        self.slow_path = 0
+
+    @property
+    def ready(self):
+        return self._filter is not None
+
+    def sync(self):
+        """Rebuild the filter from the store's deactivated/revoked users"""
+        try:
+            user_ids = self.user_store.revoked_users()
+        except Exception as e:
+            self.sync_errors += 1
+            logger.error(f"Revocation filter sync failed: {e}")
+            return False
+
+        bloom = BloomFilter(max(self.expected_items, len(user_ids) * 2), self.false_positive_rate)
+        for user_id in user_ids:
+            bloom.add(user_id)
+        self._filter = bloom
+        self.synced_at = time.time()
+        self.syncs += 1
+        return True
+
+    def might_be_revoked(self, user_id):
+        """False only when the user is definitely not revoked"""
+        self._ensure_thread()
+        bloom = self._filter
+        # A filter that has not synced for a while may miss new revocations
+        stale = self.synced_at is None or time.time() - self.synced_at > self.sync_interval * 3
+        if bloom is None or stale or user_id in bloom:
+            self.slow_path += 1
+            return True
+        self.fast_path += 1
+        return False
+
+    def _ensure_thread(self):
+        # Started on first use, so it runs in the process that serves requests
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='revocation-sync', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.sync()
+            self._stopped.wait(self.sync_interval)
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            'ready': bloom is not None,
+            'revokedUsers': bloom.count if bloom else 0,
+            'filterBytes': len(bloom.bits) if bloom else 0,
+            'syncs': self.syncs,
+            'syncErrors': self.sync_errors,
+            'secondsSinceSync': round(time.time() - self.synced_at) if self.synced_at else None,
+            'fastPath': self.fast_path,
+            'slowPath': self.slow_path
+        }
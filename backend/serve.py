@@ -0,0 +1,116 @@
+"""
+Production server for the SmartParking API.
+
+`python app.py` runs Flask's single-process development server. This entry
+point runs the same app under gunicorn: a master process supervising N
+worker processes with a pool of threads each.
+
+The app is NOT preloaded in the master. create_app() initializes Firebase
+(gRPC channels and background threads), and those must not be shared
+across fork(), so every worker imports the app and calls create_app() after
+it has been forked. Point the load balancer's health check at /readyz: a
+worker only reports ready once its warm-up has finished.
+
+    python serve.py
+
+Signals (sent to the master):
+    HUP    graceful reload: new workers start, old ones drain and exit
+    TERM   graceful shutdown: stop accepting, drain for WEB_GRACEFUL_TIMEOUT
+    TTIN / TTOU   add / remove one worker
+"""
+
+import os
+import sys
+
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+
+load_dotenv()
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Configuration
+PORT = int(os.getenv('PORT', 5000))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', CPU_COUNT))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 30))  # Seconds before a stuck worker is restarted
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))  # Seconds to drain on reload/shutdown
+WEB_KEEPALIVE = int(os.getenv('WEB_KEEPALIVE', 5))
+WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 0))  # Recycle workers after N requests, 0 = never
+WEB_PIDFILE = os.getenv('WEB_PIDFILE')  # Where to write the master pid (for kill -HUP)
+
+# Each web worker owns a bcrypt pool; share the cores instead of N x N processes
+os.environ.setdefault('BCRYPT_WORKERS', str(max(1, CPU_COUNT // WEB_WORKERS)))
+
+# Every open /api/parking/stream holds one of a worker's request threads for up to
+# STREAM_MAX_SECONDS. Streams may take at most half of them, further ones get a 503,
+# so auth and parking routes keep being served. asgi.py serves streams without threads.
+STREAM_MAX_SUBSCRIBERS = min(int(os.getenv('STREAM_MAX_SUBSCRIBERS', WEB_THREADS)), WEB_THREADS // 2)
+os.environ['STREAM_MAX_SUBSCRIBERS'] = str(STREAM_MAX_SUBSCRIBERS)
+
+# Each worker applies only the occupancy events it receives itself; the others
+# take over the free counts it writes by re-reading the store every few seconds
+PARKING_INGEST = bool(os.getenv('PARKING_INGEST_TOKEN'))
+if PARKING_INGEST and WEB_WORKERS > 1:
+    os.environ.setdefault('PARKING_SYNC_INTERVAL', '5')
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked, loading app and initializing Firebase")
+
+
+def worker_exit(server, worker):
+    # Only workers that finished importing the app have anything to release
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.shutdown()
+
+
+class SmartParkingServer(BaseApplication):
+    """gunicorn application that runs app.create_app() inside each worker"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from app import create_app
+        return create_app()
+
+
+def server_options():
+    return {
+        'bind': f'0.0.0.0:{PORT}',
+        'workers': WEB_WORKERS,
+        'threads': WEB_THREADS,
+        'worker_class': 'gthread',
+        'timeout': WEB_TIMEOUT,
+        'graceful_timeout': WEB_GRACEFUL_TIMEOUT,
+        'keepalive': WEB_KEEPALIVE,
+        'max_requests': WEB_MAX_REQUESTS,
+        'max_requests_jitter': WEB_MAX_REQUESTS // 10,
+        'preload_app': False,
+        'pidfile': WEB_PIDFILE,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+        'accesslog': '-',
+    }
+
+
+if __name__ == '__main__':
+    print(f"🚀 Starting SmartParking API (production)")
+    print(f"🔌 Port: {PORT}")
+    print(f"👷 Workers: {WEB_WORKERS} x {WEB_THREADS} threads")
+    print(f"📡 Availability streams: {STREAM_MAX_SUBSCRIBERS} per worker")
+    if PARKING_INGEST and WEB_WORKERS > 1:
+        print(f"🔄 Occupancy: free counts synced between workers every {os.environ['PARKING_SYNC_INTERVAL']}s")
+        print("⚠️ Spot sensor states are per worker: send spot events to an instance with WEB_WORKERS=1")
+    print(f"⏱️ Timeout: {WEB_TIMEOUT}s, graceful drain: {WEB_GRACEFUL_TIMEOUT}s")
+    print("=" * 50)
+
+    SmartParkingServer(server_options()).run()
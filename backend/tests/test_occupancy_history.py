@@ -0,0 +1,118 @@
+from array import array
+
+import pytest
+
+from occupancy_history import MISSING, OccupancyHistory, Tier, parse_tiers
+from parking_index import GeoGridIndex, Lot
+
+TIERS = '60:10,600:6'
+
+
+@pytest.fixture
+def index():
+    index = GeoGridIndex()
+    index.load([Lot(f'lot-{i}', '', 1.0, 1.0 + i * 0.001, 10) for i in range(3)])
+    return index
+
+
+def sample_minutes(history, index, minutes, start=6000):
+    """One sample per minute; lot-0 has minute % 10 cars parked"""
+    for minute in range(minutes):
+        index.set_free('lot-0', 10 - minute % 10)
+        history.sample(start + minute * 60)
+
+
+def test_parse_tiers():
+    assert parse_tiers('300:576,3600:1344') == [(300, 576), (3600, 1344)]
+    with pytest.raises(ValueError):
+        parse_tiers('300:10,1000:10')  # Not a multiple of the finer tier
+    with pytest.raises(ValueError):
+        parse_tiers('0:10')
+
+
+def test_ring_wraps_and_gaps_read_as_missing():
+    tier = Tier(60, 4)
+    tier.add_rows(1)
+    for bucket in (0, 1, 2, 3, 4):
+        tier.write(bucket, array('H', [bucket]))
+    assert tier.retained() == (1, 4)
+    assert tier.read(0, 1, 4) == [1, 2, 3, 4]
+    tier.write(6, array('H', [6]))  # Bucket 5 was skipped
+    assert tier.read(0, 3, 6) == [3, 4, MISSING, 6]
+
+
+def test_query_and_downsampled_means(index):
+    history = OccupancyHistory(index, tiers=TIERS)
+    sample_minutes(history, index, 25)
+    # The 10-slot ring only holds the last 10 minutes
+    fine = history.query('lot-0', 6000, 6000 + 24 * 60, resolution=60)
+    assert fine['start'] == 6000 + 15 * 60
+    assert fine['values'] == [minute % 10 / 10 for minute in range(15, 25)]
+    # The first two 10-minute buckets are complete; the third is still open
+    coarse = history.query('lot-0', 6000, 6000 + 24 * 60, resolution=600)
+    assert coarse['values'] == [0.45, 0.45]
+    assert history.aggregate('lot-1', 6000, 6000 + 24 * 60, resolution=60)['mean'] == 0.0
+    with pytest.raises(KeyError):
+        history.query('unknown', 6000, 6600)
+
+
+def test_snapshot_restore_round_trip(index, tmp_path):
+    path = str(tmp_path / 'history.bin')
+    history = OccupancyHistory(index, tiers=TIERS, path=path)
+    sample_minutes(history, index, 25)
+    assert history.snapshot() > 0
+
+    restored = OccupancyHistory(GeoGridIndex(), tiers=TIERS, path=path)
+    assert restored.restore() == 3
+    for resolution in (60, 600):
+        assert (restored.query('lot-0', 6000, 7500, resolution=resolution)
+                == history.query('lot-0', 6000, 7500, resolution=resolution))
+    # The open bucket's running sums came back too, so the next mean is complete
+    restored.index = index
+    sample_minutes(restored, index, 6, start=6000 + 25 * 60)
+    sample_minutes(history, index, 6, start=6000 + 25 * 60)
+    assert (restored.query('lot-0', 6000, 8000, resolution=600)
+            == history.query('lot-0', 6000, 8000, resolution=600))
+
+
+def test_restore_ignores_a_snapshot_with_other_tiers(index, tmp_path):
+    path = str(tmp_path / 'history.bin')
+    history = OccupancyHistory(index, tiers=TIERS, path=path)
+    history.sample(6000)
+    history.snapshot()
+    assert OccupancyHistory(index, tiers='60:20', path=path).restore() == 0
+
+
+@pytest.mark.parametrize('damage', [
+    lambda data: data[:-1],
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:12],
+    lambda data: data + b'\0',
+    lambda data: b'',
+    lambda data: data[:12] + b'{not json' + data[21:],
+    lambda data: b'not a snapshot at all',
+], ids=['last-byte', 'half', 'header', 'trailing', 'empty', 'bad-json', 'no-magic'])
+def test_restore_ignores_damaged_snapshots(index, tmp_path, damage):
+    path = tmp_path / 'history.bin'
+    history = OccupancyHistory(index, tiers=TIERS, path=str(path))
+    sample_minutes(history, index, 3)
+    history.snapshot()
+    path.write_bytes(damage(path.read_bytes()))
+
+    restored = OccupancyHistory(index, tiers=TIERS, path=str(path))
+    assert restored.restore() == 0
+    assert restored.stats()['lots'] == 0
+
+
+def test_only_the_lock_holder_writes_snapshots(index, tmp_path):
+    pytest.importorskip('fcntl')
+    path = str(tmp_path / 'history.bin')
+    writer = OccupancyHistory(index, tiers=TIERS, path=path)
+    other = OccupancyHistory(index, tiers=TIERS, path=path)
+    writer.sample(6000)
+    assert writer.snapshot() > 0
+    # flock is per open file, so a second history in the same process is a second writer
+    assert other.snapshot() == 0
+    writer.stop()
+    assert other.snapshot() > 0
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == ['history.bin', 'history.bin.lock']
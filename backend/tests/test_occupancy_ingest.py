@@ -0,0 +1,111 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from occupancy_ingest import DROP_REASONS, EventIngestor, LineSplitter
+from parking_index import GeoGridIndex
+from parking_store import SQLiteParkingRepository
+
+MAX_LINE = 16
+
+
+def expected_lines(data, max_line):
+    """What splitting the whole stream at once gives: over-long lines as None, no trailing blank line"""
+    *lines, last = data.split(b'\n')
+    if last.strip() or len(last) > max_line:
+        lines.append(last)
+    return [None if len(line) > max_line else line for line in lines]
+
+
+def split_in_chunks(data, sizes, max_line):
+    splitter = LineSplitter(max_line)
+    lines = []
+    position = 0
+    for size in sizes:
+        lines.extend(splitter.feed(data[position:position + size]))
+        position += size
+        # Never buffers more than one line's worth, however long the line is
+        assert len(splitter._buffer) <= max_line
+    lines.extend(splitter.feed(data[position:]))
+    return lines + splitter.close()
+
+
+def random_stream(rng):
+    lines = []
+    for _ in range(rng.randint(0, 30)):
+        length = rng.choice([0, 1, MAX_LINE - 1, MAX_LINE, MAX_LINE + 1, 3 * MAX_LINE, rng.randint(0, 2 * MAX_LINE)])
+        lines.append(bytes(rng.choice(b'abc {}"') for _ in range(length)))
+    data = b'\n'.join(lines)
+    return data + b'\n' if rng.random() < 0.5 else data
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_any_chunking_gives_the_same_lines(seed):
+    rng = random.Random(seed)
+    data = random_stream(rng)
+    sizes = []
+    while sum(sizes) < len(data):
+        sizes.append(rng.choice([1, 2, 3, 7, MAX_LINE, MAX_LINE + 1, 64]))
+    assert split_in_chunks(data, sizes, MAX_LINE) == expected_lines(data, MAX_LINE)
+
+
+def test_newline_on_a_chunk_boundary():
+    assert split_in_chunks(b'{"a":1}\n{"b":2}\n', [8, 8], MAX_LINE) == [b'{"a":1}', b'{"b":2}']
+    assert split_in_chunks(b'{"a":1}\n{"b":2}\n', [7, 1, 8], MAX_LINE) == [b'{"a":1}', b'{"b":2}']
+
+
+def test_line_of_exactly_max_line_is_kept():
+    line = b'x' * MAX_LINE
+    assert split_in_chunks(line + b'\n' + line + b'y\n', [5, 5, 5, 5, 5], MAX_LINE) == [line, None]
+
+
+def test_over_long_line_spanning_many_chunks_is_one_none():
+    data = b'a' * (10 * MAX_LINE) + b'\nok\n'
+    assert split_in_chunks(data, [3] * 60, MAX_LINE) == [None, b'ok']
+
+
+def test_close_returns_the_unterminated_last_line():
+    splitter = LineSplitter(MAX_LINE)
+    assert splitter.feed(b'one\ntw') == [b'one']
+    assert splitter.close() == [b'tw']
+    assert splitter.close() == []
+
+
+def test_close_reports_an_unterminated_over_long_line():
+    splitter = LineSplitter(MAX_LINE)
+    assert splitter.feed(b'z' * (MAX_LINE + 5)) == []
+    assert splitter.close() == [None]
+
+
+def test_blank_lines_inside_the_stream_are_kept_and_a_blank_tail_is_not():
+    assert split_in_chunks(b'a\n\nb\n  ', [2, 2], MAX_LINE) == [b'a', b'', b'b']
+
+
+def test_sync_takes_over_counts_other_workers_wrote():
+    store = SQLiteParkingRepository(':memory:')
+    store.put_lots({
+        'a': {'lat': 0.0, 'lng': 0.0, 'capacity': 10, 'free': 10, 'updatedAt': datetime(2024, 5, 1, 8, 0)},
+        'b': {'lat': 0.0, 'lng': 0.0, 'capacity': 10, 'free': 10, 'updatedAt': datetime(2024, 5, 1, 8, 0)},
+    })
+    workers = []
+    for _ in range(2):
+        index = GeoGridIndex()
+        index.load(store.all_lots())
+        workers.append(EventIngestor(index, store, window=0))
+    receiver, other = workers
+
+    receiver.ingest([b'{"lot": "a", "free": 3, "ts": "2024-05-01T08:05:00Z"}'], *counters())
+    # Local events the store has not caught up with are kept
+    other.ingest([b'{"lot": "b", "free": 7, "ts": "2024-05-01T08:06:00Z"}'], *counters())
+    other.window = 60
+    other.ingest([b'{"lot": "b", "free": 6, "ts": "2024-05-01T08:07:00Z"}'], *counters())
+
+    assert other.sync() == 1
+    assert other.index.get('a').free == 3
+    assert other.index.get('b').free == 6
+    assert other.sync() == 0
+
+
+def counters():
+    return {'lines': 0, 'accepted': 0, 'unchanged': 0, 'coalesced': 0}, dict.fromkeys(DROP_REASONS, 0)
@@ -0,0 +1,79 @@
+import math
+import random
+
+import pytest
+
+from parking_index import METERS_PER_DEGREE, GeoGridIndex, Lot
+
+
+def scan(lots, lat, lng, radius, min_free=1):
+    """Every lot within radius, by brute force, nearest first"""
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    found = []
+    for lot in lots:
+        distance = math.hypot(lot.lat - lat, (lot.lng - lng) * cos_lat) * METERS_PER_DEGREE
+        if distance <= radius and lot.free >= min_free:
+            found.append((distance, lot.id))
+    return sorted(found)
+
+
+def random_lots(rng, count, lat, lng, spread):
+    return [
+        Lot(f'lot-{i}', '', lat + rng.uniform(-spread, spread), lng + rng.uniform(-spread, spread),
+            capacity=20, free=rng.choice([0, 0, 1, 5, 20]))
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize('center', [(-6.2, 106.8), (51.5, -0.12), (69.6, 18.9), (0.0, 0.0)])
+@pytest.mark.parametrize('min_free', [0, 1, 5])
+def test_nearby_matches_a_full_scan(center, min_free):
+    rng = random.Random(f'{center}:{min_free}')
+    lots = random_lots(rng, 2000, *center, spread=0.2)
+    index = GeoGridIndex(cell_size=0.01)
+    index.load(lots)
+
+    for _ in range(50):
+        lat = center[0] + rng.uniform(-0.25, 0.25)
+        lng = center[1] + rng.uniform(-0.25, 0.25)
+        radius = rng.choice([50, 500, 1500, 4000, 100000])  # The widest walks the occupied cells
+        expected = scan(lots, lat, lng, radius, min_free)
+        result = index.nearby(lat, lng, radius, limit=len(lots), min_free=min_free)
+        assert [(round(d, 3), lot.id) for d, lot in result] == [(round(d, 3), lot_id) for d, lot_id in expected]
+
+        limited = index.nearby(lat, lng, radius, limit=10, min_free=min_free)
+        assert [round(d, 3) for d, _ in limited] == [round(d, 3) for d, _ in expected[:10]]
+
+
+def test_set_free_moves_lots_in_and_out_of_the_available_lists():
+    index = GeoGridIndex()
+    index.load([Lot('a', '', 1.0, 1.0, 10, free=0), Lot('b', '', 1.0001, 1.0, 10, free=3)])
+    assert [lot.id for _, lot in index.nearby(1.0, 1.0, 100)] == ['b']
+
+    assert index.set_free('a', 2)[1] == 0
+    assert index.set_free('b', 0)[1] == 3
+    assert [lot.id for _, lot in index.nearby(1.0, 1.0, 100)] == ['a']
+    assert index.set_free('missing', 1) is None
+    assert index.free == 2
+
+
+def test_set_free_is_clamped_to_capacity():
+    index = GeoGridIndex()
+    index.load([Lot('a', '', 1.0, 1.0, 10)])
+    index.set_free('a', 50)
+    index.set_free('a', -5)
+    assert index.get('a').free == 0
+    assert index.free == 0
+
+
+def test_upsert_moves_a_lot_to_its_new_cell_and_remove_drops_it():
+    index = GeoGridIndex()
+    index.load([Lot('a', '', 1.0, 1.0, 10)])
+    index.upsert(Lot('a', '', 2.0, 2.0, 4))
+    assert index.nearby(1.0, 1.0, 1000) == []
+    assert [lot.id for _, lot in index.nearby(2.0, 2.0, 1000)] == ['a']
+    assert (index.capacity, index.free, len(index)) == (4, 4, 1)
+
+    assert index.remove('a').id == 'a'
+    assert index.nearby(2.0, 2.0, 1000) == []
+    assert (index.capacity, index.free, len(index), index.stats()['cells']) == (0, 0, 0, 0)
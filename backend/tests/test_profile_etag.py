@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.http import parse_etags
+
+from app import profile_etag, profile_not_modified
+from login_writer import LoginWriter
+from user_store import LoginsNotRecorded, SQLiteUserRepository
+
+CREATED = datetime(2024, 5, 1, 8, 0, 0)
+
+
+@pytest.fixture
+def repository(tmp_path):
+    return SQLiteUserRepository(str(tmp_path / 'users.db'))
+
+
+@pytest.fixture
+def user_id(repository):
+    return repository.create({
+        'fullName': 'Ada Park',
+        'email': 'ada@example.com',
+        'phoneNumber': '+6281234567',
+        'password': 'hash',
+        'createdAt': CREATED,
+        'updatedAt': CREATED,
+        'loginCount': 0
+    })
+
+
+def test_etag_is_stable_while_the_document_is_unchanged(repository, user_id):
+    assert profile_etag(user_id, repository.get(user_id)) == profile_etag(user_id, repository.get(user_id))
+    etag = profile_etag(user_id, repository.get(user_id))
+    assert profile_not_modified(parse_etags(etag), profile_etag(user_id, repository.get(user_id)))
+
+
+def test_etag_changes_after_a_login_flush(repository, user_id):
+    before = profile_etag(user_id, repository.get(user_id))
+    writer = LoginWriter(repository, flush_interval=60)
+    writer.record(user_id, CREATED + timedelta(minutes=5))
+    # Buffered, not written yet: the profile has not changed
+    assert profile_etag(user_id, repository.get(user_id)) == before
+
+    flushed = []
+    writer.on_flushed = flushed.extend
+    assert writer.flush() == 1
+    assert flushed == [user_id]
+    after = profile_etag(user_id, repository.get(user_id))
+    assert after != before
+    assert not profile_not_modified(parse_etags(before), after)
+
+
+def test_each_flush_gives_a_new_etag(repository, user_id):
+    writer = LoginWriter(repository, flush_interval=0)  # Writes through on every record()
+    etags = set()
+    for minutes in range(1, 4):
+        writer.record(user_id, CREATED + timedelta(minutes=minutes))
+        etags.add(profile_etag(user_id, repository.get(user_id)))
+    assert len(etags) == 3
+
+
+def test_partial_flush_retries_only_the_unwritten_logins():
+    class HalfWritingStore:
+        def __init__(self):
+            self.calls = []
+
+        def record_logins(self, logins):
+            self.calls.append(dict(logins))
+            if len(self.calls) == 1:
+                raise LoginsNotRecorded({'u2': logins['u2']}, RuntimeError('deadline exceeded'))
+
+    store = HalfWritingStore()
+    writer = LoginWriter(store, flush_interval=60)
+    writer.record('u1', CREATED)
+    writer.record('u2', CREATED)
+    assert writer.flush() == 1
+    assert writer.stats()['pendingUsers'] == 1
+
+    assert writer.flush() == 1
+    assert store.calls[1] == {'u2': (1, CREATED)}
+
+
+def test_logins_of_deleted_users_are_dropped(repository, user_id):
+    writer = LoginWriter(repository, flush_interval=60)
+    writer.record(user_id, CREATED)
+    writer.record('deleted-user', CREATED)
+    assert writer.flush() == 2
+    assert writer.stats()['pendingUsers'] == 0
+    assert repository.get(user_id)['loginCount'] == 1
+
+
+def test_etag_of_documents_without_updated_at_follows_login_count():
+    legacy = {'fullName': 'Ada Park', 'email': 'ada@example.com', 'phoneNumber': '1', 'loginCount': 1}
+    assert profile_etag('u1', legacy) != profile_etag('u1', {**legacy, 'loginCount': 2})
+
+
+def test_etag_changes_when_the_account_is_deactivated(repository, user_id):
+    before = profile_etag(user_id, repository.get(user_id))
+    repository.update(user_id, {'isActive': False})
+    assert profile_etag(user_id, repository.get(user_id)) != before
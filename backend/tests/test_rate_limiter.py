@@ -0,0 +1,80 @@
+import pytest
+
+from rate_limiter import MemoryBucketStore, RateLimiter, SQLiteBucketStore, parse_rate
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBucketStore(shards=4)
+    return SQLiteBucketStore(str(tmp_path / 'ratelimit.db'))
+
+
+def test_parse_rate():
+    assert parse_rate('20/60') == (20, 60.0)
+    assert parse_rate('5') == (5, 60.0)
+    assert parse_rate('0') is None
+    assert parse_rate('') is None
+
+
+def test_burst_up_to_capacity_then_reject(store):
+    clock = Clock()
+    limiter = RateLimiter(store, {'login': (3, 60)}, clock=clock)
+    assert [limiter.check('login', '10.0.0.1') for _ in range(3)] == [0, 0, 0]
+    # One token comes back every 20 seconds
+    assert limiter.check('login', '10.0.0.1') == 20
+    assert limiter.stats()['allowed'] == 3
+    assert limiter.stats()['rejected'] == 1
+
+
+def test_tokens_refill_continuously(store):
+    clock = Clock()
+    limiter = RateLimiter(store, {'login': (3, 60)}, clock=clock)
+    for _ in range(3):
+        limiter.check('login', 'a')
+    clock.now += 10
+    assert limiter.check('login', 'a') == 10  # Half a token so far
+    clock.now += 10
+    assert limiter.check('login', 'a') == 0
+    assert limiter.check('login', 'a') > 0
+
+
+def test_refill_stops_at_capacity(store):
+    clock = Clock()
+    limiter = RateLimiter(store, {'login': (2, 60)}, clock=clock)
+    limiter.check('login', 'a')
+    clock.now += 3600
+    assert [limiter.check('login', 'a') for _ in range(3)] == [0, 0, 30]
+
+
+def test_keys_and_rules_have_separate_buckets(store):
+    limiter = RateLimiter(store, {'login': (1, 60), 'signup': (1, 60)}, clock=Clock())
+    assert limiter.check('login', 'a') == 0
+    assert limiter.check('login', 'b') == 0
+    assert limiter.check('signup', 'a') == 0
+    assert limiter.check('login', 'a') > 0
+
+
+def test_disabled_rule_and_empty_value_are_not_limited():
+    limiter = RateLimiter(rules={'login': None, 'signup': (1, 60)}, clock=Clock())
+    assert all(limiter.check('login', 'a') == 0 for _ in range(5))
+    assert all(limiter.check('signup', '') == 0 for _ in range(5))
+
+
+def test_memory_sweep_drops_fully_refilled_buckets():
+    store = MemoryBucketStore(shards=1, sweep_every=4)
+    store.take('old', 5, 60, 0.0)
+    store.take('recent', 5, 60, 50.0)
+    store.take('recent', 5, 60, 70.0)
+    store.take('new', 5, 60, 70.0)  # Fourth operation: sweeps the shard
+    assert store.size() == 2
+    # A swept bucket starts full again, as it would have refilled anyway
+    assert store.take('old', 5, 60, 71.0) == 0.0
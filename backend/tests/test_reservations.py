@@ -0,0 +1,166 @@
+import random
+import time
+
+import pytest
+
+from parking_index import GeoGridIndex, Lot
+from parking_store import ReservationConflict, SQLiteParkingRepository
+from reservations import CONFIRMED, HELD, Reservation, ReservationEngine, ReservationStateError, SpotSchedule
+
+HOUR = 3600
+
+
+def reservation(start, end, status=CONFIRMED, expires_at=0.0, reservation_id=None):
+    return Reservation(reservation_id or f'r-{start}-{end}', 'lot', '1', 'user', start, end, status, expires_at, 0.0)
+
+
+def overlaps(schedule, start, end, now):
+    """Brute force: active reservations overlapping [start, end)"""
+    return [r for r in schedule.reservations if r.start < end and start < r.end and r.blocks(now)]
+
+
+@pytest.fixture
+def index():
+    index = GeoGridIndex()
+    index.load([Lot('lot', '', 1.0, 1.0, 3)])
+    return index
+
+
+def test_touching_windows_do_not_conflict():
+    schedule = SpotSchedule()
+    schedule.insert(reservation(10, 20))
+    assert schedule.conflict(0, 10, now=0) is None
+    assert schedule.conflict(20, 30, now=0) is None
+    assert schedule.conflict(19, 21, now=0).start == 10
+    assert schedule.conflict(0, 100, now=0).start == 10
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_conflict_matches_a_brute_force_scan(seed):
+    rng = random.Random(seed)
+    now = 1000
+    schedule = SpotSchedule()
+    # Non-overlapping windows, some confirmed, some holds that have run out
+    position = 0
+    while position < 500:
+        start = position + rng.randint(0, 10)
+        end = start + rng.randint(1, 20)
+        expired = rng.random() < 0.3
+        schedule.insert(reservation(start, end, HELD if expired else CONFIRMED, expires_at=now - 1 if expired else 0))
+        position = end
+
+    for _ in range(200):
+        start = rng.randint(0, 520)
+        end = start + rng.randint(1, 40)
+        expected = overlaps(schedule, start, end, now)
+        active = [r for r in schedule.reservations if r.blocks(now)]
+        found = schedule.conflict(start, end, now)
+        if expected:
+            assert found in expected
+        else:
+            assert found is None
+        # Only expired holds are dropped on the way
+        assert all(r in schedule.reservations for r in active)
+
+
+def test_claiming_free_windows_keeps_the_schedule_disjoint():
+    rng = random.Random(7)
+    schedule = SpotSchedule()
+    for _ in range(2000):
+        start = rng.randint(0, 5000)
+        end = start + rng.randint(1, 50)
+        if schedule.conflict(start, end, now=0) is None:
+            schedule.insert(reservation(start, end))
+    windows = [(r.start, r.end) for r in schedule.reservations]
+    assert schedule.starts == sorted(schedule.starts)
+    assert all(previous[1] <= current[0] for previous, current in zip(windows, windows[1:]))
+
+
+def test_remove_only_removes_that_reservation():
+    schedule = SpotSchedule()
+    first, second = reservation(0, 10), reservation(10, 20)
+    schedule.insert(first)
+    schedule.insert(second)
+    schedule.remove(first)
+    schedule.remove(first)
+    assert schedule.reservations == [second]
+
+
+def test_hold_takes_the_next_free_spot_then_conflicts(index):
+    engine = ReservationEngine(index)
+    now = time.time()
+    spots = [engine.hold(f'user-{i}', 'lot', now + HOUR, now + 2 * HOUR, now=now).spot_id for i in range(3)]
+    assert spots == ['1', '2', '3']
+    with pytest.raises(ReservationConflict):
+        engine.hold('user-4', 'lot', now + HOUR, now + 2 * HOUR, now=now)
+    # Other windows on the same spots are still free
+    assert engine.hold('user-4', 'lot', now + 2 * HOUR, now + 3 * HOUR, spot_id='1', now=now).spot_id == '1'
+
+
+def test_hold_rejects_invalid_windows_and_unknown_spots(index):
+    engine = ReservationEngine(index, max_duration=4 * HOUR)
+    now = time.time()
+    with pytest.raises(ValueError):
+        engine.hold('user', 'lot', now + 2 * HOUR, now + HOUR, now=now)
+    with pytest.raises(ValueError):
+        engine.hold('user', 'lot', now + HOUR, now + 6 * HOUR, now=now)
+    with pytest.raises(KeyError):
+        engine.hold('user', 'lot', now + HOUR, now + 2 * HOUR, spot_id='9', now=now)
+    with pytest.raises(KeyError):
+        engine.hold('user', 'other-lot', now + HOUR, now + 2 * HOUR, now=now)
+
+
+def test_confirm_cancel_and_ownership(index):
+    engine = ReservationEngine(index)
+    now = time.time()
+    held = engine.hold('user', 'lot', now + HOUR, now + 2 * HOUR, spot_id='1', now=now)
+    with pytest.raises(KeyError):
+        engine.get(held.id, 'someone-else')
+    assert engine.confirm(held.id, 'user', now=now).status == CONFIRMED
+    assert engine.confirm(held.id, 'user', now=now).status == CONFIRMED  # Idempotent
+    engine.cancel(held.id, 'user', now=now)
+    with pytest.raises(ReservationStateError):
+        engine.confirm(held.id, 'user', now=now)
+    # The cancelled window can be booked again
+    assert engine.hold('other', 'lot', now + HOUR, now + 2 * HOUR, spot_id='1', now=now).spot_id == '1'
+    assert (engine.stats()['held'], engine.stats()['confirmed'], engine.stats()['cancelled']) == (2, 1, 1)
+
+
+def test_expired_hold_frees_its_window(index):
+    engine = ReservationEngine(index, hold_seconds=60)
+    now = time.time()
+    held = engine.hold('user', 'lot', now + HOUR, now + 2 * HOUR, spot_id='1', now=now)
+    later = now + 61
+    with pytest.raises(ReservationStateError):
+        engine.confirm(held.id, 'user', now=later)
+    assert engine.hold('other', 'lot', now + HOUR, now + 2 * HOUR, spot_id='1', now=later).spot_id == '1'
+    assert engine.sweep(now=later) == [held.id]
+    assert engine.stats()['expired'] == 1
+
+
+def test_engines_sharing_a_store_do_not_double_book(index, tmp_path):
+    path = str(tmp_path / 'parking.db')
+    first = ReservationEngine(index, SQLiteParkingRepository(path))
+    second = ReservationEngine(index, SQLiteParkingRepository(path))
+    now = time.time()
+    first.hold('user-1', 'lot', now + HOUR, now + 2 * HOUR, spot_id='1')
+    # The second engine's schedule does not know the hold; the store turns it down
+    with pytest.raises(ReservationConflict):
+        second.hold('user-2', 'lot', now + HOUR, now + 2 * HOUR, spot_id='1')
+    assert second.stats()['storeConflicts'] == 1
+    # ... and it remembers the window, so the next try is answered in memory
+    with pytest.raises(ReservationConflict):
+        second.hold('user-3', 'lot', now + HOUR, now + 2 * HOUR, spot_id='1')
+    assert second.stats()['storeConflicts'] == 1
+    assert second.hold('user-2', 'lot', now + HOUR, now + 2 * HOUR).spot_id == '2'
+
+
+def test_load_restores_active_reservations_from_the_store(index, tmp_path):
+    store = SQLiteParkingRepository(str(tmp_path / 'parking.db'))
+    now = time.time()
+    held = ReservationEngine(index, store).hold('user', 'lot', now + HOUR, now + 2 * HOUR, spot_id='1')
+
+    restarted = ReservationEngine(index, store)
+    assert restarted.load(store.active_reservations()) == 1
+    assert restarted.get(held.id, 'user').status == HELD
+    assert restarted.check_schedules() == []
@@ -0,0 +1,75 @@
+import pytest
+
+from revocation import BloomFilter, RevocationFilter
+
+
+class FakeUserStore:
+    def __init__(self, revoked=()):
+        self.revoked = list(revoked)
+        self.fail = False
+
+    def revoked_users(self):
+        if self.fail:
+            raise RuntimeError('store unavailable')
+        return list(self.revoked)
+
+
+@pytest.fixture
+def make_filter():
+    def make(store):
+        revocation_filter = RevocationFilter(store, sync_interval=3600)
+        # The background thread exits at once; tests sync explicitly
+        revocation_filter.stop()
+        return revocation_filter
+
+    return make
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    members = [f'user-{i}' for i in range(1000)]
+    for member in members:
+        bloom.add(member)
+    assert all(member in bloom for member in members)
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_false_positive_rate_is_near_target():
+    bloom = BloomFilter(1000, false_positive_rate=0.01)
+    for i in range(1000):
+        bloom.add(f'user-{i}')
+    false_positives = sum(f'other-{i}' in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.03
+
+
+def test_unsynced_filter_sends_everyone_to_the_store(make_filter):
+    revocation_filter = make_filter(FakeUserStore())
+    assert not revocation_filter.ready
+    assert revocation_filter.might_be_revoked('anyone')
+
+
+def test_sync_marks_revoked_users_only(make_filter):
+    revocation_filter = make_filter(FakeUserStore(['revoked-1', 'revoked-2']))
+    assert revocation_filter.sync()
+    assert revocation_filter.might_be_revoked('revoked-1')
+    assert revocation_filter.might_be_revoked('revoked-2')
+    assert not revocation_filter.might_be_revoked('active')
+    assert revocation_filter.stats()['fastPath'] == 1
+
+
+def test_failed_sync_keeps_the_previous_filter(make_filter):
+    store = FakeUserStore(['revoked'])
+    revocation_filter = make_filter(store)
+    revocation_filter.sync()
+    store.fail = True
+    assert not revocation_filter.sync()
+    assert revocation_filter.might_be_revoked('revoked')
+    assert not revocation_filter.might_be_revoked('active')
+    assert revocation_filter.stats()['syncErrors'] == 1
+
+
+def test_stale_filter_sends_everyone_to_the_store(make_filter):
+    revocation_filter = make_filter(FakeUserStore())
+    revocation_filter.sync()
+    revocation_filter.synced_at -= revocation_filter.sync_interval * 3 + 1
+    assert revocation_filter.might_be_revoked('active')
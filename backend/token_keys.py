@@ -0,0 +1,150 @@
+"""
+Signing keys for the API's own JWTs.
+
+By default tokens are signed with HS256 and the shared JWT_SECRET, which
+means only this service can check them and every other service has to call
+/api/auth/verify. With a key directory configured, tokens are signed with an
+asymmetric key (RS256 for RSA keys, EdDSA for Ed25519 keys) and carry a
+`kid` header; the public halves are published at /.well-known/jwks.json so
+downstream services verify tokens locally.
+
+Key directory layout: one PEM private key per file, named `<kid>.pem`.
+Every key in the directory is accepted for verification; the active one
+(JWT_ACTIVE_KID, or the last file name in sort order) signs new tokens.
+Rotation: add the new key, deploy and wait for the JWKS max-age so
+downstream caches know it, switch JWT_ACTIVE_KID, and remove the old key
+once the last token signed with it has expired.
+
+PyJWT imports `cryptography` along with itself, about 50 ms together, so
+both are imported on first use: when keys are loaded from a configured
+directory, or when the first token is signed or verified (app.py does that
+during warm-up).
+"""
+
+import json
+import os
+
+
+def _algorithm_for(private_key):
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return 'RS256'
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return 'EdDSA'
+    raise ValueError(f'Unsupported signing key type: {type(private_key).__name__}')
+
+
+def _public_jwk(kid, algorithm, public_key):
+    import jwt
+
+    if algorithm == 'RS256':
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(public_key))
+    else:
+        jwk = json.loads(jwt.algorithms.OKPAlgorithm.to_jwk(public_key))
+    jwk.update({'kid': kid, 'alg': algorithm, 'use': 'sig'})
+    return jwk
+
+
+def generate_signing_key(keys_dir, kid, key_type='rsa'):
+    """Create `<kid>.pem` in keys_dir and return its path"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if key_type == 'ed25519':
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    os.makedirs(keys_dir, exist_ok=True)
+    path = os.path.join(keys_dir, f'{kid}.pem')
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(pem)
+    return path
+
+
+class TokenKeyRing:
+    """Signs and verifies API tokens (HS256 secret, or asymmetric keys by kid)"""
+
+    def __init__(self, secret, keys_dir=None, active_kid=None, accept_legacy_hs256=True):
+        self.secret = secret
+        self.accept_legacy_hs256 = accept_legacy_hs256
+        self._private_keys = {}
+        self._public_keys = {}
+        self._algorithms = {}
+        self.active_kid = None
+
+        if keys_dir and os.path.isdir(keys_dir):
+            for filename in sorted(os.listdir(keys_dir)):
+                if filename.endswith('.pem'):
+                    self._load(filename[:-4], os.path.join(keys_dir, filename))
+            if self._private_keys:
+                self.active_kid = active_kid or sorted(self._private_keys)[-1]
+                if self.active_kid not in self._private_keys:
+                    raise ValueError(f"JWT_ACTIVE_KID '{self.active_kid}' not found in {keys_dir}")
+
+        self._jwks = {'keys': [
+            _public_jwk(kid, self._algorithms[kid], public_key)
+            for kid, public_key in self._public_keys.items()
+        ]}
+        # Serialized once; the JWKS endpoint is hit by every downstream cache refresh
+        self.jwks_json = json.dumps(self._jwks, separators=(',', ':'))
+
+    def _load(self, kid, path):
+        from cryptography.hazmat.primitives import serialization
+
+        with open(path, 'rb') as f:
+            private_key = serialization.load_pem_private_key(f.read(), password=None)
+        self._algorithms[kid] = _algorithm_for(private_key)
+        self._private_keys[kid] = private_key
+        self._public_keys[kid] = private_key.public_key()
+
+    @property
+    def algorithm(self):
+        return self._algorithms[self.active_kid] if self.active_kid else 'HS256'
+
+    def jwks(self):
+        return self._jwks
+
+    def encode(self, payload):
+        import jwt
+
+        if self.active_kid is None:
+            return jwt.encode(payload, self.secret, algorithm='HS256')
+        return jwt.encode(
+            payload,
+            self._private_keys[self.active_kid],
+            algorithm=self.algorithm,
+            headers={'kid': self.active_kid}
+        )
+
+    def decode(self, token):
+        """Verify a token and return its claims (raises jwt.InvalidTokenError)"""
+        import jwt
+
+        header = jwt.get_unverified_header(token)
+        kid = header.get('kid')
+
+        if kid is None:
+            # Tokens issued before asymmetric signing was enabled
+            if self.active_kid is not None and not self.accept_legacy_hs256:
+                raise jwt.InvalidTokenError('Token has no key id')
+            return jwt.decode(token, self.secret, algorithms=['HS256'])
+
+        public_key = self._public_keys.get(kid)
+        if public_key is None:
+            raise jwt.InvalidTokenError(f'Unknown key id: {kid}')
+        return jwt.decode(token, public_key, algorithms=[self._algorithms[kid]])
+
+    def stats(self):
+        return {
+            'algorithm': self.algorithm,
+            'activeKid': self.active_kid,
+            'keys': sorted(self._public_keys)
+        }
@@ -0,0 +1,96 @@
+"""
+In-process cache for user documents.
+
+The mobile app re-verifies its token on almost every screen, so
+/api/auth/verify and /api/auth/profile keep reading the same handful of
+user documents. This cache keeps recently used documents in memory for a
+short time so most of those requests never reach Firestore.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """Bounded TTL + LRU cache of user documents keyed by user_id"""
+
+    def __init__(self, max_size=10000, ttl=60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, user_id):
+        """Return a copy of the cached user document, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, user_data = entry
+            if expires_at <= self._clock():
+                del self._entries[user_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+
+        # Callers are free to mutate what they get back
+        return copy.copy(user_data)
+
+    def set(self, user_id, user_data):
+        """Store a user document, evicting the least recently used entries"""
+        if not self.enabled:
+            return
+
+        entry = (self._clock() + self.ttl, copy.copy(user_data))
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        """Drop a user document after it has been written"""
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for the health endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'ttlSeconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,594 @@
+"""
+User storage backends.
+
+The auth routes only talk to a UserRepository, so the service can run on
+Firestore in production or on a local SQLite file (edge deployments, load
+tests, development without Firebase credentials). The async serving mode
+(asgi.py) uses the coroutine versions at the bottom of this module.
+
+User documents are plain dicts shaped like the Firestore documents
+('fullName', 'email', 'createdAt', ...), with datetimes as datetime objects.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+import weakref
+from abc import ABC, abstractmethod
+from datetime import datetime
+from urllib.parse import quote
+
+# firebase_admin and google.api_core are imported inside the Firestore
+# repositories: they take hundreds of milliseconds to import, and SQLite
+# deployments and tools that only import this module never need them
+
+logger = logging.getLogger(__name__)
+
+
+class EmailAlreadyRegistered(Exception):
+    """Raised by create() when another user already has this email"""
+
+
+class LoginsNotRecorded(Exception):
+    """Raised by record_logins() after a partial write, with the logins that were not applied"""
+
+    def __init__(self, logins, error):
+        super().__init__(str(error))
+        self.logins = logins
+
+
+class UserRepository(ABC):
+    """Storage interface used by the auth routes; a backend missing a method fails at construction"""
+
+    name = 'base'
+
+    @abstractmethod
+    def get(self, user_id):
+        """Return the user document as a dict, or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_many(self, user_ids):
+        """Return {user_id: user_data} for the ids that exist, in one read"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_by_email(self, email):
+        """Return (user_id, user_data) for an email, or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def create(self, user_data):
+        """Store a new user and return its id (raises EmailAlreadyRegistered)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, user_id, fields):
+        """Merge fields into an existing user document"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def record_logins(self, logins):
+        """
+        Apply buffered logins: {user_id: (count, last_login)} (see LoginWriter).
+
+        Logins of users that no longer exist are dropped. Raises
+        LoginsNotRecorded with the rest if only part of them was written;
+        any other exception means none were.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def revoked_users(self):
+        """Ids of users that are deactivated or have revoked tokens (tokenVersion > 0)"""
+        raise NotImplementedError
+
+    def backfill_email_index(self):
+        """Build the email index for existing users; None if the backend needs none"""
+        return None
+
+
+def _email_key(email):
+    """Firestore document id for an email ('/' is not allowed in ids)"""
+    return quote(email, safe='@+')
+
+
+class FirestoreUserRepository(UserRepository):
+    """
+    Users stored in the Firestore 'users' collection.
+
+    A second collection, 'user_emails', maps each email to its user id
+    (document id = email). Email lookups are point reads instead of a
+    where('email', '==', ...) query, and because the index entry is created
+    in the same atomic batch as the user, a second signup for the same email
+    fails instead of creating a duplicate account.
+    """
+
+    name = 'firestore'
+
+    def __init__(self, db, collection='users', email_collection='user_emails'):
+        self.db = db
+        self.users_ref = db.collection(collection)
+        self.emails_ref = db.collection(email_collection)
+
+    def get(self, user_id):
+        user_doc = self.users_ref.document(user_id).get()
+        if not user_doc.exists:
+            return None
+        return user_doc.to_dict()
+
+    def get_many(self, user_ids):
+        user_refs = [self.users_ref.document(user_id) for user_id in user_ids]
+        return {
+            user_doc.id: user_doc.to_dict()
+            for user_doc in self.db.get_all(user_refs)
+            if user_doc.exists
+        }
+
+    def find_by_email(self, email):
+        index_doc = self.emails_ref.document(_email_key(email)).get()
+        if not index_doc.exists:
+            return None
+
+        user_id = index_doc.get('userId')
+        user_data = self.get(user_id)
+        if user_data is None:
+            return None
+        return user_id, user_data
+
+    def create(self, user_data):
+        from google.api_core.exceptions import AlreadyExists
+
+        email_ref = self.emails_ref.document(_email_key(user_data['email']))
+        for attempt in range(2):
+            user_ref = self.users_ref.document()
+            batch = self.db.batch()
+            # create() fails the whole batch if the email is already indexed
+            batch.create(email_ref, {'userId': user_ref.id})
+            batch.create(user_ref, user_data)
+            try:
+                batch.commit()
+                return user_ref.id
+            except AlreadyExists:
+                # An entry left behind by a deleted user is released once, then retried
+                if attempt or not self._release_stale_email(email_ref):
+                    raise EmailAlreadyRegistered(user_data['email'])
+
+    def _release_stale_email(self, email_ref):
+        """Delete an index entry whose user no longer exists; True if the email is free"""
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def _release(transaction):
+            index_doc = email_ref.get(transaction=transaction)
+            if not index_doc.exists:
+                return True
+            user_id = index_doc.get('userId')
+            if self.users_ref.document(user_id).get(transaction=transaction).exists:
+                return False
+            transaction.delete(email_ref)
+            logger.warning(f"Removed stale email index entry {email_ref.id} (user {user_id} is gone)")
+            return True
+
+        return _release(self.db.transaction())
+
+    def update(self, user_id, fields):
+        if 'email' not in fields:
+            self.users_ref.document(user_id).update(fields)
+            return
+
+        from firebase_admin import firestore
+
+        # Changing the email moves its index entry in the same transaction
+        user_ref = self.users_ref.document(user_id)
+        new_email_ref = self.emails_ref.document(_email_key(fields['email']))
+
+        @firestore.transactional
+        def _move_email(transaction):
+            old_email = user_ref.get(transaction=transaction).get('email')
+            if old_email != fields['email']:
+                if new_email_ref.get(transaction=transaction).exists:
+                    raise EmailAlreadyRegistered(fields['email'])
+                transaction.delete(self.emails_ref.document(_email_key(old_email)))
+                transaction.create(new_email_ref, {'userId': user_id})
+            transaction.update(user_ref, fields)
+
+        _move_email(self.db.transaction())
+
+    def record_logins(self, logins, batch_size=500):
+        from google.api_core.exceptions import NotFound
+
+        items = list(logins.items())
+        for start in range(0, len(items), batch_size):
+            chunk = dict(items[start:start + batch_size])
+            try:
+                try:
+                    self._commit_logins(chunk)
+                except NotFound:
+                    # update() fails the whole batch for a deleted user: drop those and retry
+                    existing = self.get_many(chunk)
+                    for user_id in chunk.keys() - existing.keys():
+                        logger.warning(f"Dropping buffered logins of deleted user {user_id}")
+                    chunk = {user_id: login for user_id, login in chunk.items() if user_id in existing}
+                    if chunk:
+                        self._commit_logins(chunk)
+            except Exception as e:
+                if not start:
+                    raise
+                # Earlier chunks are committed; retrying them would count their logins twice
+                raise LoginsNotRecorded(dict(items[start:]), e) from e
+
+    def _commit_logins(self, logins):
+        from firebase_admin import firestore
+
+        # Atomic increments, so logins flushed by other workers are never lost
+        batch = self.db.batch()
+        for user_id, (count, last_login) in logins.items():
+            batch.update(self.users_ref.document(user_id), {
+                'loginCount': firestore.Increment(count),
+                'lastLogin': last_login,
+                'updatedAt': last_login
+            })
+        batch.commit()
+
+    def revoked_users(self):
+        user_ids = set()
+        for query in (self.users_ref.where('isActive', '==', False),
+                      self.users_ref.where('tokenVersion', '>', 0)):
+            # select([]) returns document ids only
+            for user_doc in query.select([]).stream():
+                user_ids.add(user_doc.id)
+        return user_ids
+
+    def backfill_email_index(self, page_size=300):
+        """Create missing 'user_emails' entries for users created before the index, drop stale ones"""
+        counts = {'scanned': 0, 'created': 0, 'existing': 0, 'duplicates': 0, 'stale': 0}
+        # Stale entries go first, so a remaining user with the same email gets indexed below
+        counts['stale'] = self._remove_stale_emails(page_size)
+        last_doc = None
+
+        while True:
+            query = self.users_ref.order_by('__name__').limit(page_size)
+            if last_doc is not None:
+                query = query.start_after(last_doc)
+            user_docs = list(query.stream())
+            if not user_docs:
+                break
+            last_doc = user_docs[-1]
+
+            users_by_key = {}
+            for user_doc in user_docs:
+                counts['scanned'] += 1
+                email = (user_doc.to_dict() or {}).get('email')
+                if not email:
+                    continue
+                key = _email_key(email)
+                if key in users_by_key:
+                    counts['duplicates'] += 1
+                    logger.warning(f"Duplicate email {email}: {users_by_key[key]} and {user_doc.id}")
+                    continue
+                users_by_key[key] = user_doc.id
+            if not users_by_key:
+                continue
+
+            email_refs = [self.emails_ref.document(key) for key in users_by_key]
+            batch = self.db.batch()
+            pending = 0
+            for index_doc in self.db.get_all(email_refs):
+                user_id = users_by_key[index_doc.id]
+                if index_doc.exists:
+                    if index_doc.get('userId') == user_id:
+                        counts['existing'] += 1
+                    else:
+                        counts['duplicates'] += 1
+                        logger.warning(f"Duplicate email {index_doc.id}: {index_doc.get('userId')} and {user_id}")
+                    continue
+                batch.set(index_doc.reference, {'userId': user_id})
+                pending += 1
+            if pending:
+                batch.commit()
+                counts['created'] += pending
+
+        return counts
+
+    def _remove_stale_emails(self, page_size):
+        """Delete index entries pointing at users that no longer exist"""
+        removed = 0
+        last_doc = None
+
+        while True:
+            query = self.emails_ref.order_by('__name__').limit(page_size)
+            if last_doc is not None:
+                query = query.start_after(last_doc)
+            index_docs = list(query.stream())
+            if not index_docs:
+                break
+            last_doc = index_docs[-1]
+
+            user_refs = [self.users_ref.document(index_doc.get('userId')) for index_doc in index_docs]
+            existing = {user_doc.id for user_doc in self.db.get_all(user_refs) if user_doc.exists}
+            for index_doc in index_docs:
+                # Re-checked in a transaction: the user may have signed up again meanwhile
+                if index_doc.get('userId') not in existing and self._release_stale_email(index_doc.reference):
+                    removed += 1
+
+        return removed
+
+
+# SQL is kept in constants so sqlite3's per-connection statement cache
+# reuses the prepared statements across requests
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS users ('
+    ' id TEXT PRIMARY KEY,'
+    ' email TEXT NOT NULL,'
+    ' data TEXT NOT NULL'
+    ')',
+    'CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email)',
+)
+_SELECT_BY_ID = 'SELECT data FROM users WHERE id = ?'
+_SELECT_MANY = 'SELECT id, data FROM users WHERE id IN (SELECT value FROM json_each(?))'
+_SELECT_BY_EMAIL = 'SELECT id, data FROM users WHERE email = ?'
+_INSERT = 'INSERT INTO users (id, email, data) VALUES (?, ?, ?)'
+_UPDATE = 'UPDATE users SET email = ?, data = ? WHERE id = ?'
+_SELECT_REVOKED = (
+    "SELECT id FROM users"
+    " WHERE json_extract(data, '$.isActive') = 0"
+    " OR json_extract(data, '$.tokenVersion') > 0"
+)
+
+_DATETIME_TAG = '$datetime'
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {_DATETIME_TAG: value.isoformat()}
+    raise TypeError(f'Cannot store {type(value).__name__} in a user document')
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and _DATETIME_TAG in obj:
+        return datetime.fromisoformat(obj[_DATETIME_TAG])
+    return obj
+
+
+def _dumps(user_data):
+    return json.dumps(user_data, default=_encode_value, separators=(',', ':'))
+
+
+def _loads(data):
+    return json.loads(data, object_hook=_decode_object)
+
+
+class SQLiteDatabase:
+    """Per-thread connections to one SQLite file in WAL mode (base of the SQLite repositories)"""
+
+    schema = ()
+    scratch_name = 'smartparking.db'
+
+    def __init__(self, path='smartparking.db', timeout=5.0):
+        if path == ':memory:':
+            # Throwaway database file, on tmpfs where available. Shared-cache
+            # in-memory databases use table locks that fail immediately
+            # (no busy timeout) as soon as two threads write.
+            scratch = tempfile.mkdtemp(prefix='smartparking-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+            weakref.finalize(self, shutil.rmtree, scratch, True)
+            self._target = os.path.join(scratch, self.scratch_name)
+        else:
+            self._target = path
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._anchor = self._connect()
+        for statement in self.schema:
+            self._anchor.execute(statement)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self._target,
+            timeout=self.timeout,
+            isolation_level=None,  # Explicit BEGIN/COMMIT where needed
+            check_same_thread=False,
+            cached_statements=64
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @property
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+
+class SQLiteUserRepository(SQLiteDatabase, UserRepository):
+    """Users stored in a local SQLite database (WAL mode, unique email index)"""
+
+    name = 'sqlite'
+    schema = _SCHEMA
+    scratch_name = 'users.db'
+
+    def get(self, user_id):
+        row = self._conn.execute(_SELECT_BY_ID, (user_id,)).fetchone()
+        return _loads(row[0]) if row else None
+
+    def get_many(self, user_ids):
+        # One statement for any number of ids: they are passed as a JSON array
+        rows = self._conn.execute(_SELECT_MANY, (json.dumps(list(user_ids)),))
+        return {user_id: _loads(data) for user_id, data in rows}
+
+    def find_by_email(self, email):
+        row = self._conn.execute(_SELECT_BY_EMAIL, (email,)).fetchone()
+        return (row[0], _loads(row[1])) if row else None
+
+    def create(self, user_data):
+        user_id = uuid.uuid4().hex
+        try:
+            self._conn.execute(_INSERT, (user_id, user_data['email'], _dumps(user_data)))
+        except sqlite3.IntegrityError:
+            raise EmailAlreadyRegistered(user_data['email'])
+        return user_id
+
+    def update(self, user_id, fields):
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(_SELECT_BY_ID, (user_id,)).fetchone()
+            if row is None:
+                raise KeyError(f'User {user_id} not found')
+            user_data = _loads(row[0])
+            user_data.update(fields)
+            conn.execute(_UPDATE, (user_data['email'], _dumps(user_data), user_id))
+        except sqlite3.IntegrityError:
+            conn.execute('ROLLBACK')
+            raise EmailAlreadyRegistered(fields.get('email'))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def revoked_users(self):
+        return {row[0] for row in self._conn.execute(_SELECT_REVOKED)}
+
+    def record_logins(self, logins):
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for user_id, (count, last_login) in logins.items():
+                row = conn.execute(_SELECT_BY_ID, (user_id,)).fetchone()
+                if row is None:
+                    continue
+                user_data = _loads(row[0])
+                user_data['loginCount'] = user_data.get('loginCount', 0) + count
+                if not user_data.get('lastLogin') or user_data['lastLogin'] < last_login:
+                    user_data['lastLogin'] = last_login
+                user_data['updatedAt'] = last_login
+                conn.execute(_UPDATE, (user_data['email'], _dumps(user_data), user_id))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+class AsyncFirestoreUserRepository:
+    """FirestoreUserRepository on Firestore's async client (async serving mode)"""
+
+    name = 'firestore-async'
+
+    def __init__(self, async_db, collection='users', email_collection='user_emails'):
+        self.db = async_db
+        self.users_ref = async_db.collection(collection)
+        self.emails_ref = async_db.collection(email_collection)
+
+    async def get(self, user_id):
+        user_doc = await self.users_ref.document(user_id).get()
+        if not user_doc.exists:
+            return None
+        return user_doc.to_dict()
+
+    async def get_many(self, user_ids):
+        user_refs = [self.users_ref.document(user_id) for user_id in user_ids]
+        users = {}
+        async for user_doc in self.db.get_all(user_refs):
+            if user_doc.exists:
+                users[user_doc.id] = user_doc.to_dict()
+        return users
+
+    async def find_by_email(self, email):
+        index_doc = await self.emails_ref.document(_email_key(email)).get()
+        if not index_doc.exists:
+            return None
+
+        user_id = index_doc.get('userId')
+        user_data = await self.get(user_id)
+        if user_data is None:
+            return None
+        return user_id, user_data
+
+    async def create(self, user_data):
+        from google.api_core.exceptions import AlreadyExists
+
+        email_ref = self.emails_ref.document(_email_key(user_data['email']))
+        for attempt in range(2):
+            user_ref = self.users_ref.document()
+            batch = self.db.batch()
+            batch.create(email_ref, {'userId': user_ref.id})
+            batch.create(user_ref, user_data)
+            try:
+                await batch.commit()
+                return user_ref.id
+            except AlreadyExists:
+                if attempt or not await self._release_stale_email(email_ref):
+                    raise EmailAlreadyRegistered(user_data['email'])
+
+    async def _release_stale_email(self, email_ref):
+        from google.cloud.firestore import async_transactional
+
+        # Same transaction as FirestoreUserRepository._release_stale_email
+        @async_transactional
+        async def _release(transaction):
+            index_doc = await email_ref.get(transaction=transaction)
+            if not index_doc.exists:
+                return True
+            user_id = index_doc.get('userId')
+            if (await self.users_ref.document(user_id).get(transaction=transaction)).exists:
+                return False
+            transaction.delete(email_ref)
+            logger.warning(f"Removed stale email index entry {email_ref.id} (user {user_id} is gone)")
+            return True
+
+        return await _release(self.db.transaction())
+
+    async def update(self, user_id, fields):
+        if 'email' not in fields:
+            await self.users_ref.document(user_id).update(fields)
+            return
+
+        from google.cloud.firestore import async_transactional
+
+        # Same transaction as FirestoreUserRepository.update, on an AsyncTransaction
+        user_ref = self.users_ref.document(user_id)
+        new_email_ref = self.emails_ref.document(_email_key(fields['email']))
+
+        @async_transactional
+        async def _move_email(transaction):
+            old_email = (await user_ref.get(transaction=transaction)).get('email')
+            if old_email != fields['email']:
+                if (await new_email_ref.get(transaction=transaction)).exists:
+                    raise EmailAlreadyRegistered(fields['email'])
+                transaction.delete(self.emails_ref.document(_email_key(old_email)))
+                transaction.create(new_email_ref, {'userId': user_id})
+            transaction.update(user_ref, fields)
+
+        await _move_email(self.db.transaction())
+
+
+class ThreadedAsyncUserRepository:
+    """Async facade over a blocking repository (e.g. SQLite) using worker threads"""
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.name = f'{repository.name}-threaded'
+
+    async def get(self, user_id):
+        return await asyncio.to_thread(self.repository.get, user_id)
+
+    async def get_many(self, user_ids):
+        return await asyncio.to_thread(self.repository.get_many, user_ids)
+
+    async def find_by_email(self, email):
+        return await asyncio.to_thread(self.repository.find_by_email, email)
+
+    async def create(self, user_data):
+        return await asyncio.to_thread(self.repository.create, user_data)
+
+    async def update(self, user_id, fields):
+        return await asyncio.to_thread(self.repository.update, user_id, fields)
@@ -22,6 +22,14 @@ const API_CONFIG = {
     VERIFY_TOKEN: "/auth/verify", // POST /api/auth/verify
     PROFILE: "/auth/profile", // GET /api/auth/profile
     UPDATE_PROFILE: "/auth/profile", // PUT /api/auth/profile (future)
+    PARKING_NEARBY: "/parking/nearby", // GET /api/parking/nearby?lat=&lng=&radius=
+    PARKING_STREAM: "/parking/stream", // GET /api/parking/stream?lot=&lat=&lng=&ticket= (server-sent events)
+    PARKING_STREAM_TICKET: "/parking/stream/ticket", // POST, bearer token -> { ticket, expiresIn } for EventSource
+    PARKING_HISTORY: "/parking/history", // GET /api/parking/history?lot=&from=&to=
+    PARKING_HISTORY_AGGREGATE: "/parking/history/aggregate", // GET /api/parking/history/aggregate?lot=&from=&to=
+    PARKING_FORECAST: "/parking/forecast", // GET /api/parking/forecast?lot=&eta=
+    RESERVATIONS: "/reservations", // POST /api/reservations {lot, spot?, start, end}; GET/DELETE /api/reservations/<id>
+    RESERVATION_CONFIRM: "/confirm", // POST /api/reservations/<id>/confirm (appended to RESERVATIONS/<id>)
   },
 
   // All possible URLs for testing